@@ -0,0 +1,64 @@
+"""Compare the throughput and ratio of the compression policies on a CSV export.
+
+Only the compression is timed, so the numbers tell how fast uploads can be fed: pick the fastest level that keeps up
+with the bandwidth to S3. Usage::
+
+    python benchmarks/compression.py [rows]
+"""
+import io
+import random
+import sys
+import time
+
+from efs.compression import GZIP
+from efs.compression import ZSTD
+from efs.compression import CompressionPolicy
+from efs.compression import decompress
+from efs.compression import zstandard
+from efs.streaming import DEFAULT_PART_SIZE
+from efs.streaming import iter_chunks
+
+LEVELS = {GZIP: (1, 6, 9), ZSTD: (1, 3, 10)}
+
+
+def export(rows):
+    """Return a CSV export of ``rows`` orders."""
+    rng = random.Random(0)
+    cities = ["Berlin", "London", "Lisbon", "Paris", "Amsterdam", "Madrid"]
+    lines = ["id,customer,city,amount,created_at\n"]
+    for number in range(rows):
+        lines.append(
+            "{},customer-{},{},{:.2f},2018-{:02}-{:02}T{:02}:{:02}:00Z\n".format(
+                number, rng.randrange(100000), rng.choice(cities), rng.uniform(5, 500), rng.randint(1, 12),
+                rng.randint(1, 28), rng.randrange(24), rng.randrange(60)
+            )
+        )
+    return "".join(lines).encode()
+
+
+def run(rows):
+    """Compress and decompress the export with every encoding and level and print the results."""
+    content = export(rows)
+    print("{} rows, {:.1f} MiB".format(rows, len(content) / 1024 ** 2))
+    for encoding, levels in LEVELS.items():
+        if encoding == ZSTD and zstandard is None:
+            print("zstd skipped, install zstandard")
+            continue
+        for level in levels:
+            policy = CompressionPolicy(encoding, level)
+            started = time.perf_counter()
+            compressed = b"".join(policy.compress(iter_chunks(content, DEFAULT_PART_SIZE)))
+            compressing = time.perf_counter() - started
+            started = time.perf_counter()
+            assert decompress(io.BytesIO(compressed), encoding).read() == content
+            decompressing = time.perf_counter() - started
+            print(
+                "{:<4} level={:<2} ratio={:5.2f} compress MiB/s={:7.1f} decompress MiB/s={:7.1f}".format(
+                    encoding, level, len(content) / len(compressed), len(content) / compressing / 1024 ** 2,
+                    len(content) / decompressing / 1024 ** 2
+                )
+            )
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 500000)
@@ -0,0 +1,63 @@
+"""Compare the upload throughput and stored bytes of ``EFS.upload`` with and without ``dedup``.
+
+A share of the files (``duplicates``, 0.7 by default) are copies of a few templates, like logos or PDF templates
+uploaded for every customer, the others are unique. Runs against moto, so the throughput does not include the
+network, only the hashing and client side overhead. Usage::
+
+    python benchmarks/dedup_uploads.py [uploads] [duplicates] [size]
+"""
+import os
+import random
+import sys
+import time
+from collections import Counter
+
+import boto3
+from flask import Flask
+from moto import mock_s3
+
+from efs import EFS
+
+TEMPLATES = 10
+
+
+def count_requests(efs):
+    """Return a counter of the S3 API calls made by ``efs``."""
+    calls = Counter()
+    efs.home.client.meta.events.register("before-call.s3", lambda model, **kwargs: calls.update([model.name]))
+    return calls
+
+
+def run(uploads, duplicates, size):
+    """Upload ``uploads`` files of ``size`` bytes with both modes and print the results."""
+    app = Flask(__name__)
+    app.config["S3_BUCKET"] = "bucket"
+    templates = [os.urandom(size) for _ in range(TEMPLATES)]
+    rng = random.Random(0)
+    contents = [rng.choice(templates) if rng.random() < duplicates else os.urandom(size) for _ in range(uploads)]
+    with app.app_context(), mock_s3():
+        bucket = boto3.resource("s3").Bucket("bucket")
+        bucket.create()
+        for dedup in (False, True):
+            efs = EFS(storage="s3", fast_upload=True, dedup=dedup)
+            calls = count_requests(efs)
+            started = time.perf_counter()
+            for number, content in enumerate(contents):
+                efs.upload("customers/{}/document.pdf".format(number), content)
+            elapsed = time.perf_counter() - started
+            stored = sum(obj.size for obj in bucket.objects.all())
+            print(
+                "dedup={!s:<5} MiB/s={:7.1f} stored MiB={:7.1f} requests/upload={:4.1f} {}".format(
+                    dedup, uploads * size / elapsed / 1024 ** 2, stored / 1024 ** 2, sum(calls.values()) / uploads,
+                    dict(calls)
+                )
+            )
+            bucket.objects.all().delete()
+
+
+if __name__ == "__main__":
+    run(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 200,
+        float(sys.argv[2]) if len(sys.argv) > 2 else 0.7,
+        int(sys.argv[3]) if len(sys.argv) > 3 else 256 * 1024,
+    )
@@ -0,0 +1,46 @@
+"""Compare building S3 file urls by signing each of them with the precomputed public url builder.
+
+Usage::
+
+    python benchmarks/file_urls.py [urls]
+"""
+import sys
+import time
+import urllib.parse
+
+from flask import Flask
+from moto import mock_s3
+
+from efs import EFS
+
+
+def signed_file_url(efs, path, cdn_host):
+    """Build a file url the way EFS.file_url did before urls were precomputed."""
+    url = efs.home.geturl(path)
+    if cdn_host:
+        url = url.replace(urllib.parse.urlparse(url).hostname, cdn_host)
+    return url.split("?")[0].replace("http://", "https://")
+
+
+def run(count):
+    """Build ``count`` urls with each method and print how long it took."""
+    app = Flask(__name__)
+    app.config["S3_BUCKET"] = "bucket"
+    app.config["S3_CDN_URL"] = "cdn.example.com"
+    paths = ["products/{}/image {}.jpg".format(number % 50, number) for number in range(count)]
+    with app.app_context(), mock_s3():
+        efs = EFS(storage="s3")
+        efs.file_url(paths[0])
+        for name, build in (
+            ("signed", lambda: [signed_file_url(efs, path, "cdn.example.com") for path in paths]),
+            ("file_url", lambda: [efs.file_url(path) for path in paths]),
+            ("file_urls", lambda: efs.file_urls(paths)),
+        ):
+            started = time.perf_counter()
+            build()
+            elapsed = time.perf_counter() - started
+            print("{:<10} {:8.2f} us/url {:8.0f} urls/s".format(name, elapsed * 1e6 / count, count / elapsed))
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
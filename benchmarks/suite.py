@@ -0,0 +1,179 @@
+"""Benchmark the EFS operations on the local and S3 backends, across object sizes and counts.
+
+For every backend and size, files are uploaded, opened and read, given a url, moved and removed. Each operation
+reports its throughput, latency percentiles, S3 requests per call (counted by the :mod:`efs.metrics` hooks) and the
+peak memory allocated while it ran (tracemalloc). S3 runs against moto, which keeps objects in memory, so S3 uploads
+also count the stored bytes and timings only show the client side overhead.
+
+Results can be saved with ``--json`` and compared to a previous run with ``--baseline``: the run fails if an
+operation got slower than ``--tolerance`` allows or sends more requests. Usage::
+
+    python benchmarks/suite.py [--backends local s3] [--sizes 1K 1M 64M 1G] [--count 50] [--budget 256M]
+                               [--json results.json] [--baseline previous.json] [--tolerance 0.5]
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import boto3
+from flask import Flask
+from moto import mock_s3
+
+from efs import EFS
+
+UNITS = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+CHUNK_SIZE = 1024 * 1024
+OPERATIONS = ("upload", "open+read", "file_url", "move", "remove")
+
+
+def parse_size(text):
+    """Return the number of bytes of a size like ``64M``."""
+    unit = text[-1].upper()
+    return int(text[:-1]) * UNITS[unit] if unit in UNITS else int(text)
+
+
+def content(size, chunk):
+    """Yield ``size`` bytes made of ``chunk``, without holding them all in memory."""
+    for start in range(0, size, len(chunk)):
+        yield chunk[: size - start]
+
+
+def percentile(timings, fraction):
+    """Return the ``fraction`` percentile of ``timings``."""
+    ordered = sorted(timings)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def measure(efs, operation, calls, size):
+    """Run every call of ``calls`` and return the statistics of ``operation``."""
+    records = []
+    efs.hooks[:] = [records.append]
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    for call in calls:
+        call()
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1] - baseline
+    tracemalloc.stop()
+    efs.hooks[:] = []
+    timings = [record.seconds for record in records]
+    return {
+        "operation": operation,
+        "size": size,
+        "count": len(calls),
+        "ops_per_second": len(calls) / elapsed,
+        "mib_per_second": size * len(calls) / elapsed / 1024 ** 2 if operation in ("upload", "open+read") else None,
+        "p50_ms": percentile(timings, 0.5) * 1000,
+        "p99_ms": percentile(timings, 0.99) * 1000,
+        "requests_per_call": sum(record.requests for record in records) / len(calls),
+        "peak_mib": peak / 1024 ** 2,
+    }
+
+
+def read_all(efs, path):
+    """Open ``path`` and read it in chunks."""
+    with efs.open(path) as file:
+        while file.read(CHUNK_SIZE):
+            pass
+
+
+def run_size(efs, size, count):
+    """Benchmark every operation on ``count`` files of ``size`` bytes and return the results."""
+    chunk = os.urandom(min(size, CHUNK_SIZE))
+    paths = ["bench/{}/{}.bin".format(number % 10, number) for number in range(count)]
+    moved = ["moved/{}/{}.bin".format(number % 10, number) for number in range(count)]
+    steps = (
+        ("upload", [lambda path=path: efs.upload(path, content(size, chunk)) for path in paths]),
+        ("open+read", [lambda path=path: read_all(efs, path) for path in paths]),
+        ("file_url", [lambda path=path: efs.file_url(path) for path in paths]),
+        ("move", [lambda path=path, new_path=new_path: efs.move(path, new_path) for path, new_path in zip(paths, moved)]),
+        ("remove", [lambda path=path: efs.remove(path) for path in moved]),
+    )
+    return [measure(efs, operation, calls, size) for operation, calls in steps]
+
+
+def run(backends, sizes, count, budget):
+    """Run the benchmarks and return the results of every backend, operation and size."""
+    app = Flask(__name__)
+    app.config["S3_BUCKET"] = "bucket"
+    app.config["LOCAL_STORAGE"] = tempfile.mkdtemp()
+    results = []
+    try:
+        with app.app_context(), mock_s3():
+            boto3.resource("s3").Bucket("bucket").create()
+            for backend in backends:
+                efs = EFS(storage=backend, hooks=[], fast_upload=True)
+                for size in sizes:
+                    for result in run_size(efs, size, max(1, min(count, budget // size))):
+                        result["backend"] = backend
+                        results.append(result)
+                        report(result)
+    finally:
+        shutil.rmtree(app.config["LOCAL_STORAGE"])
+    return results
+
+
+def report(result):
+    """Print one result."""
+    throughput = "" if result["mib_per_second"] is None else "{:8.1f} MiB/s".format(result["mib_per_second"])
+    print(
+        "{backend:<5} {operation:<9} {size:>11} B x{count:<4} {ops_per_second:9.1f} ops/s {throughput:>14} "
+        "p50={p50_ms:8.2f}ms p99={p99_ms:8.2f}ms requests={requests_per_call:4.1f} peak={peak_mib:8.2f} MiB".format(
+            throughput=throughput, **result
+        )
+    )
+
+
+def regressions(results, baseline, tolerance):
+    """Return a description of every result slower than ``baseline`` allows or sending more requests."""
+    previous = {(result["backend"], result["operation"], result["size"]): result for result in baseline}
+    found = []
+    for result in results:
+        before = previous.get((result["backend"], result["operation"], result["size"]))
+        if before is None:
+            continue
+        name = "{backend} {operation} {size}".format(**result)
+        if result["p50_ms"] > before["p50_ms"] * (1 + tolerance):
+            found.append("{}: p50 {:.2f}ms, was {:.2f}ms".format(name, result["p50_ms"], before["p50_ms"]))
+        if result["requests_per_call"] > before["requests_per_call"]:
+            found.append(
+                "{}: {:.1f} requests per call, was {:.1f}".format(
+                    name, result["requests_per_call"], before["requests_per_call"]
+                )
+            )
+    return found
+
+
+def main(argv=None):
+    """Parse the command line, run the benchmarks and compare them to the baseline."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--backends", nargs="+", default=["local", "s3"], choices=["local", "s3"])
+    parser.add_argument("--sizes", nargs="+", default=["1K", "1M", "64M"], type=parse_size)
+    parser.add_argument("--count", type=int, default=50, help="files per size")
+    parser.add_argument("--budget", type=parse_size, default="256M", help="bytes per size, caps the count")
+    parser.add_argument("--json", help="save the results to this file")
+    parser.add_argument("--baseline", help="compare the results to the ones saved in this file")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed latency increase")
+    args = parser.parse_args(argv)
+
+    results = run(args.backends, args.sizes, args.count, args.budget)
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as file:
+            found = regressions(results, json.load(file), args.tolerance)
+        for regression in found:
+            print("REGRESSION", regression)
+        return 1 if found else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
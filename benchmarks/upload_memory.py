@@ -0,0 +1,151 @@
+"""Measure how much memory ``EFS.upload`` needs on top of the payload, for each kind of content.
+
+Every case runs in its own process, which loads the payload from a temporary file, then uploads it. The reported
+growth is the peak resident memory (``VmHWM``, Linux only) of the process minus its resident memory before the upload, so a flat number
+means the payload was not copied. ``bytes(bytearray)`` shows what converting a buffer before uploading it costs.
+Mapped pages of ``mmap`` count as resident once read, although they are the page cache and not a copy. S3 requests
+are answered in process by a stub that reads the request bodies and discards them, like a socket would, so S3
+numbers only count the client. Usage::
+
+    python benchmarks/upload_memory.py [--backends local s3] [--sizes 64 256]
+"""
+import argparse
+import io
+import mmap
+import os
+import pathlib
+import subprocess
+import sys
+import tempfile
+import uuid
+
+SOURCES = ("bytes", "bytes(bytearray)", "bytearray", "memoryview", "mmap", "BytesIO", "path")
+MIB = 1024 * 1024
+
+
+def status(field):
+    """Return a memory ``field`` of ``/proc/self/status``, like ``VmRSS``, in bytes."""
+    with open("/proc/self/status") as lines:
+        for line in lines:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) * 1024
+    raise KeyError(field)
+
+
+def reset_peak():
+    """Make the current resident memory the peak one, so loading the payload does not count."""
+    with open("/proc/self/clear_refs", "w") as clear_refs:
+        clear_refs.write("5")
+
+
+def load(source, path):
+    """Return the content to upload for ``source``, read from the file at ``path``."""
+    if source == "path":
+        return pathlib.Path(path)
+    size = os.path.getsize(path)
+    with open(path, "rb") as file:
+        if source == "mmap":
+            return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if source == "bytes":
+            return file.read()
+        buffer = bytearray(size)
+        file.readinto(buffer)
+    if source == "memoryview":
+        return memoryview(buffer)
+    if source == "BytesIO":
+        return io.BytesIO(buffer)
+    return buffer
+
+
+def discard(request, event_name, **kwargs):
+    """Answer an S3 upload request without sending it, after reading its body the way a socket would."""
+    from botocore.awsrequest import AWSResponse
+
+    body = request.body
+    if hasattr(body, "read"):
+        while body.read(MIB):
+            pass
+    operation = event_name.rsplit(".", 1)[-1]
+    headers = {"ETag": '"{}"'.format(uuid.uuid4().hex)}
+    if operation == "CreateMultipartUpload":
+        content = "<InitiateMultipartUploadResult><UploadId>upload</UploadId></InitiateMultipartUploadResult>"
+    elif operation == "CompleteMultipartUpload":
+        content = "<CompleteMultipartUploadResult><ETag>{}</ETag></CompleteMultipartUploadResult>".format(
+            headers["ETag"]
+        )
+    elif operation in ("PutObject", "UploadPart"):
+        content = ""
+    else:
+        raise RuntimeError("the benchmark does not answer {} requests".format(operation))
+    return AWSResponse(request.url, 200, headers, StubBody(content.encode()))
+
+
+class StubBody:
+    """The raw body of a stubbed response."""
+
+    def __init__(self, content):
+        self.content = content
+
+    def stream(self, **kwargs):
+        yield self.content
+
+
+def child(backend, source, path):
+    """Upload the payload and print the memory growth in MiB, runs in its own process."""
+    from flask import Flask
+
+    from efs import EFS
+
+    # The requests are signed but never sent
+    os.environ.update(AWS_ACCESS_KEY_ID="benchmark", AWS_SECRET_ACCESS_KEY="benchmark", AWS_DEFAULT_REGION="us-east-1")
+    app = Flask(__name__)
+    app.config["S3_BUCKET"] = "bucket"
+    app.config["LOCAL_STORAGE"] = tempfile.mkdtemp()
+    with app.app_context():
+        efs = EFS(storage=backend, fast_upload=True)
+        if backend == "s3":
+            efs.home.client.meta.events.register("before-send.s3", discard)
+        efs.upload("warm-up.bin", b"x")
+        content = load(source, path)
+        reset_peak()
+        before = status("VmRSS")
+        if source == "bytes(bytearray)":
+            content = bytes(content)
+        efs.upload("payload.bin", content)
+        print((status("VmHWM") - before) / MIB)
+
+
+def run(backends, sizes):
+    """Run every case in a subprocess and print the results."""
+    for size in sizes:
+        with tempfile.NamedTemporaryFile() as payload:
+            for _ in range(size):
+                payload.write(os.urandom(MIB))
+            payload.flush()
+            for backend in backends:
+                for source in SOURCES:
+                    growth = subprocess.check_output(
+                        [sys.executable, __file__, "--child", backend, source, payload.name]
+                    )
+                    print(
+                        "{:<5} {:>5} MiB {:<16} peak growth={:8.1f} MiB".format(
+                            backend, size, source, float(growth)
+                        )
+                    )
+
+
+def main(argv=None):
+    """Parse the command line and run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--backends", nargs="+", default=["local", "s3"], choices=["local", "s3"])
+    parser.add_argument("--sizes", nargs="+", type=int, default=[64, 256], help="payload sizes in MiB")
+    parser.add_argument("--child", nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.child:
+        child(*args.child)
+    else:
+        run(args.backends, args.sizes)
+
+
+if __name__ == "__main__":
+    main()
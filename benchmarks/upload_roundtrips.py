@@ -0,0 +1,46 @@
+"""Count the S3 requests and time taken by ``EFS.upload`` with and without fast uploads.
+
+Runs against moto, so timings only show the client side overhead. Usage::
+
+    python benchmarks/upload_roundtrips.py [uploads]
+"""
+import sys
+import time
+from collections import Counter
+
+import boto3
+from flask import Flask
+from moto import mock_s3
+
+from efs import EFS
+
+
+def count_requests(efs):
+    """Return a counter of the S3 API calls made by ``efs``."""
+    calls = Counter()
+    efs.home.client.meta.events.register("before-call.s3", lambda model, **kwargs: calls.update([model.name]))
+    return calls
+
+
+def run(uploads):
+    """Upload ``uploads`` small files to nested paths with both modes and print the results."""
+    app = Flask(__name__)
+    app.config["S3_BUCKET"] = "bucket"
+    with app.app_context(), mock_s3():
+        boto3.resource("s3").Bucket("bucket").create()
+        for fast in (False, True):
+            efs = EFS(storage="s3", fast_upload=fast)
+            calls = count_requests(efs)
+            started = time.perf_counter()
+            for number in range(uploads):
+                efs.upload("reports/{}/{}.json".format(number % 10, number), b"{}")
+            elapsed = time.perf_counter() - started
+            print(
+                "fast_upload={!s:<5} requests/upload={:5.1f} ms/upload={:6.2f} {}".format(
+                    fast, sum(calls.values()) / uploads, elapsed * 1000 / uploads, dict(calls)
+                )
+            )
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 100)
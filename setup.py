@@ -48,12 +48,12 @@ setup(
         'Operating System :: POSIX',
         'Operating System :: Microsoft :: Windows',
         'Programming Language :: Python',
-        'Programming Language :: Python :: 2.7',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.3',
-        'Programming Language :: Python :: 3.4',
-        'Programming Language :: Python :: 3.5',
-        'Programming Language :: Python :: 3.6',
+        'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
         'Programming Language :: Python :: Implementation :: CPython',
         'Programming Language :: Python :: Implementation :: PyPy',
         'Topic :: Utilities',
@@ -61,9 +61,10 @@ setup(
     keywords=[
         # eg: 'keyword1', 'keyword2', 'keyword3',
     ],
+    python_requires='>=3.7',
     install_requires=[
-        'Flask',
-        'fs >= 2.0, < 3.0',
+        'Flask >= 2.0',
+        'fs >= 2.4.16, < 3.0',
         'fs-s3fs >= 1.0, < 2.0',
         'autorepr',
     ],
@@ -71,5 +72,11 @@ setup(
         # eg:
         #   'rst': ['docutils>=0.11'],
         #   ':python_version=="2.6"': ['argparse'],
+        'zstd': ['zstandard'],
+    },
+    entry_points={
+        'console_scripts': [
+            'efs-sync = efs.cli:sync',
+        ],
     },
 )
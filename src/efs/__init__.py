@@ -1,7 +1,28 @@
+import importlib
+
 __version__ = "0.2.0"
 
-from .filesystem import EFS
+# The public names are imported on first use, so ``import efs`` does not load flask, asyncio or the storage backends
+_LAZY = {
+    'AsyncEFS': ('.aio', 'AsyncEFS'),
+    'EFS': ('.filesystem', 'EFS'),
+    'FlaskEFS': ('.extension', 'FlaskEFS'),
+}
+
+__all__ = ('AsyncEFS', 'EFS', 'FlaskEFS', 'get_filesystem', )
+
+
+def __getattr__(name):
+    """Import the public names on first use."""
+    if name == 'get_filesystem':
+        return __getattr__('EFS').get_filesystem
+    if name not in _LAZY:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    module, attribute = _LAZY[name]
+    value = globals()[name] = getattr(importlib.import_module(module, __name__), attribute)
+    return value
 
-get_filesystem = EFS.get_filesystem
 
-__all__ = ('EFS', 'get_filesystem', )
+def __dir__():
+    """List the public names, imported or not."""
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,214 @@
+"""Asyncio counterpart of the filesystem abstraction."""
+import asyncio
+import contextlib
+import functools
+import queue
+from concurrent.futures import ThreadPoolExecutor
+
+from .filesystem import EFS
+from .streaming import DEFAULT_RANGE_SIZE
+
+DEFAULT_ASYNC_CONCURRENCY = 16
+
+_END = object()
+
+
+class AsyncReader:
+    """A file opened by :meth:`AsyncEFS.open`, reads run on the :class:`AsyncEFS` thread pool."""
+
+    def __init__(self, aefs, file, chunk_size=DEFAULT_RANGE_SIZE):
+        """Wrap the blocking ``file``."""
+        self._aefs = aefs
+        self._file = file
+        self.chunk_size = chunk_size
+
+    async def read(self, size=-1):
+        """Read up to ``size`` bytes, or everything left if ``size`` is negative."""
+        return await self._aefs._run(self._file.read, size)
+
+    async def seek(self, offset, whence=0):
+        """Move the current position."""
+        return await self._aefs._run(self._file.seek, offset, whence)
+
+    async def close(self):
+        """Close the file."""
+        await self._aefs._run(self._file.close)
+
+    def __aiter__(self):
+        """Iterate over the file in chunks of ``chunk_size`` bytes."""
+        return self
+
+    async def __anext__(self):
+        """Return the next chunk."""
+        chunk = await self.read(self.chunk_size)
+        if not chunk:
+            raise StopAsyncIteration
+        return chunk
+
+    async def __aenter__(self):
+        """Return the reader."""
+        return self
+
+    async def __aexit__(self, *exc_info):
+        """Close the file."""
+        await self.close()
+
+
+class AsyncWriter:
+    """Upload a file from chunks written by a coroutine, see :meth:`AsyncEFS.writer`.
+
+    The upload runs on the :class:`AsyncEFS` thread pool, reading the chunks from a queue of ``max_chunks``, so
+    writers are slowed down to the upload speed instead of buffering the whole file.
+    """
+
+    def __init__(self, aefs, path, max_chunks=2, **options):
+        """Prepare the upload of ``path``, ``options`` are passed to :meth:`EFS.upload`."""
+        self._aefs = aefs
+        self._queue = queue.Queue(maxsize=max_chunks)
+        self._upload = None
+        self.path = path
+        self.options = options
+        self.size = None
+
+    def _chunks(self):
+        while True:
+            chunk = self._queue.get()
+            if chunk is _END:
+                return
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+
+    def _start(self):
+        if self._upload is None:
+            self._upload = asyncio.ensure_future(
+                self._aefs._run(self._aefs.filesystem.upload, self.path, self._chunks(), **self.options)
+            )
+
+    async def _put(self, item):
+        """Queue ``item`` without blocking the event loop, failing if the upload already failed."""
+        put = asyncio.get_event_loop().run_in_executor(None, self._queue.put, item)
+        done, _ = await asyncio.wait([put, self._upload], return_when=asyncio.FIRST_COMPLETED)
+        if self._upload in done and put not in done:
+            # Unblock the put, the upload will never read it
+            self._queue.get_nowait()
+            await put
+            self._upload.result()
+            raise RuntimeError("upload of {} stopped before reading all the content".format(self.path))
+        await put
+
+    async def write(self, data):
+        """Queue ``data`` to be uploaded."""
+        if isinstance(data, str):
+            data = data.encode()
+        self._start()
+        await self._put(data)
+
+    async def close(self):
+        """Wait for the upload to finish and return the size of the file."""
+        self._start()
+        await self._put(_END)
+        self.size = await self._upload
+        return self.size
+
+    async def __aenter__(self):
+        """Return the writer."""
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        """Finish the upload, or make it fail too if the block raised so that no partial file is stored."""
+        if exc_type is None:
+            await self.close()
+        elif self._upload is not None:
+            with contextlib.suppress(Exception):
+                await self._put(exc if isinstance(exc, Exception) else RuntimeError("upload cancelled"))
+                await self._upload
+
+
+class AsyncEFS:
+    """The EatFirst File system, with coroutines instead of blocking methods.
+
+    The blocking :class:`~efs.filesystem.EFS` calls run on a pool of ``max_concurrency`` threads and at most that
+    many run at the same time, whatever the number of pending coroutines.
+    """
+
+    def __init__(self, *args, filesystem=None, max_concurrency=DEFAULT_ASYNC_CONCURRENCY, **kwargs):
+        """The constructor method of the asynchronous filesystem abstraction.
+
+        :param filesystem: the :class:`~efs.filesystem.EFS` to wrap, built from ``args`` and ``kwargs`` (e.g.
+            ``storage="s3"``) if not given.
+        :param max_concurrency: how many operations may run at the same time.
+        """
+        self.filesystem = filesystem if filesystem is not None else EFS(*args, **kwargs)
+        self.max_concurrency = max_concurrency
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency)
+        self._semaphore = None
+
+    async def _run(self, function, *args, **kwargs):
+        """Run the blocking ``function`` on the thread pool once a slot is free."""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with self._semaphore:
+            return await asyncio.get_event_loop().run_in_executor(
+                self._executor, functools.partial(function, *args, **kwargs)
+            )
+
+    async def upload(self, path, content, **options):
+        """Upload a file and return its size in bytes, see :meth:`EFS.upload`.
+
+        :param content: anything :meth:`EFS.upload` accepts, or an asynchronous iterable of bytes.
+        """
+        if hasattr(content, "__aiter__"):
+            async with self.writer(path, **options) as writer:
+                async for chunk in content:
+                    await writer.write(chunk)
+            return writer.size
+        return await self._run(self.filesystem.upload, path, content, **options)
+
+    def writer(self, path, **options):
+        """Return an :class:`AsyncWriter` uploading to ``path`` what is written to it.
+
+        .. code-block:: python
+
+            async with aefs.writer('exports/report.csv') as writer:
+                async for row in rows:
+                    await writer.write(row)
+        """
+        return AsyncWriter(self, path, **options)
+
+    async def open(self, path, *args, **kwargs):
+        """Open a file and return an :class:`AsyncReader`, see :meth:`EFS.open`."""
+        return AsyncReader(self, await self._run(self.filesystem.open, path, *args, **kwargs))
+
+    async def read(self, path, **kwargs):
+        """Return the whole content of a file."""
+        async with await self.open(path, **kwargs) as reader:
+            return await reader.read()
+
+    async def remove(self, path, **kwargs):
+        """Remove a file or folder, see :meth:`EFS.remove`."""
+        return await self._run(self.filesystem.remove, path, **kwargs)
+
+    async def rename(self, path, new_path):
+        """Rename a file, see :meth:`EFS.rename`."""
+        return await self._run(self.filesystem.rename, path, new_path)
+
+    async def move(self, path, new_path):
+        """Move a file, see :meth:`EFS.move`."""
+        return await self._run(self.filesystem.move, path, new_path)
+
+    async def file_url(self, path, with_cdn=True):
+        """Get a file url, see :meth:`EFS.file_url`."""
+        return await self._run(self.filesystem.file_url, path, with_cdn)
+
+    async def close(self):
+        """Wait for the running operations and stop the thread pool."""
+        await asyncio.get_event_loop().run_in_executor(None, self._executor.shutdown)
+
+    async def __aenter__(self):
+        """Return the filesystem."""
+        return self
+
+    async def __aexit__(self, *exc_info):
+        """Stop the thread pool."""
+        await self.close()
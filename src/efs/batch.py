@@ -0,0 +1,48 @@
+"""Run an operation over many items, reporting every item instead of stopping at the first error."""
+import itertools
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from .metrics import in_context
+
+DEFAULT_BATCH_WORKERS = 8
+
+
+class BatchResult(namedtuple("BatchResult", ["path", "value", "error"])):
+    """The outcome of one item of a batch: what the operation returned, or the exception it raised."""
+
+    __slots__ = ()
+
+    @property
+    def ok(self):
+        """Whether the operation succeeded for this item."""
+        return self.error is None
+
+
+def chunked(iterable, size):
+    """Yield lists of at most ``size`` items from ``iterable``."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def run_batch(function, items, max_workers=DEFAULT_BATCH_WORKERS):
+    """Call ``function(*item)`` for every item from a pool of ``max_workers`` threads.
+
+    :param function: the operation to run, the first argument of each item is reported as the path.
+    :param items: an iterable of argument tuples.
+    :param max_workers: how many items are processed at the same time.
+    :return: a list of :class:`BatchResult` in the same order as ``items``.
+    """
+
+    def call(item):
+        try:
+            return BatchResult(item[0], function(*item), None)
+        except Exception as exc:
+            return BatchResult(item[0], None, exc)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(in_context(call), items))
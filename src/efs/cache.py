@@ -0,0 +1,309 @@
+"""In-process caches sitting in front of the storage backends."""
+import contextlib
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from fs import errors
+from fs.path import normpath
+from fs.path import relpath
+
+from .eatfirst_osfs import EatFirstOSFS
+
+DEFAULT_MAX_ENTRIES = 10000
+DEFAULT_TTL = 60
+DEFAULT_DISK_CACHE_SIZE = 1024 * 1024 * 1024
+DEFAULT_LOCK_TIMEOUT = 300
+
+
+def cache_path(path):
+    """Normalise ``path`` so ``a/b``, ``/a/b`` and ``a/b/`` share cache entries."""
+    return relpath(normpath(path)).rstrip("/")
+
+
+class MetadataCache:
+    """A bounded, thread-safe LRU cache of path metadata (existence, type and info) with a time to live.
+
+    Entries are grouped by path, so everything known about a path is evicted or invalidated at once. Misses are
+    cached too: a path that does not exist is not looked up again until its entry expires or is invalidated. A value
+    loaded while its path was written or invalidated is returned but not cached, since it may be stale.
+
+    :param max_entries: how many paths are remembered, the least recently used ones are evicted first.
+    :param ttl: how many seconds an entry is trusted for.
+    :param clock: the function telling the time, in seconds.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL, clock=time.monotonic):
+        """Create an empty cache."""
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        # The loads running for every path: how many, and the generation of the path, bumped by each invalidation
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """Return how many paths are cached."""
+        return len(self._entries)
+
+    @property
+    def stats(self):
+        """Return the hit and miss counters and the number of cached paths."""
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+    def get_or_load(self, path, kind, load):
+        """Return the cached ``kind`` of metadata about ``path``, calling ``load()`` to fill it on a miss."""
+        path = cache_path(path)
+        now = self.clock()
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and kind in entry and entry[kind][0] > now:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return entry[kind][1]
+            self.misses += 1
+            loading = self._loading.setdefault(path, [0, 0])
+            loading[0] += 1
+            generation = loading[1]
+        try:
+            value = load()
+        except Exception:
+            with self._lock:
+                self._loaded(path, loading)
+            raise
+        with self._lock:
+            self._loaded(path, loading)
+            if loading[1] == generation:
+                self._set(path, kind, value)
+        return value
+
+    def _loaded(self, path, loading):
+        """Count a load of ``path`` as finished, the lock has to be held."""
+        loading[0] -= 1
+        if not loading[0]:
+            del self._loading[path]
+
+    def _bump(self, matches):
+        """Make the running loads of the paths ``matches`` accepts stale, the lock has to be held."""
+        for loading_path, loading in self._loading.items():
+            if matches(loading_path):
+                loading[1] += 1
+
+    def _set(self, path, kind, value):
+        """Cache ``value`` as the ``kind`` of metadata about the normalised ``path``, the lock has to be held."""
+        self._entries.setdefault(path, {})[kind] = (self.clock() + self.ttl, value)
+        self._entries.move_to_end(path)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def set(self, path, kind, value):
+        """Cache ``value`` as the ``kind`` of metadata about ``path``."""
+        path = cache_path(path)
+        with self._lock:
+            self._bump(lambda loading_path: loading_path == path)
+            self._set(path, kind, value)
+
+    def set_file(self, path):
+        """Record that ``path`` was just written as a file, making its parents unknown."""
+        path = cache_path(path)
+        self.invalidate_parents(path)
+        with self._lock:
+            self._bump(lambda loading_path: loading_path == path)
+            self._entries.pop(path, None)
+        self.set(path, "exists", True)
+        self.set(path, "isdir", False)
+
+    def set_missing(self, path):
+        """Record that ``path`` and everything under it was just removed."""
+        path = cache_path(path)
+        self.invalidate_tree(path)
+        self.set(path, "exists", False)
+        self.set(path, "isdir", False)
+
+    def invalidate_parents(self, path):
+        """Forget what is known about the directories containing ``path``."""
+        parts = cache_path(path).split("/")[:-1]
+        parents = {"/".join(parts[:depth]) for depth in range(len(parts) + 1)}
+        with self._lock:
+            self._bump(parents.__contains__)
+            for parent in parents:
+                self._entries.pop(parent, None)
+
+    def invalidate_tree(self, path):
+        """Forget what is known about ``path`` and everything under it."""
+        path = cache_path(path)
+        prefix = path + "/" if path else ""
+
+        def inside(cached):
+            return cached == path or cached.startswith(prefix)
+
+        with self._lock:
+            self._bump(inside)
+            for cached in [cached for cached in self._entries if inside(cached)]:
+                del self._entries[cached]
+
+    def clear(self):
+        """Forget everything, the counters are kept."""
+        with self._lock:
+            self._bump(lambda loading_path: True)
+            self._entries.clear()
+
+
+class DiskCache:
+    """A local, size bounded copy of remote files, validated against their ETag every time they are opened.
+
+    Each cached path gets an entry folder (the path with a ``~`` suffix) holding a single file named after the
+    ETag it was downloaded with, so content and validator are always replaced together by one atomic rename.
+    Opening a file sends a conditional GET: an unchanged object costs a request but no transfer.
+
+    Only one thread or process sharing the folder downloads a given path at a time, the others wait for it to
+    finish (or for ``lock_timeout`` seconds, after which the lock is considered abandoned) and then reuse its
+    copy. Once the cache grows over ``max_size`` bytes the least recently opened files are evicted.
+
+    :param root: the local folder to cache files in.
+    :param max_size: how many bytes of files are kept.
+    :param lock_timeout: how many seconds a download may hold the lock of a path.
+    """
+
+    ENTRY_SUFFIX = "~"
+    LOCK_NAME = ".lock"
+
+    def __init__(self, root, max_size=DEFAULT_DISK_CACHE_SIZE, lock_timeout=DEFAULT_LOCK_TIMEOUT):
+        """Create the cache, reusing the files already in ``root``."""
+        self.home = EatFirstOSFS(root, create=True)
+        self.max_size = max_size
+        self.lock_timeout = lock_timeout
+        self.hits = 0
+        self.misses = 0
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        self._size = 0
+        self.evict()
+
+    @property
+    def stats(self):
+        """Return how many opens were served without and with a download."""
+        with self._locks_lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+    def _entry(self, path):
+        return cache_path(path) + self.ENTRY_SUFFIX
+
+    def _cached_etag(self, entry):
+        """Return the ETag of the copy in ``entry``, if any."""
+        if not self.home.isdir(entry):
+            return None
+        names = [name for name in self.home.listdir(entry) if not name.startswith(".")]
+        return names[0] if names else None
+
+    @contextlib.contextmanager
+    def _thread_lock(self, entry):
+        """Hold the lock of ``entry`` against the other threads of this process.
+
+        The lock is dropped once no thread holds or waits for it, so only the paths being opened keep one.
+        """
+        with self._locks_lock:
+            lock, users = self._locks.get(entry, (threading.Lock(), 0))
+            self._locks[entry] = (lock, users + 1)
+        try:
+            with lock:
+                yield
+        finally:
+            with self._locks_lock:
+                users = self._locks[entry][1] - 1
+                if users:
+                    self._locks[entry] = (lock, users)
+                else:
+                    del self._locks[entry]
+
+    @contextlib.contextmanager
+    def _lock(self, entry):
+        """Hold the lock of ``entry`` against the other threads of this process and other processes."""
+        with self._thread_lock(entry):
+            lock_path = "{}/{}".format(entry, self.LOCK_NAME)
+            deadline = time.time() + self.lock_timeout
+            while True:
+                self.home.makedirs(entry, recreate=True)
+                try:
+                    self.home.openbin(lock_path, "x").close()
+                    break
+                except errors.FileExists:
+                    if time.time() > deadline:
+                        with contextlib.suppress(errors.ResourceNotFound):
+                            self.home.remove(lock_path)
+                    time.sleep(0.05)
+                except errors.ResourceNotFound:
+                    # The entry was invalidated or evicted in the meantime
+                    continue
+            try:
+                yield
+            finally:
+                with contextlib.suppress(errors.ResourceNotFound):
+                    self.home.remove(lock_path)
+
+    def open(self, backend, path):
+        """Return a local copy of ``path`` opened for reading, downloading it only if it changed.
+
+        :param backend: a filesystem with a ``download_if_changed`` method, like :class:`~efs.eatfirst_s3.EatFirstS3`.
+        :param path: the relative path to file, including filename.
+        """
+        entry = self._entry(path)
+        with self._lock(entry):
+            etag = self._cached_etag(entry)
+            temp = "{}/.{}.tmp".format(entry, uuid.uuid4().hex)
+            try:
+                with self.home.openbin(temp, "w") as temp_file:
+                    new_etag = backend.download_if_changed(path, temp_file, etag)
+                if new_etag is None:
+                    with self._locks_lock:
+                        self.hits += 1
+                    os.utime(self.home.getsyspath("{}/{}".format(entry, etag)))
+                else:
+                    etag = new_etag
+                    os.replace(self.home.getsyspath(temp), self.home.getsyspath("{}/{}".format(entry, etag)))
+                    size = self.home.getsize("{}/{}".format(entry, etag))
+                    with self._locks_lock:
+                        self.misses += 1
+                        self._size += size
+                    for name in self.home.listdir(entry):
+                        if name != etag and not name.startswith("."):
+                            self.home.remove("{}/{}".format(entry, name))
+            finally:
+                with contextlib.suppress(errors.ResourceNotFound):
+                    self.home.remove(temp)
+            cached_file = self.home.openbin("{}/{}".format(entry, etag))
+        if self._size > self.max_size:
+            self.evict()
+        return cached_file
+
+    def evict(self):
+        """Delete the least recently opened files until the cache fits in ``max_size``."""
+        files = []
+        for directory, _, names in os.walk(self.home.getsyspath("/")):
+            for name in names:
+                if not name.startswith("."):
+                    stat = os.stat(os.path.join(directory, name))
+                    files.append((stat.st_mtime, stat.st_size, os.path.join(directory, name)))
+        size = sum(file_size for _, file_size, _ in files)
+        for _, file_size, file_path in sorted(files):
+            if size <= self.max_size:
+                break
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(file_path)
+            size -= file_size
+        self._size = size
+
+    def invalidate(self, path):
+        """Forget the copies of ``path`` and of everything under it."""
+        path = cache_path(path)
+        if not path:
+            self.home.removetree("/")
+            return
+        for cached in (path + self.ENTRY_SUFFIX, path):
+            with contextlib.suppress(errors.ResourceNotFound):
+                self.home.removetree(cached)
@@ -0,0 +1,56 @@
+"""Command line tools, installed as console scripts."""
+import argparse
+import sys
+import urllib.parse
+
+from .filesystem import EFS
+
+
+def filesystem(location, workers):
+    """Return the :class:`~efs.filesystem.EFS` and the folder a command line ``location`` points to.
+
+    :param location: ``s3://bucket/prefix`` or a local folder.
+    :param workers: how many files the filesystem handles at the same time.
+    """
+    parsed = urllib.parse.urlparse(location)
+    if parsed.scheme == "s3":
+        config = {"S3_BUCKET": parsed.netloc}
+        return EFS(storage="s3", config=config, batch_workers=workers, fast_upload=True), parsed.path
+    config = {"LOCAL_STORAGE": location}
+    return EFS(storage="local", config=config, batch_workers=workers, fast_upload=True), ""
+
+
+def sync(argv=None):
+    """Mirror a local folder or S3 prefix to another one, see :meth:`efs.filesystem.EFS.sync`."""
+    parser = argparse.ArgumentParser(prog="efs-sync", description=sync.__doc__.split(",")[0])
+    parser.add_argument("source", help="s3://bucket/prefix or a local folder")
+    parser.add_argument("destination", help="s3://bucket/prefix or a local folder")
+    parser.add_argument("--delete", action="store_true", help="delete the destination files missing from the source")
+    parser.add_argument("--workers", type=int, default=8, help="how many files are copied at the same time")
+    parser.add_argument("--state", help="record the progress in this file to resume an interrupted sync")
+    parser.add_argument("--dry-run", action="store_true", help="only print what would be copied and deleted")
+    args = parser.parse_args(argv)
+
+    source, prefix = filesystem(args.source, args.workers)
+    destination, destination_prefix = filesystem(args.destination, args.workers)
+    result = source.sync(
+        prefix,
+        destination,
+        destination_prefix,
+        delete=args.delete,
+        state_file=args.state,
+        dry_run=args.dry_run,
+    )
+    for path in result.copied:
+        print("copy", path)
+    for path in result.deleted:
+        print("delete", path)
+    for failure in result.failed:
+        print("failed", failure.path, failure.error, file=sys.stderr)
+    print(
+        "{} copied, {} deleted, {} up to date, {} failed".format(
+            len(result.copied), len(result.deleted), result.skipped, len(result.failed)
+        ),
+        file=sys.stderr,
+    )
+    return 1 if result.failed else 0
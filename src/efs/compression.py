@@ -0,0 +1,107 @@
+"""Streaming compression of the uploaded files, decided by their content type."""
+import gzip
+import mimetypes
+import os
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+GZIP = "gzip"
+ZSTD = "zstd"
+
+#: Content types compressed by default, a trailing ``/`` matches a whole family.
+DEFAULT_COMPRESSIBLE_TYPES = (
+    "text/",
+    "application/json",
+    "application/javascript",
+    "application/xml",
+    "application/x-ndjson",
+    "image/svg+xml",
+)
+#: Extensions of files that are already compressed, they are never compressed nor decompressed again.
+COMPRESSED_EXTENSIONS = (".br", ".bz2", ".gz", ".tgz", ".xz", ".zip", ".zst")
+
+#: The supported encodings.
+ENCODINGS = (GZIP, ZSTD)
+
+
+class CompressionPolicy:
+    """Which uploads are compressed, and how.
+
+    :param encoding: ``gzip``, or ``zstd`` which needs the `zstandard <https://pypi.org/project/zstandard/>`_
+        package and is only understood by recent browsers.
+    :param level: the compression level, defaults to the one of the encoding.
+    :param content_types: the content types to compress, a trailing ``/`` matches a whole family.
+    """
+
+    def __init__(self, encoding=GZIP, level=None, content_types=DEFAULT_COMPRESSIBLE_TYPES):
+        """Check the encoding is available."""
+        if encoding not in ENCODINGS:
+            raise RuntimeError("{} does not support {} compression".format(self.__class__.__name__, encoding))
+        if encoding == ZSTD and zstandard is None:
+            raise RuntimeError("zstd compression needs the zstandard package")
+        self.encoding = encoding
+        self.level = level
+        self.content_types = tuple(content_types)
+
+    def encoding_for(self, path, content_type=None):
+        """Return the encoding to store ``path`` with, or None to store it as is.
+
+        :param path: the relative path to file, its extension is used when ``content_type`` is not given.
+        :param content_type: the content type the file is uploaded with.
+        """
+        if os.path.splitext(path)[1].lower() in COMPRESSED_EXTENSIONS:
+            return None
+        content_type = (content_type or mimetypes.guess_type(path)[0] or "").split(";")[0].strip().lower()
+        for compressible in self.content_types:
+            if content_type == compressible or (compressible.endswith("/") and content_type.startswith(compressible)):
+                return self.encoding
+        return None
+
+    def compress(self, chunks, encoding=None):
+        """Compress the ``chunks`` of bytes as they come, yielding the compressed chunks.
+
+        :param chunks: an iterable of bytes.
+        :param encoding: override the policy ``encoding``.
+        """
+        encoding = encoding or self.encoding
+        if encoding == GZIP:
+            level = zlib.Z_DEFAULT_COMPRESSION if self.level is None else self.level
+            compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        else:
+            compressor = zstandard.ZstdCompressor(level=3 if self.level is None else self.level).compressobj()
+        for chunk in chunks:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+
+
+class _GzipReader(gzip.GzipFile):
+    """A gzip reader that closes the file it reads from."""
+
+    def __init__(self, file):
+        super().__init__(fileobj=file, mode="rb")
+        self._source = file
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self._source.close()
+
+
+def decompress(file, encoding):
+    """Return a file reading the decompressed content of ``file``, which it closes once closed.
+
+    :param file: a binary file holding content compressed with ``encoding``.
+    :param encoding: ``gzip`` or ``zstd``.
+    """
+    if encoding == GZIP:
+        return _GzipReader(file)
+    if encoding == ZSTD and zstandard is not None:
+        return zstandard.ZstdDecompressor().stream_reader(file, closefd=True)
+    raise RuntimeError("can not decompress {} content".format(encoding))
@@ -0,0 +1,87 @@
+"""Content addressed storage: identical files are stored once, as a blob named by the hash of their content.
+
+The path a file is uploaded to only holds a small pointer to its blob. Every pointer owns a reference, an empty file
+in the ``.refs`` folder next to the blob, and a blob is removed with its last reference.
+"""
+import hashlib
+import io
+import json
+import os
+import re
+import tempfile
+from collections import namedtuple
+
+from .streaming import DEFAULT_PART_SIZE
+from .streaming import iter_chunks
+
+DEFAULT_BLOB_FOLDER = ".blobs"
+#: Files bigger than this are never pointers, so they are not read to find out.
+MAX_POINTER_SIZE = 1024
+
+_POINTER_HEADER = b"efs-blob\n"
+
+#: What a pointer file holds: the path of the blob, the name of the reference it owns and the size of the content.
+Pointer = namedtuple("Pointer", ["blob", "ref", "size"])
+
+
+def blob_path(folder, digest, path):
+    """Return where the content hashed to ``digest`` is stored.
+
+    The extension of ``path`` is kept, so that S3 guesses the same content type for the blob as for the path.
+    """
+    return "{}/{}/{}{}".format(folder, digest[:2], digest, os.path.splitext(path)[1].lower())
+
+
+def refs_path(blob):
+    """Return the folder holding the references to ``blob``."""
+    return blob + ".refs"
+
+
+def encode_pointer(pointer):
+    """Return the content of the file pointing to a blob."""
+    return _POINTER_HEADER + json.dumps(pointer._asdict(), sort_keys=True).encode()
+
+
+def decode_pointer(data, folder=DEFAULT_BLOB_FOLDER):
+    """Return the :class:`Pointer` in ``data``, or None if it is not a pointer to a blob of ``folder``.
+
+    Pointers to anything but a blob, or owning a reference outside of its ``.refs`` folder, are rejected.
+    """
+    if not data.startswith(_POINTER_HEADER):
+        return None
+    try:
+        pointer = Pointer(**json.loads(data[len(_POINTER_HEADER):].decode()))
+    except (TypeError, ValueError):
+        return None
+    blob = re.compile(r"{}/([0-9a-f]{{2}})/\1[0-9a-f]{{62}}(\.[^/.]*)?".format(re.escape(folder)))
+    if not isinstance(pointer.blob, str) or not blob.fullmatch(pointer.blob):
+        return None
+    if not isinstance(pointer.ref, str) or not re.fullmatch("[0-9a-f]{32}", pointer.ref):
+        return None
+    return pointer
+
+
+def spool(content, part_size=DEFAULT_PART_SIZE):
+    """Hash ``content`` while copying it to a temporary file, which only goes to disk past ``part_size`` bytes.
+
+    :param content: ``bytes``, ``str``, a readable file-like object or an iterable of bytes.
+    :param part_size: how many bytes are read at once and kept in memory.
+    :return: the copy, positioned at its start, the sha256 hex digest and the size of the content.
+    """
+    if isinstance(content, str):
+        content = content.encode()
+    if isinstance(content, bytes):
+        return io.BytesIO(content), hashlib.sha256(content).hexdigest(), len(content)
+    digest = hashlib.sha256()
+    size = 0
+    copy = tempfile.SpooledTemporaryFile(max_size=part_size)
+    try:
+        for chunk in iter_chunks(content, part_size):
+            digest.update(chunk)
+            copy.write(chunk)
+            size += len(chunk)
+    except BaseException:
+        copy.close()
+        raise
+    copy.seek(0)
+    return copy, digest.hexdigest(), size
@@ -0,0 +1,195 @@
+"""EatFirst file system kept in memory, for scratch data and tests."""
+import io
+import threading
+import time
+
+from autorepr import autorepr
+from fs import errors
+from fs.enums import ResourceType
+from fs.memoryfs import MemoryFS
+
+from .listing import FileEntry
+from .streaming import DEFAULT_PART_SIZE
+from .streaming import DEFAULT_RANGE_SIZE
+from .streaming import PartReport
+from .streaming import iter_chunks
+
+
+class _Budget:
+    """The bytes used by the files of a :class:`EatFirstMemoryFS`, out of ``max_size``."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def resize(self, growth):
+        """Count ``growth`` more bytes, refusing them if they do not fit."""
+        with self._lock:
+            if growth > 0 and self.max_size is not None and self.used + growth > self.max_size:
+                raise errors.InsufficientStorage(
+                    msg="{} bytes do not fit, {} of {} are used".format(growth, self.used, self.max_size)
+                )
+            self.used += growth
+
+
+class _BudgetedBytes(io.BytesIO):
+    """The content of a file, counting its growth against the budget before writing."""
+
+    def __init__(self, budget):
+        super().__init__()
+        self._budget = budget
+        self._size = 0
+
+    def write(self, data):
+        size = max(self._size, self.tell() + memoryview(data).nbytes)
+        self._budget.resize(size - self._size)
+        try:
+            written = super().write(data)
+        except Exception:
+            self._budget.resize(self._size - size)
+            raise
+        self._size = size
+        return written
+
+    def truncate(self, size=None):
+        result = super().truncate(size)
+        self._budget.resize(result - self._size)
+        self._size = result
+        return result
+
+    def release(self):
+        """Give the bytes of the file back to the budget."""
+        self._budget.resize(-self._size)
+        self._size = 0
+
+
+class EatFirstMemoryFS(MemoryFS):
+    """A filesystem kept in the memory of the process, that can hold at most ``max_size`` bytes of files.
+
+    Writes that would go over the budget raise :class:`fs.errors.InsufficientStorage`, and the memory of removed
+    files is given back.
+
+    :param max_size: how many bytes the files can use in total, unlimited if None.
+    """
+
+    __repr__ = autorepr(["max_size", "used"])
+
+    #: Files can only be written inside existing directories.
+    needs_directories = True
+
+    def __init__(self, max_size=None):
+        """Create an empty filesystem."""
+        self._budget = _Budget(max_size)
+        super().__init__()
+
+    @property
+    def max_size(self):
+        """How many bytes the files can use in total, or None."""
+        return self._budget.max_size
+
+    @property
+    def used(self):
+        """How many bytes the files use."""
+        return self._budget.used
+
+    def _make_dir_entry(self, resource_type, name):
+        entry = super()._make_dir_entry(resource_type, name)
+        if resource_type == ResourceType.file:
+            entry._bytes_file = _BudgetedBytes(self._budget)
+        return entry
+
+    def _files(self, entry):
+        """Yield the entries of the files in the folder ``entry`` and its sub folders."""
+        for name in entry.list():
+            child = entry.get_entry(name)
+            if child.is_dir:
+                yield from self._files(child)
+            else:
+                yield child
+
+    def remove(self, path):
+        """Remove a file, giving its bytes back to the budget."""
+        with self._lock:
+            entry = self._get_dir_entry(self.validatepath(path))
+            super().remove(path)
+            entry.bytes_file.release()
+
+    def removetree(self, path):
+        """Remove a folder and everything in it, giving their bytes back to the budget."""
+        with self._lock:
+            entry = self._get_dir_entry(self.validatepath(path))
+            files = list(self._files(entry)) if entry is not None and entry.is_dir else []
+            super().removetree(path)
+            for file in files:
+                file.bytes_file.release()
+
+    def move(self, src_path, dst_path, overwrite=False, preserve_time=False):
+        """Move a file, giving the bytes of the file it replaces back to the budget."""
+        with self._lock:
+            moved = self._get_dir_entry(self.validatepath(src_path))
+            replaced = self._get_dir_entry(self.validatepath(dst_path))
+            super().move(src_path, dst_path, overwrite, preserve_time)
+            if replaced is not None and replaced is not moved:
+                replaced.bytes_file.release()
+
+    def remove_tree(self, path, max_workers=1, on_progress=None, dry_run=False):
+        """Remove a folder and everything in it, see :meth:`efs.eatfirst_s3.EatFirstS3.remove_tree`.
+
+        :param path: the relative path to folder.
+        :param max_workers: ignored, kept for parity with S3.
+        :param on_progress: called once with the number of files removed.
+        :param dry_run: only count the files that would be removed.
+        :return: the number of files removed.
+        """
+        count = sum(1 for _ in self.walk.files(path))
+        if not dry_run:
+            self.removetree(path)
+        if on_progress:
+            on_progress(count)
+        return count
+
+    def iter_files(self, path="/", recursive=True):
+        """Yield a :class:`~efs.listing.FileEntry` for every file under ``path``, in no particular order.
+
+        :param path: the relative path to folder, nothing is yielded if it does not exist.
+        :param recursive: also list the files of the sub folders.
+        """
+        if not self.isdir(path):
+            return
+        walker = self.walk.info(path, namespaces=["details"], max_depth=None if recursive else 1)
+        for file_path, info in walker:
+            if info.is_file:
+                yield FileEntry(file_path.lstrip("/"), info.size, info.modified, None)
+
+    def open_ranged(self, path, range_size=DEFAULT_RANGE_SIZE, read_ahead=1, max_concurrency=1):
+        """Open ``path`` for reading, the file is already in memory so the range options are ignored.
+
+        :param path: the relative path to file, including filename.
+        :return: a seekable binary file.
+        """
+        return self.openbin(path)
+
+    def upload_stream(
+        self, path, content, part_size=DEFAULT_PART_SIZE, max_concurrency=1, on_part=None, upload_args=None
+    ):
+        """Write ``content`` to ``path`` one chunk at a time, see :meth:`efs.eatfirst_osfs.EatFirstOSFS.upload_stream`.
+
+        :param path: the relative path to file, including filename.
+        :param content: ``bytes``, a buffer, a readable file-like object or an iterable of bytes.
+        :param part_size: how many bytes are read from ``content`` at once.
+        :param max_concurrency: ignored, kept for parity with S3.
+        :param on_part: called with a :class:`~efs.streaming.PartReport` once each chunk is written.
+        :param upload_args: ignored, files in memory have no metadata. Kept for parity with S3.
+        :return: the number of bytes written.
+        :raise fs.errors.InsufficientStorage: if the file does not fit in the budget, it is then left truncated.
+        """
+        size = 0
+        with self.openbin(path, "w") as destination:
+            for number, chunk in enumerate(iter_chunks(content, part_size), 1):
+                started = time.perf_counter()
+                destination.write(chunk)
+                size += len(chunk)
+                if on_part:
+                    on_part(PartReport(number, len(chunk), time.perf_counter() - started))
+        return size
@@ -1,8 +1,153 @@
+import errno
+import itertools
+import os
+import time
+from datetime import datetime
+from datetime import timezone
+
 from autorepr import autorepr
 from fs.osfs import OSFS
 
+from .listing import FileEntry
+from .streaming import DEFAULT_PART_SIZE
+from .streaming import DEFAULT_RANGE_SIZE
+from .streaming import PartReport
+from .streaming import file_descriptor
+from .streaming import iter_chunks
+
+#: Errors of ``copy_file_range`` and ``sendfile`` meaning the files can not be copied that way.
+_UNSUPPORTED_COPY = (errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP, errno.ENOTSUP)
+
+
+def copy_range(source, destination, offset, count):
+    """Copy up to ``count`` bytes at ``offset`` of the ``source`` descriptor to the ``destination`` descriptor.
+
+    The bytes are copied by the kernel with ``copy_file_range`` or ``sendfile`` when the platform and filesystems
+    support it, without going through user space, and read then written otherwise.
+
+    :return: the number of bytes copied, 0 at the end of ``source``.
+    """
+    if hasattr(os, "copy_file_range"):
+        try:
+            return os.copy_file_range(source, destination, count, offset)
+        except OSError as exc:
+            if exc.errno not in _UNSUPPORTED_COPY:
+                raise
+    if hasattr(os, "sendfile"):
+        try:
+            return os.sendfile(destination, source, offset, count)
+        except OSError as exc:
+            if exc.errno not in _UNSUPPORTED_COPY:
+                raise
+    return os.write(destination, os.pread(source, count, offset))
+
 
 class EatFirstOSFS(OSFS):
     """Simple wrapper to have a better repr."""
 
     __repr__ = autorepr(['root_path', 'dir_mode:o'])
+
+    #: Files can only be written inside existing directories.
+    needs_directories = True
+
+    def remove_tree(self, path, max_workers=1, on_progress=None, dry_run=False):
+        """Remove a folder and everything in it, see :meth:`efs.eatfirst_s3.EatFirstS3.remove_tree`.
+
+        :param path: the relative path to folder.
+        :param max_workers: ignored, kept for parity with S3.
+        :param on_progress: called once with the number of files removed.
+        :param dry_run: only count the files that would be removed.
+        :return: the number of files removed.
+        """
+        count = sum(1 for _ in self.walk.files(path))
+        if not dry_run:
+            self.removetree(path)
+        if on_progress:
+            on_progress(count)
+        return count
+
+    def iter_files(self, path="/", recursive=True):
+        """Lazily yield a :class:`~efs.listing.FileEntry` for every file under ``path``, in no particular order.
+
+        Folders are read with :func:`os.scandir`, one open folder per level, so memory does not grow with the
+        number of files. Symbolic links to folders are not followed.
+
+        :param path: the relative path to folder, nothing is yielded if it does not exist.
+        :param recursive: also list the files of the sub folders.
+        """
+        top = self.validatepath(path).strip("/")
+        try:
+            stack = [(top, os.scandir(self.getsyspath(top)))]
+        except (FileNotFoundError, NotADirectoryError):
+            return
+        try:
+            while stack:
+                directory, entries = stack[-1]
+                entry = next(entries, None)
+                if entry is None:
+                    stack.pop()[1].close()
+                    continue
+                entry_path = "{}/{}".format(directory, entry.name) if directory else entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive:
+                        stack.append((entry_path, os.scandir(entry.path)))
+                elif entry.is_file():
+                    stat = entry.stat()
+                    yield FileEntry(
+                        entry_path, stat.st_size, datetime.fromtimestamp(stat.st_mtime, timezone.utc), None
+                    )
+        finally:
+            for _, entries in stack:
+                entries.close()
+
+    def open_ranged(self, path, range_size=DEFAULT_RANGE_SIZE, read_ahead=1, max_concurrency=1):
+        """Open ``path`` for reading, local files are already read lazily so the range options are ignored.
+
+        :param path: the relative path to file, including filename.
+        :return: a seekable binary file.
+        """
+        return self.openbin(path)
+
+    def upload_stream(
+        self, path, content, part_size=DEFAULT_PART_SIZE, max_concurrency=1, on_part=None, upload_args=None
+    ):
+        """Write ``content`` to ``path`` one chunk at a time.
+
+        :param path: the relative path to file, including filename.
+        :param content: ``bytes``, a buffer (``bytearray``, ``memoryview`` or ``mmap``, written in place), a
+            readable file-like object or an iterable of bytes. Regular files are copied by the kernel from their
+            current position, see :func:`copy_range`.
+        :param part_size: how many bytes are held in memory (or copied by the kernel) at once.
+        :param max_concurrency: ignored, local writes are sequential. Kept for parity with S3.
+        :param on_part: called with a :class:`~efs.streaming.PartReport` once each chunk is written.
+        :param upload_args: ignored, local files have no metadata. Kept for parity with S3.
+        :return: the number of bytes written.
+        """
+        source = file_descriptor(content)
+        if source is not None:
+            return self._copy_file(path, content, source, part_size, on_part)
+        size = 0
+        with self.openbin(path, "w") as destination:
+            for number, chunk in enumerate(iter_chunks(content, part_size), 1):
+                started = time.perf_counter()
+                destination.write(chunk)
+                size += len(chunk)
+                if on_part:
+                    on_part(PartReport(number, len(chunk), time.perf_counter() - started))
+        return size
+
+    def _copy_file(self, path, content, source, part_size, on_part):
+        """Copy the rest of the regular file ``content``, open on the ``source`` descriptor, to ``path``."""
+        offset = content.tell()
+        size = 0
+        with self.openbin(path, "w") as destination:
+            for number in itertools.count(1):
+                started = time.perf_counter()
+                copied = copy_range(source, destination.fileno(), offset + size, part_size)
+                if not copied:
+                    break
+                size += copied
+                if on_part:
+                    on_part(PartReport(number, copied, time.perf_counter() - started))
+        content.seek(offset + size)
+        return size
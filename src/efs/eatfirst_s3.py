@@ -1,10 +1,159 @@
 """EatFirst file system for S3."""
+import io
+import itertools
+import shutil
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
 
 from autorepr import autorepr
+from botocore.exceptions import ClientError
+from fs import errors
+from fs.enums import ResourceType
+from fs.info import Info
+from fs.path import basename
 from fs.path import iteratepath
 from fs.path import normpath
 from fs.path import relpath
 from fs_s3fs import S3FS
+from fs_s3fs._s3fs import s3errors
+
+from .batch import DEFAULT_BATCH_WORKERS
+from .batch import BatchResult
+from .batch import chunked
+from .batch import run_batch
+from .listing import FileEntry
+from .metrics import in_context
+from .pool import DEFAULT_MAX_POOL_CONNECTIONS
+from .pool import get_client
+from .pool import get_resource
+from .records import POINTER_METADATA
+from .records import FileAttributes
+from .streaming import DEFAULT_PART_SIZE
+from .streaming import DEFAULT_RANGE_SIZE
+from .streaming import PartReport
+from .streaming import as_body
+from .streaming import iter_chunks
+from .tickets import MultipartTicket
+from .tickets import Ticket
+from .tickets import content_disposition
+from .tickets import part_count
+from .tickets import upload_headers
+from .urls import PublicUrlBuilder
+
+#: S3 returns at most this many keys per ListObjectsV2 request.
+MAX_LIST_KEYS = 1000
+#: S3 refuses DeleteObjects requests with more keys than this.
+MAX_DELETE_KEYS = 1000
+#: Objects bigger than this can not be copied with a single CopyObject request.
+MAX_COPY_SIZE = 5 * 1024 * 1024 * 1024
+#: A multipart upload can not have more parts than this.
+MAX_PARTS = 10000
+#: The smallest part S3 accepts, but for the last one. Smaller part sizes are raised to it.
+MIN_PART_SIZE = 5 * 1024 * 1024
+DEFAULT_COPY_PART_SIZE = 512 * 1024 * 1024
+#: The headers kept by multipart copies, single CopyObject requests keep all of them.
+COPIED_HEADERS = ("CacheControl", "ContentDisposition", "ContentEncoding", "ContentLanguage", "ContentType", "Metadata")
+
+
+class S3RangedFile(io.RawIOBase):
+    """A read-only, seekable view of an S3 object that downloads byte ranges only when they are read.
+
+    The object is split in blocks of ``range_size`` bytes. Reading a block schedules the next ``read_ahead``
+    ones in the background, fetched by up to ``max_concurrency`` parallel ``GET`` requests. Only the blocks in
+    that window are kept in memory.
+    """
+
+    def __init__(self, client, bucket, key, size, range_size=DEFAULT_RANGE_SIZE, read_ahead=1, max_concurrency=1):
+        """Create the reader, no request is made until the first read."""
+        super().__init__()
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.size = size
+        self.range_size = range_size
+        self.read_ahead = read_ahead
+        self.position = 0
+        self._blocks = OrderedDict()
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency) if read_ahead else None
+
+    def readable(self):
+        """Return True, this file can be read."""
+        return True
+
+    def seekable(self):
+        """Return True, seeking is only a matter of fetching a different range."""
+        return True
+
+    def tell(self):
+        """Return the current position."""
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        """Move the current position, no data is fetched until the next read."""
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self.position + offset
+        elif whence == io.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError("invalid whence ({}, should be 0, 1 or 2)".format(whence))
+        if position < 0:
+            raise ValueError("negative seek position {}".format(position))
+        self.position = position
+        return position
+
+    def _fetch(self, index):
+        """Download one block with a ranged GET."""
+        start = index * self.range_size
+        end = min(start + self.range_size, self.size) - 1
+        with s3errors(self.key):
+            response = self.client.get_object(Bucket=self.bucket, Key=self.key, Range="bytes={}-{}".format(start, end))
+        return response["Body"].read()
+
+    def _schedule(self, index):
+        if index not in self._blocks:
+            if self._executor:
+                self._blocks[index] = self._executor.submit(in_context(self._fetch), index)
+            else:
+                self._blocks[index] = self._fetch(index)
+
+    def _block(self, index):
+        """Return the block at ``index``, scheduling the read ahead window and forgetting blocks out of it."""
+        last = (self.size - 1) // self.range_size
+        window = range(index, min(index + self.read_ahead, last) + 1)
+        for ahead in window:
+            self._schedule(ahead)
+        for stale in [cached for cached in self._blocks if cached not in window]:
+            block = self._blocks.pop(stale)
+            if isinstance(block, Future):
+                block.cancel()
+        block = self._blocks[index]
+        return block.result() if isinstance(block, Future) else block
+
+    def readinto(self, buffer):
+        """Read up to ``len(buffer)`` bytes, never crossing a block boundary."""
+        if self.position >= self.size:
+            return 0
+        index, offset = divmod(self.position, self.range_size)
+        data = self._block(index)[offset:offset + len(buffer)]
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+    def close(self):
+        """Drop the cached blocks and stop any pending read ahead."""
+        for block in self._blocks.values():
+            if isinstance(block, Future):
+                block.cancel()
+        self._blocks.clear()
+        if self._executor:
+            self._executor.shutdown(wait=False)
+        super().close()
 
 
 class EatFirstS3(S3FS):
@@ -12,6 +161,37 @@ class EatFirstS3(S3FS):
 
     __repr__ = autorepr([], bucket=lambda self: self._bucket_name, key=lambda self: self._access_keys[0])
 
+    #: Keys are flat, directories only exist as an emulation on top of them.
+    needs_directories = False
+
+    def __init__(self, *args, max_pool_connections=DEFAULT_MAX_POOL_CONNECTIONS, **kwargs):
+        """Create the filesystem, clients are taken from the process-wide :mod:`efs.pool`.
+
+        :param max_pool_connections: how many connections the shared client keeps open.
+        """
+        super().__init__(*args, **kwargs)
+        self.max_pool_connections = max_pool_connections
+
+    def _pool_settings(self):
+        return (
+            self.region,
+            self.aws_access_key_id,
+            self.aws_secret_access_key,
+            self.aws_session_token,
+            self.endpoint_url,
+            self.max_pool_connections,
+        )
+
+    @property
+    def client(self):
+        """The S3 client shared by every filesystem with the same settings, it is thread-safe."""
+        return get_client(*self._pool_settings())
+
+    @property
+    def s3(self):
+        """This thread's S3 resource, sending its requests through the shared client."""
+        return get_resource(*self._pool_settings())
+
     def _s3path(self, path):
         """Get the absolute path to a file stored in S3."""
         path = relpath(normpath(path))
@@ -20,3 +200,517 @@ class EatFirstS3(S3FS):
         if s3path and s3path[-1] == self._separator:
             s3path = s3path[:-1]
         return s3path
+
+    def open_ranged(self, path, range_size=DEFAULT_RANGE_SIZE, read_ahead=1, max_concurrency=1):
+        """Open ``path`` for reading without downloading it, ranges are fetched as they are read.
+
+        :param path: the relative path to file, including filename.
+        :param range_size: how many bytes each ranged GET fetches.
+        :param read_ahead: how many blocks after the one being read are fetched in the background, 0 disables it.
+        :param max_concurrency: how many ranged GETs may run at the same time.
+        :return: a buffered, seekable binary file.
+        """
+        key = self._path_to_key(self.validatepath(path))
+        with s3errors(path):
+            size = self.client.head_object(Bucket=self._bucket_name, Key=key)["ContentLength"]
+        raw = S3RangedFile(self.client, self._bucket_name, key, size, range_size, read_ahead, max_concurrency)
+        return io.BufferedReader(raw, buffer_size=range_size)
+
+    def attributes(self, path):
+        """Return the :class:`~efs.records.FileAttributes` the object at ``path`` was stored with.
+
+        :param path: the relative path to file, including filename.
+        """
+        with s3errors(path):
+            response = self.client.head_object(Bucket=self._bucket_name, Key=self._path_to_key(self.validatepath(path)))
+        pointer = response.get("Metadata", {}).get(POINTER_METADATA) == "true"
+        return FileAttributes(response.get("ContentEncoding"), pointer)
+
+    def public_url_builder(self, cdn_host=None):
+        """Return a :class:`~efs.urls.PublicUrlBuilder` for the objects of this filesystem.
+
+        The bucket URL is taken from a single presigned URL (signing is done locally, no request is made) so it
+        follows the client's region, endpoint and addressing style.
+
+        :param cdn_host: the host name serving the bucket through a CDN, if any.
+        """
+        sentinel = "efs-public-url-base"
+        url = self.client.generate_presigned_url(
+            ClientMethod="get_object", Params={"Bucket": self._bucket_name, "Key": sentinel}
+        )
+        base_url = url.split("?")[0][:-len(sentinel)]
+        key_prefix = self._prefix + "/" if self._prefix else ""
+        return PublicUrlBuilder(base_url, key_prefix, cdn_host, self.delimiter)
+
+    def download_if_changed(self, path, file, etag=None):
+        """Download ``path`` into ``file`` unless its ETag is still ``etag``, in a single conditional GET.
+
+        :param path: the relative path to file, including filename.
+        :param file: a binary file-like object to write to.
+        :param etag: the ETag of the copy the caller has, if any.
+        :return: the current ETag, without quotes, or ``None`` when the object did not change.
+        """
+        key = self._path_to_key(self.validatepath(path))
+        conditions = {"IfNoneMatch": '"{}"'.format(etag)} if etag else {}
+        try:
+            response = self.client.get_object(Bucket=self._bucket_name, Key=key, **conditions)
+        except ClientError as error:
+            if error.response.get("ResponseMetadata", {}).get("HTTPStatusCode") == 304:
+                return None
+            with s3errors(path):
+                raise
+        with s3errors(path):
+            shutil.copyfileobj(response["Body"], file, DEFAULT_RANGE_SIZE)
+        return response["ETag"].strip('"')
+
+    def presign_upload(self, path, expires_in, upload_args=None, max_size=None, post=False):
+        """Return a :class:`~efs.tickets.Ticket` uploading ``path`` with a single request straight to S3.
+
+        Signing is done locally, no request is made.
+
+        :param path: the relative path to file, including filename.
+        :param expires_in: how many seconds the ticket is valid for.
+        :param upload_args: extra arguments of the upload, merged over the filesystem ones (ACL, guessed content
+            type). The client has to send them as the ticket headers, or form fields.
+        :param max_size: the largest upload a POST ticket accepts, PUT tickets can not limit it.
+        :param post: return a ticket for a form POST instead of a PUT.
+        """
+        key = self._path_to_key(self.validatepath(path))
+        upload_args = dict(self._get_upload_args(key), **(upload_args or {}))
+        expires = int(time.time()) + expires_in
+        if post:
+            fields = upload_headers(upload_args, form=True)
+            conditions = [{name: value} for name, value in fields.items()]
+            if max_size is not None:
+                conditions.append(["content-length-range", 0, max_size])
+            presigned = self.client.generate_presigned_post(
+                self._bucket_name, key, Fields=fields, Conditions=conditions, ExpiresIn=expires_in
+            )
+            return Ticket(path, "POST", presigned["url"], presigned["fields"], {}, expires)
+        url = self.client.generate_presigned_url(
+            ClientMethod="put_object",
+            Params=dict(upload_args, Bucket=self._bucket_name, Key=key),
+            ExpiresIn=expires_in,
+        )
+        return Ticket(path, "PUT", url, {}, upload_headers(upload_args), expires)
+
+    def presign_multipart(self, path, size, part_size, expires_in, upload_args=None):
+        """Start a multipart upload of ``path`` and return a :class:`~efs.tickets.MultipartTicket` for its parts.
+
+        :param path: the relative path to file, including filename.
+        :param size: the size of the file, in bytes.
+        :param part_size: the size of the parts, raised to :data:`MIN_PART_SIZE` and grown if the file would need
+            more than :data:`MAX_PARTS`.
+        :param expires_in: how many seconds the part urls are valid for.
+        :param upload_args: extra arguments of the upload, merged over the filesystem ones.
+        """
+        key = self._path_to_key(self.validatepath(path))
+        upload_args = dict(self._get_upload_args(key), **(upload_args or {}))
+        count, part_size = part_count(size, max(part_size, MIN_PART_SIZE), MAX_PARTS)
+        with s3errors(path):
+            response = self.client.create_multipart_upload(Bucket=self._bucket_name, Key=key, **upload_args)
+        upload_id = response["UploadId"]
+        urls = [
+            self.client.generate_presigned_url(
+                ClientMethod="upload_part",
+                Params={"Bucket": self._bucket_name, "Key": key, "UploadId": upload_id, "PartNumber": number},
+                ExpiresIn=expires_in,
+            )
+            for number in range(1, count + 1)
+        ]
+        return MultipartTicket(path, upload_id, part_size, urls, {}, int(time.time()) + expires_in)
+
+    def complete_multipart(self, path, upload_id, etags):
+        """Complete the multipart upload ``upload_id`` of ``path`` from the ETags of its parts, in order."""
+        parts = [{"ETag": etag, "PartNumber": number} for number, etag in enumerate(etags, 1)]
+        with s3errors(path):
+            self.client.complete_multipart_upload(
+                Bucket=self._bucket_name,
+                Key=self._path_to_key(self.validatepath(path)),
+                UploadId=upload_id,
+                MultipartUpload={"Parts": parts},
+            )
+
+    def abort_multipart(self, path, upload_id):
+        """Abort the multipart upload ``upload_id`` of ``path``, S3 drops the parts already uploaded."""
+        with s3errors(path):
+            self.client.abort_multipart_upload(
+                Bucket=self._bucket_name, Key=self._path_to_key(self.validatepath(path)), UploadId=upload_id
+            )
+
+    def presign_download(self, path, expires_in, filename=None):
+        """Return a :class:`~efs.tickets.Ticket` downloading ``path`` straight from S3.
+
+        :param path: the relative path to file, including filename.
+        :param expires_in: how many seconds the ticket is valid for.
+        :param filename: save the download under this name instead of showing it in the browser.
+        """
+        params = {"Bucket": self._bucket_name, "Key": self._path_to_key(self.validatepath(path))}
+        if filename:
+            params["ResponseContentDisposition"] = content_disposition(filename)
+        url = self.client.generate_presigned_url(ClientMethod="get_object", Params=params, ExpiresIn=expires_in)
+        return Ticket(path, "GET", url, {}, {}, int(time.time()) + expires_in)
+
+    def upload_stream(
+        self, path, content, part_size=DEFAULT_PART_SIZE, max_concurrency=1, on_part=None, upload_args=None
+    ):
+        """Upload ``content`` to ``path`` through a multipart upload.
+
+        Content that fits in a single part is sent with one ``PutObject`` instead. Parts are sent by up to
+        ``max_concurrency`` threads and reading pauses while that many parts are in flight, so at most
+        ``max_concurrency + 1`` parts are held in memory. If anything fails midway the multipart upload is aborted
+        so S3 does not keep (and bill) the orphan parts.
+
+        :param path: the relative path to file, including filename.
+        :param content: ``bytes``, a buffer (``bytearray``, ``memoryview`` or ``mmap``, sent without copying the
+            parts), a readable file-like object or an iterable of bytes.
+        :param part_size: size in bytes of each part, raised to :data:`MIN_PART_SIZE` since S3 rejects smaller parts
+            but the last one when the upload is completed.
+        :param max_concurrency: how many parts may be uploading at the same time.
+        :param on_part: called with a :class:`~efs.streaming.PartReport` once each part is stored.
+        :param upload_args: extra arguments of the ``PutObject`` or ``CreateMultipartUpload`` request (e.g.
+            ``ContentType`` or ``Metadata``), they take precedence over the ones the filesystem was built with.
+        :return: the number of bytes written.
+        """
+        key = self._path_to_key(self.validatepath(path))
+        upload_args = dict(self._get_upload_args(key), **(upload_args or {}))
+        client = self.client
+        chunks = iter_chunks(content, max(part_size, MIN_PART_SIZE))
+        first = next(chunks, b"")
+        second = next(chunks, None)
+
+        if second is None:
+            started = time.perf_counter()
+            with s3errors(path):
+                client.put_object(Bucket=self._bucket_name, Key=key, Body=as_body(first), **upload_args)
+            if on_part:
+                on_part(PartReport(1, len(first), time.perf_counter() - started))
+            return len(first)
+
+        with s3errors(path):
+            upload_id = client.create_multipart_upload(Bucket=self._bucket_name, Key=key, **upload_args)["UploadId"]
+
+        def upload_part(number, chunk):
+            started = time.perf_counter()
+            with s3errors(path):
+                response = client.upload_part(
+                    Bucket=self._bucket_name, Key=key, UploadId=upload_id, PartNumber=number, Body=as_body(chunk)
+                )
+            report = PartReport(number, len(chunk), time.perf_counter() - started)
+            if on_part:
+                on_part(report)
+            return {"ETag": response["ETag"], "PartNumber": number}, report.size
+
+        parts = []
+        pending = set()
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            try:
+                for number, chunk in enumerate(itertools.chain((first, second), chunks), 1):
+                    if len(pending) >= max_concurrency:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            parts.append(future.result())
+                    pending.add(executor.submit(in_context(upload_part), number, chunk))
+                    del chunk
+                for future in pending:
+                    parts.append(future.result())
+                parts.sort(key=lambda part: part[0]["PartNumber"])
+                with s3errors(path):
+                    client.complete_multipart_upload(
+                        Bucket=self._bucket_name,
+                        Key=key,
+                        UploadId=upload_id,
+                        MultipartUpload={"Parts": [part for part, _ in parts]},
+                    )
+            except BaseException:
+                for future in pending:
+                    future.cancel()
+                wait(pending)
+                client.abort_multipart_upload(Bucket=self._bucket_name, Key=key, UploadId=upload_id)
+                raise
+        return sum(size for _, size in parts)
+
+    def remove_many(self, paths, max_workers=DEFAULT_BATCH_WORKERS):
+        """Remove files with ``DeleteObjects``, :data:`MAX_DELETE_KEYS` keys per request.
+
+        Requests are sent by up to ``max_workers`` threads. Like S3 itself, removing a key that does not exist is
+        not an error, and paths are removed as files: folders need :meth:`removetree`.
+
+        :param paths: an iterable of relative paths to files.
+        :param max_workers: how many ``DeleteObjects`` requests may run at the same time.
+        :return: a list of :class:`~efs.batch.BatchResult` in the same order as ``paths``.
+        """
+        keys = []
+        failed = {}
+        for path in paths:
+            try:
+                keys.append((path, self._path_to_key(self.validatepath(path))))
+            except errors.FSError as exc:
+                keys.append((path, None))
+                failed[path] = exc
+        failed_keys = self._delete_keys((key for _, key in keys if key is not None), max_workers)
+        return [BatchResult(path, None, failed.get(path) or failed_keys.get(key)) for path, key in keys]
+
+    def _delete_keys(self, keys, max_workers=DEFAULT_BATCH_WORKERS):
+        """Delete ``keys`` with ``DeleteObjects`` requests and return the exceptions of the ones that failed, by key."""
+        failed_keys = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            batches = chunked(OrderedDict.fromkeys(keys), MAX_DELETE_KEYS)
+            for batch_errors in executor.map(in_context(self._delete_batch), batches):
+                failed_keys.update(batch_errors)
+        return failed_keys
+
+    def _delete_batch(self, keys):
+        """Delete up to :data:`MAX_DELETE_KEYS` keys with one request, returning the exceptions of the failed ones."""
+        try:
+            response = self.client.delete_objects(
+                Bucket=self._bucket_name, Delete={"Objects": [{"Key": key} for key in keys], "Quiet": True}
+            )
+        except Exception as exc:
+            return {key: exc for key in keys}
+        return {
+            error["Key"]: errors.OperationFailed(self._key_to_path(error["Key"]), msg=error.get("Message"))
+            for error in response.get("Errors", ())
+        }
+
+    def isdir(self, path):
+        """Check if ``path`` is a folder, which on S3 is the case as soon as any object is stored under it.
+
+        Folders do not need a directory marker, so the ones written with fast uploads are folders too.
+        """
+        _path = self.validatepath(path)
+        if _path == "/":
+            return True
+        with s3errors(path):
+            response = self.client.list_objects_v2(
+                Bucket=self._bucket_name, Prefix=self._path_to_dir_key(_path), MaxKeys=1
+            )
+        return bool(response.get("Contents"))
+
+    def getinfo(self, path, namespaces=None):
+        """Get the info of a file or folder without requiring a directory marker for its parent folder."""
+        self.check()
+        _path = self.validatepath(path)
+        if _path == "/":
+            return super().getinfo(path, namespaces)
+        try:
+            obj = self._get_object(path, self._path_to_key(_path))
+        except errors.ResourceNotFound:
+            if not self.isdir(_path):
+                raise
+            return Info(
+                {"basic": {"name": basename(_path), "is_dir": True}, "details": {"type": int(ResourceType.directory)}}
+            )
+        return Info(self._info_from_object(obj, namespaces or ()))
+
+    def iter_files(self, path="/", recursive=True):
+        """Lazily yield a :class:`~efs.listing.FileEntry` for every file under ``path``, sorted by key.
+
+        Unlike :meth:`walk`, which lists every folder separately and keeps the listings, the whole prefix is
+        listed flat, one page of :data:`MAX_LIST_KEYS` keys at a time, and the next page is only requested once
+        the current one has been consumed. Directory markers are skipped.
+
+        :param path: the relative path to folder, nothing is yielded if it does not exist.
+        :param recursive: also list the files of the sub folders, otherwise a ``Delimiter`` stops at the first
+            level.
+        """
+        prefix = self._path_to_dir_key(self.validatepath(path))
+        root = self._path_to_dir_key("/")
+        options = {"Bucket": self._bucket_name, "Prefix": prefix, "PaginationConfig": {"PageSize": MAX_LIST_KEYS}}
+        if not recursive:
+            options["Delimiter"] = self.delimiter
+        with s3errors(path):
+            for page in self.client.get_paginator("list_objects_v2").paginate(**options):
+                for obj in page.get("Contents", ()):
+                    key = obj["Key"]
+                    if key.endswith(self.delimiter):
+                        continue
+                    yield FileEntry(
+                        self._key_to_path(key[len(root):]), obj["Size"], obj["LastModified"], obj["ETag"].strip('"')
+                    )
+
+    def remove_tree(self, path, max_workers=DEFAULT_BATCH_WORKERS, on_progress=None, dry_run=False):
+        """Remove a folder and everything in it, without walking it folder by folder.
+
+        The objects under ``path`` are listed in pages of :data:`MAX_DELETE_KEYS` and each page is deleted with a
+        ``DeleteObjects`` request, up to ``max_workers`` of them at a time, while the next pages are listed.
+
+        :param path: the relative path to folder.
+        :param max_workers: how many ``DeleteObjects`` requests may run at the same time.
+        :param on_progress: called with the number of objects removed (or counted) so far, after each page.
+        :param dry_run: only count the objects that would be removed.
+        :return: the number of objects removed.
+        """
+        prefix = self._path_to_dir_key(self.validatepath(path))
+        pages = self.client.get_paginator("list_objects_v2").paginate(
+            Bucket=self._bucket_name, Prefix=prefix, PaginationConfig={"PageSize": MAX_DELETE_KEYS}
+        )
+        count = 0
+        failed = {}
+        pending = {}
+
+        def collect(futures):
+            nonlocal count
+            for future in futures:
+                batch_errors = future.result()
+                count += pending.pop(future) - len(batch_errors)
+                failed.update(batch_errors)
+                if on_progress:
+                    on_progress(count)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            with s3errors(path):
+                for page in pages:
+                    keys = [obj["Key"] for obj in page.get("Contents", ())]
+                    if dry_run:
+                        count += len(keys)
+                        if on_progress:
+                            on_progress(count)
+                        continue
+                    if len(pending) >= max_workers:
+                        collect(wait(pending, return_when=FIRST_COMPLETED).done)
+                    pending[executor.submit(in_context(self._delete_batch), keys)] = len(keys)
+            collect(wait(pending).done)
+
+        if failed:
+            key, error = next(iter(failed.items()))
+            raise errors.OperationFailed(
+                self._key_to_path(key), exc=error, msg="{} objects could not be removed".format(len(failed))
+            )
+        return count
+
+    def _copy_key(self, source_key, key, size, part_size=None, max_concurrency=1, source_bucket=None):
+        """Copy ``source_key`` to ``key`` inside S3, with ``UploadPartCopy`` for objects over :data:`MAX_COPY_SIZE`.
+
+        The ACL is not part of what S3 copies, so the one new uploads get is applied to the copy.
+
+        :param source_bucket: the bucket of ``source_key``, this filesystem's by default.
+        """
+        client = self.client
+        source = {"Bucket": source_bucket or self._bucket_name, "Key": source_key}
+        acl = (self.upload_args or {}).get("ACL")
+        acl_args = {"ACL": acl} if acl else {}
+        if size <= MAX_COPY_SIZE:
+            client.copy_object(Bucket=self._bucket_name, Key=key, CopySource=source, **acl_args)
+            return
+
+        head = client.head_object(**source)
+        headers = {name: head[name] for name in COPIED_HEADERS if head.get(name)}
+        upload_id = client.create_multipart_upload(Bucket=self._bucket_name, Key=key, **headers, **acl_args)["UploadId"]
+        part_size = max(part_size or DEFAULT_COPY_PART_SIZE, -(-size // MAX_PARTS))
+
+        def copy_part(number):
+            start = (number - 1) * part_size
+            response = client.upload_part_copy(
+                Bucket=self._bucket_name,
+                Key=key,
+                UploadId=upload_id,
+                PartNumber=number,
+                CopySource=source,
+                CopySourceRange="bytes={}-{}".format(start, min(start + part_size, size) - 1),
+            )
+            return {"ETag": response["CopyPartResult"]["ETag"], "PartNumber": number}
+
+        try:
+            with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+                parts = list(executor.map(in_context(copy_part), range(1, -(-size // part_size) + 1)))
+            client.complete_multipart_upload(
+                Bucket=self._bucket_name, Key=key, UploadId=upload_id, MultipartUpload={"Parts": parts}
+            )
+        except BaseException:
+            client.abort_multipart_upload(Bucket=self._bucket_name, Key=key, UploadId=upload_id)
+            raise
+
+    def move_object(self, path, new_path, overwrite=True, part_size=None, max_concurrency=1):
+        """Move a file without downloading it: copy it inside S3 and delete the original.
+
+        Objects over 5 GiB are copied in parts of ``part_size`` bytes (:data:`DEFAULT_COPY_PART_SIZE` by default),
+        ``max_concurrency`` at a time. No directory markers are created for the destination.
+
+        :param path: the relative path to file, including filename.
+        :param new_path: the relative path to new file, including filename.
+        :param overwrite: replace ``new_path`` if it exists, instead of raising :class:`fs.errors.DestinationExists`.
+        """
+        source_key = self._path_to_key(self.validatepath(path))
+        key = self._path_to_key(self.validatepath(new_path))
+        client = self.client
+        with s3errors(path):
+            size = client.head_object(Bucket=self._bucket_name, Key=source_key)["ContentLength"]
+        if source_key == key:
+            return
+        if not overwrite and self.exists(new_path):
+            raise errors.DestinationExists(new_path)
+        with s3errors(path):
+            self._copy_key(source_key, key, size, part_size, max_concurrency)
+            client.delete_object(Bucket=self._bucket_name, Key=source_key)
+
+    def copies_from(self, source):
+        """Whether the objects of the ``source`` filesystem can be copied to this one inside S3, by :meth:`copy_from`.
+
+        :param source: the backend of another filesystem.
+        """
+        client = getattr(source, "client", None)
+        return isinstance(source, EatFirstS3) and client.meta.endpoint_url == self.client.meta.endpoint_url
+
+    def copy_from(self, source, path, new_path, part_size=None, max_concurrency=1):
+        """Copy a file of the ``source`` S3 filesystem without downloading it, with its headers and metadata.
+
+        :param source: an :class:`EatFirstS3`, possibly of another bucket, see :meth:`copies_from`.
+        :param path: the relative path to the file in ``source``.
+        :param new_path: the relative path to new file, including filename.
+        :return: the size of the file.
+        """
+        source_key = source._path_to_key(source.validatepath(path))
+        key = self._path_to_key(self.validatepath(new_path))
+        with s3errors(path):
+            size = self.client.head_object(Bucket=source._bucket_name, Key=source_key)["ContentLength"]
+            self._copy_key(source_key, key, size, part_size, max_concurrency, source._bucket_name)
+        return size
+
+    def upload_args_of(self, path):
+        """Return the headers and metadata of the object at ``path``, as arguments of an upload request.
+
+        :param path: the relative path to file, including filename.
+        """
+        with s3errors(path):
+            head = self.client.head_object(Bucket=self._bucket_name, Key=self._path_to_key(self.validatepath(path)))
+        return {name: head[name] for name in COPIED_HEADERS if head.get(name)}
+
+    def move_tree(
+        self,
+        path,
+        new_path,
+        part_size=None,
+        max_concurrency=1,
+        max_workers=DEFAULT_BATCH_WORKERS,
+    ):
+        """Move every object under the folder ``path`` to the folder ``new_path``, ``max_workers`` at a time.
+
+        Objects are copied inside S3 and the ones copied are then deleted with ``DeleteObjects``, so a failed copy
+        leaves its original in place.
+
+        :param path: the relative path to folder.
+        :param new_path: the relative path to new folder.
+        :return: a list of :class:`~efs.batch.BatchResult`, one per object, with paths relative to the filesystem.
+        """
+        prefix = self._path_to_dir_key(self.validatepath(path))
+        new_prefix = self._path_to_dir_key(self.validatepath(new_path))
+        client = self.client
+        relative_path = self.validatepath(path).strip("/")
+        items = []
+        with s3errors(path):
+            for page in client.get_paginator("list_objects_v2").paginate(Bucket=self._bucket_name, Prefix=prefix):
+                for obj in page.get("Contents", ()):
+                    name = obj["Key"][len(prefix):]
+                    items.append((relative_path + "/" + name, obj["Key"], new_prefix + name, obj["Size"]))
+
+        def copy(_, source_key, key, size):
+            with s3errors(source_key):
+                self._copy_key(source_key, key, size, part_size, max_concurrency)
+
+        copied = run_batch(copy, items, max_workers)
+        failed_keys = self._delete_keys((item[1] for item, result in zip(items, copied) if result.ok), max_workers)
+        return [
+            BatchResult(result.path, None, failed_keys.get(item[1])) if result.ok else result
+            for item, result in zip(items, copied)
+        ]
@@ -0,0 +1,124 @@
+"""Flask extension building the filesystem once per application."""
+from flask import abort
+from flask import current_app
+from flask import jsonify
+from flask import request
+from flask import send_file
+from fs.path import basename
+
+from .filesystem import EFS
+from .filesystem import EXTENSION_NAME
+from .tickets import ContentTooLarge
+
+
+class FlaskEFS:
+    """Build the app's filesystem once and keep it in ``app.extensions``.
+
+    :func:`efs.get_filesystem` then returns that instance instead of building a new backend on every call. The
+    instance is shared by every thread serving the app, which is safe: the backends are thread-safe and S3 clients
+    come from the process-wide :mod:`efs.pool`.
+
+    .. code-block:: python
+
+        storage = FlaskEFS()
+
+        def create_app():
+            app = Flask(__name__)
+            storage.init_app(app)
+            return app
+
+    With a :class:`~efs.metrics.MetricsCollector` as ``collector`` every operation of the filesystem is recorded,
+    and ``stats_rule`` (e.g. ``/_efs/stats``) serves the collected statistics as JSON. Protect that url like any
+    other internal endpoint.
+
+    Local upload and download tickets (see :meth:`~efs.filesystem.EFS.upload_ticket`) are served by
+    ``ticket_rule`` (e.g. ``/_efs/tickets``), whose external url goes in the ``EFS_TICKET_URL`` setting.
+    """
+
+    def __init__(self, app=None, filesystem_class=EFS, collector=None, stats_rule=None, ticket_rule=None, **options):
+        """Create the extension, registering it with ``app`` if given.
+
+        :param app: the Flask application.
+        :param filesystem_class: the class of the filesystem to build.
+        :param collector: a :class:`~efs.metrics.MetricsCollector` added to the filesystem hooks.
+        :param stats_rule: the url rule serving the collector statistics, not served if None.
+        :param ticket_rule: the url rule serving the local tickets, not served if None.
+        :param options: keyword arguments for the filesystem constructor, e.g. ``fast_upload=True``.
+        """
+        self.filesystem_class = filesystem_class
+        self.collector = collector
+        self.stats_rule = stats_rule
+        self.ticket_rule = ticket_rule
+        self.options = options
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Build the filesystem for the storage in ``app.config["DEFAULT_STORAGE"]`` and register it on ``app``."""
+        options = dict(self.options)
+        if self.collector is not None:
+            options["hooks"] = list(options.get("hooks") or ()) + [self.collector]
+            if self.stats_rule:
+                app.add_url_rule(self.stats_rule, "efs_stats", self.stats)
+        if self.ticket_rule:
+            app.add_url_rule(
+                self.ticket_rule.rstrip("/") + "/<token>", "efs_ticket", self.ticket, methods=["GET", "PUT", "POST"]
+            )
+        app.extensions[EXTENSION_NAME] = self.filesystem_class(
+            storage=app.config["DEFAULT_STORAGE"], config=app.config, **options
+        )
+
+    def stats(self):
+        """Return a JSON response with the statistics of the collector."""
+        return jsonify(operations=self.collector.snapshot())
+
+    def ticket(self, token):
+        """Serve a local ticket: send the file of a download ticket, or store the body of an upload one."""
+        filesystem = self.filesystem
+        try:
+            claims = filesystem.verify_ticket(token, request.method)
+        except PermissionError as error:
+            abort(403, str(error))
+        if request.method == "GET":
+            if not filesystem.home.isfile(claims.path):
+                abort(404)
+            if filesystem.home.hassyspath(claims.path):
+                response = send_file(
+                    filesystem.home.getsyspath(claims.path),
+                    as_attachment=bool(claims.filename),
+                    download_name=claims.filename,
+                )
+            else:
+                # Files kept in memory have no path, Flask then guesses their type from the download name
+                response = send_file(
+                    filesystem.home.openbin(claims.path),
+                    as_attachment=bool(claims.filename),
+                    download_name=claims.filename or basename(claims.path),
+                )
+            # Compressed files are sent as stored, like S3 does with their ContentEncoding
+            encoding = filesystem._attributes(claims.path).encoding
+            if encoding is not None:
+                response.headers["Content-Encoding"] = encoding
+            return response
+        if claims.max_size is not None and (request.content_length or 0) > claims.max_size:
+            abort(413)
+        if request.method == "POST":
+            if "file" not in request.files:
+                abort(400, "the form has no file field")
+            content = request.files["file"].stream
+        else:
+            content = request.stream
+        try:
+            result = filesystem.store_ticket_upload(claims, content)
+        except ContentTooLarge:
+            abort(413)
+        except PermissionError as error:
+            abort(403, str(error))
+        if claims.part is not None:
+            return "", 200, {"ETag": '"{}"'.format(result)}
+        return jsonify(path=result.path, size=result.size), 201
+
+    @property
+    def filesystem(self):
+        """The filesystem of the current app."""
+        return current_app.extensions[EXTENSION_NAME]
@@ -1,132 +1,1131 @@
 """The file system abstraction."""
+import contextlib
+import functools
+import hashlib
+import os
+import threading
+import time
 import urllib.parse
-from io import BytesIO
+import uuid
 
-from flask import current_app
+from fs import errors
+from fs.path import basename
+from fs.path import join
+from fs.path import normpath
+from fs.path import relpath
 
-from .eatfirst_osfs import EatFirstOSFS
-from .eatfirst_s3 import EatFirstS3
+from .batch import DEFAULT_BATCH_WORKERS
+from .batch import run_batch
+from .compression import decompress
+from .dedup import DEFAULT_BLOB_FOLDER
+from .dedup import MAX_POINTER_SIZE
+from .dedup import Pointer
+from .dedup import blob_path
+from .dedup import decode_pointer
+from .dedup import encode_pointer
+from .dedup import refs_path
+from .dedup import spool
+from .listing import FileEntry
+from .metrics import count_request
+from .metrics import instrumented
+from .records import NO_ATTRIBUTES
+from .records import POINTER_METADATA
+from .records import RECORDS_FOLDER
+from .records import RecordStore
+from .records import with_attributes
+from .streaming import DEFAULT_PART_SIZE
+from .streaming import DEFAULT_RANGE_SIZE
+from .streaming import iter_chunks
+from .sync import COPY
+from .sync import DELETE
+from .sync import SyncResult
+from .sync import SyncState
+from .sync import diff
+from .sync import rebase
+from .sync import sync_folder
+from .tickets import DEFAULT_TICKET_TTL
+from .tickets import UPLOADS_FOLDER
+from .tickets import MultipartTicket
+from .tickets import Ticket
+from .tickets import TicketClaims
+from .tickets import TicketSigner
+from .tickets import limit_size
+from .tickets import part_count
+
+#: The key the :class:`~efs.extension.FlaskEFS` extension stores the filesystem under in ``app.extensions``.
+EXTENSION_NAME = "efs"
 
 
 class EFS:
     """The EatFirst File system."""
 
-    def __init__(self, *args, storage="local", **kwargs):
-        """The constructor method of the filesystem abstraction."""
+    def __init__(
+        self,
+        *args,
+        storage="local",
+        part_size=DEFAULT_PART_SIZE,
+        max_concurrency=1,
+        batch_workers=DEFAULT_BATCH_WORKERS,
+        fast_upload=False,
+        config=None,
+        metadata_cache=None,
+        disk_cache=None,
+        dedup=False,
+        blob_folder=DEFAULT_BLOB_FOLDER,
+        compression=None,
+        hooks=None,
+        prefix_depth=1,
+        ticket_url=None,
+        ticket_secret=None,
+        on_direct_upload=None,
+        write_behind=None,
+        **kwargs
+    ):
+        """The constructor method of the filesystem abstraction.
+
+        :param storage: which backend to use: ``local``, ``s3``, ``memory`` (at most ``MEMORY_STORAGE_SIZE``
+            bytes) or ``tiered`` (the files up to ``MEMORY_STORAGE_FILE_SIZE`` bytes in memory, the others in
+            ``LOCAL_STORAGE``).
+        :param part_size: how many bytes of a streamed upload are held in memory at once, on S3 this is the
+            multipart upload part size.
+        :param max_concurrency: how many parts of a streamed upload are sent to S3 at the same time.
+        :param batch_workers: how many items of the ``*_many`` batch operations are processed at the same time.
+        :param fast_upload: skip the directory emulation on uploads, see :meth:`upload`.
+        :param config: the configuration to read the storage settings from, defaults to the current app's.
+        :param metadata_cache: a :class:`~efs.cache.MetadataCache` answering :meth:`exists`, :meth:`isdir` and
+            :meth:`getinfo` without asking the backend every time. It is kept up to date by the writes done through
+            this instance, so it should not be shared with instances of other storages.
+        :param disk_cache: a :class:`~efs.cache.DiskCache` keeping local copies of the S3 files read with
+            :meth:`open`. Ignored by the local storage.
+        :param dedup: store identical files once, see :meth:`upload`.
+        :param blob_folder: the folder deduplicated contents are stored in.
+        :param compression: a :class:`~efs.compression.CompressionPolicy` telling which uploads to compress.
+        :param hooks: callables receiving an :class:`~efs.metrics.OperationRecord` after every operation, e.g. a
+            :class:`~efs.metrics.MetricsCollector`. They run in the thread of the operation and must not raise.
+        :param prefix_depth: how many folders of the operation paths are kept in the records.
+        :param ticket_url: the url of the :class:`~efs.extension.FlaskEFS` ticket endpoint local tickets point to,
+            defaults to the ``EFS_TICKET_URL`` setting.
+        :param ticket_secret: the key local tickets are signed with, defaults to the ``SECRET_KEY`` setting.
+        :param on_direct_upload: called with the :class:`~efs.listing.FileEntry` of every file uploaded with a
+            ticket, once :meth:`complete_upload` confirmed it is stored.
+        :param write_behind: a :class:`~efs.writebehind.WriteBehind` spool, making :meth:`upload` return once the
+            content is written to it. The uploads it holds from a previous run are sent again.
+        """
         self.separator = kwargs.get("separator", "/")
         self.current_file = ""
-        if storage.lower() == "local":
-            self.home = EatFirstOSFS(current_app.config["LOCAL_STORAGE"], create=True, *args, **kwargs)
-        elif storage.lower() == "s3":
+        self.part_size = part_size
+        self.max_concurrency = max_concurrency
+        self.batch_workers = batch_workers
+        self.fast_upload = fast_upload
+        self._known_directories = set()
+        if config is None:
+            from flask import current_app
+
+            config = current_app.config
+        self.config = config
+        self.metadata_cache = metadata_cache
+        self.disk_cache = disk_cache
+        self.dedup = dedup
+        self.blob_folder = blob_folder
+        self.compression = compression
+        self.storage = storage.lower()
+        self.hooks = list(hooks or ())
+        self.prefix_depth = prefix_depth
+        self._watched_client = None
+        self._url_builders = {}
+        self.ticket_url = ticket_url or self.config.get("EFS_TICKET_URL")
+        self.ticket_secret = ticket_secret or self.config.get("SECRET_KEY")
+        self.on_direct_upload = on_direct_upload
+        # Backends are imported with their first instance, so local deployments never load boto3
+        if self.storage == "local":
+            from .eatfirst_osfs import EatFirstOSFS
+
+            self.home = EatFirstOSFS(self.config["LOCAL_STORAGE"], create=True, *args, **kwargs)
+        elif self.storage == "s3":
+            from .eatfirst_s3 import EatFirstS3
+
             self.home = EatFirstS3(
-                current_app.config["S3_BUCKET"],
+                self.config["S3_BUCKET"],
                 # We always called make_public after upload, with this we do one less call to aws API
                 acl="public-read",
                 *args,
                 **kwargs
             )
+        elif self.storage == "memory":
+            from .eatfirst_memoryfs import EatFirstMemoryFS
+
+            self.home = EatFirstMemoryFS(self.config.get("MEMORY_STORAGE_SIZE"))
+        elif self.storage == "tiered":
+            from .eatfirst_memoryfs import EatFirstMemoryFS
+            from .eatfirst_osfs import EatFirstOSFS
+            from .tiered import DEFAULT_MAX_MEMORY_FILE_SIZE
+            from .tiered import TieredFS
+
+            self.home = TieredFS(
+                EatFirstMemoryFS(self.config.get("MEMORY_STORAGE_SIZE")),
+                EatFirstOSFS(self.config["LOCAL_STORAGE"], create=True, *args, **kwargs),
+                self.config.get("MEMORY_STORAGE_FILE_SIZE", DEFAULT_MAX_MEMORY_FILE_SIZE),
+            )
         else:
             raise RuntimeError("{} does not support {} storage".format(self.__class__.__name__, storage))
+        # Backends without metadata keep the attributes of the files in records
+        self._records = None if hasattr(self.home, "attributes") else RecordStore(self.home)
+        self.write_behind = write_behind
+        if write_behind is not None:
+            write_behind.start(self)
 
-    def upload(self, path, content, content_type=None):
+    @instrumented("upload", sized=True)
+    def upload(
+        self,
+        path,
+        content,
+        content_type=None,
+        part_size=None,
+        max_concurrency=None,
+        on_part=None,
+        fast=None,
+        cache_control=None,
+        metadata=None,
+        storage_class=None,
+        write_behind=None,
+    ):
         """Upload a file and return its size in bytes.
 
+        ``bytes`` and ``str`` are written in one go, anything else (``BytesIO``, an open file or any iterable of
+        bytes) is streamed in chunks of ``part_size`` bytes so the whole payload is never held in memory.
+        ``bytearray``, ``memoryview`` and ``mmap`` contents are uploaded in place, without copies. Local files,
+        given as an open file, a :class:`pathlib.Path` or a file descriptor, are copied by the kernel to the local
+        storage and read one part at a time for S3.
+
+        By default parent directories are created and the file is created empty before being written. A fast
+        upload skips that: on S3, which has no directories, the object is written with a single ``PutObject``,
+        and locally missing parent directories are created once per directory and remembered.
+
+        With ``dedup`` the content is hashed while it is copied to a temporary file (kept in memory up to
+        ``part_size`` bytes) and only uploaded if no file with the same content and extension was uploaded before.
+        ``path`` then holds a small pointer to the stored content, which :meth:`open`, :meth:`file_url`,
+        :meth:`move` and :meth:`remove` follow. The content is removed with the last path pointing to it. The
+        content type of a deduplicated file is the one of its first upload.
+
+        With a ``compression`` policy, files of the content types it lists are compressed while they are uploaded
+        and stored with a ``ContentEncoding`` on S3. :meth:`open` decompresses them.
+
         :param path: the relative path to file, including filename.
-        :param content: the content to be written.
+        :param content: the content to be written, or the ``os.PathLike`` path or descriptor of a local file.
         :param content_type: Enforce content-type on destination.
-        :return: size of the saved file.
+        :param part_size: override the instance ``part_size`` for this upload.
+        :param max_concurrency: override the instance ``max_concurrency`` for this upload.
+        :param on_part: called with a :class:`~efs.streaming.PartReport` (number, size and seconds taken) for
+            every part of a streamed upload.
+        :param fast: override the instance ``fast_upload`` for this upload.
+        :param cache_control: the ``Cache-Control`` header S3 serves the file with.
+        :param metadata: a dict of user metadata stored with the S3 object.
+        :param storage_class: the S3 storage class, e.g. ``STANDARD_IA``.
+        :param write_behind: False to upload now even if the filesystem has a ``write_behind`` spool. Spooled
+            uploads return once the content is in the spool, :meth:`open` and :meth:`exists` read it from there
+            until it is sent, and ``on_part`` is not called.
+        :return: size of the saved file, after compression, or of the spooled content.
         """
+        # The options are passed down with each call instead of being set on the backend, so threads sharing this
+        # instance never see each other's options
+        upload_args = {
+            key: value
+            for key, value in (
+                ("ContentType", content_type),
+                ("CacheControl", cache_control),
+                ("Metadata", metadata),
+                ("StorageClass", storage_class),
+            )
+            if value
+        }
+        encoding = None if self.compression is None else self.compression.encoding_for(path, content_type)
+        with contextlib.ExitStack() as stack:
+            if isinstance(content, (os.PathLike, int)):
+                # Descriptors belong to the caller, only the files opened from paths are closed
+                content = stack.enter_context(open(content, "rb", closefd=not isinstance(content, int)))
+            if self.write_behind is not None and write_behind is not False:
+                options = {
+                    "content_type": content_type,
+                    "fast": fast,
+                    "cache_control": cache_control,
+                    "metadata": metadata,
+                    "storage_class": storage_class,
+                }
+                return self.write_behind.submit(path, content, options)
+            if self.dedup:
+                return self._upload_deduplicated(
+                    path, content, upload_args, part_size, max_concurrency, on_part, fast, encoding
+                )
+            return self._write(path, content, upload_args, part_size, max_concurrency, on_part, fast, encoding)
+
+    def _write(
+        self,
+        path,
+        content,
+        upload_args=None,
+        part_size=None,
+        max_concurrency=None,
+        on_part=None,
+        fast=None,
+        encoding=None,
+        attributes=NO_ATTRIBUTES,
+    ):
+        """Upload ``content`` to ``path``, compressed with ``encoding`` if given, see :meth:`upload`.
+
+        :param upload_args: extra arguments of the S3 ``PutObject`` or ``CreateMultipartUpload`` request.
+        :param attributes: the :class:`~efs.records.FileAttributes` of ``content`` as given, e.g. the encoding of
+            content that is already compressed.
+        """
+        fast = self.fast_upload if fast is None else fast
+        part_size = part_size or self.part_size
         path_list = path.split(self.separator)
-        if len(path_list) > 1:
-            self.home.makedirs(self.separator.join(path_list[:-1]), recreate=True)
-        self.home.create(path, wipe=False)
-
-        # s3fs' API sucks and we have to set the content type on construction
-        # assuming this will always be called in a synchronous way, we just override the inner variable (O.o) and
-        # restore it back
-        content_type_key = "ContentType"
-        has_upload_args = hasattr(self.home, "upload_args")
-        old_content_type_exists = False
-        old_content_type = None
-
-        if has_upload_args and content_type:
-            old_content_type_exists = content_type_key in self.home.upload_args
-            old_content_type = self.home.upload_args.pop(content_type_key, None)
-            self.home.upload_args[content_type_key] = content_type
-
-        if isinstance(content, BytesIO):
-            # TODO: The underlying library only expects bytes instead of verifying what is coming
-            # maybe we should send a pr as this can result in more memory usage
-            content = content.read()
-        if isinstance(content, str):
-            content = content.encode()
-        self.home.setbytes(path, content)
-
-        if has_upload_args:
-            if old_content_type_exists:
-                self.home.upload_args[content_type_key] = old_content_type
+        directory = self.separator.join(path_list[:-1])
+        if not fast:
+            if directory:
+                self.home.makedirs(directory, recreate=True)
+            self.home.create(path, wipe=False)
+        elif self.home.needs_directories and directory and directory not in self._known_directories:
+            self.home.makedirs(directory, recreate=True)
+            self._known_directories.add(directory)
+
+        try:
+            if isinstance(content, str):
+                content = content.encode()
+            if encoding is not None:
+                content = self.compression.compress(iter_chunks(content, part_size), encoding)
+                attributes = attributes._replace(encoding=encoding)
+            if self._records is None:
+                upload_args = with_attributes(upload_args, attributes)
+            if isinstance(content, bytes) and not fast and not upload_args:
+                self.home.setbytes(path, content)
+                size = len(content)
             else:
-                self.home.upload_args.pop(content_type_key, None)
+                size = self.home.upload_stream(
+                    path,
+                    content,
+                    part_size,
+                    max_concurrency=max_concurrency or self.max_concurrency,
+                    on_part=on_part,
+                    upload_args=upload_args,
+                )
+            if self._records is not None:
+                self._records.set(path, attributes)
+        except Exception:
+            if self.metadata_cache is not None:
+                self.metadata_cache.invalidate_tree(path)
+                self.metadata_cache.invalidate_parents(path)
+            raise
+        if self.metadata_cache is not None:
+            self.metadata_cache.set_file(path)
+        if self.disk_cache is not None:
+            self.disk_cache.invalidate(path)
+        return size
 
-    def open(self, path, *args, **kwargs):
+    def _upload_deduplicated(
+        self, path, content, upload_args, part_size, max_concurrency, on_part, fast, encoding
+    ):
+        """Store ``content`` once under its hash and point ``path`` to it, see :meth:`upload`."""
+        part_size = part_size or self.part_size
+        copy, digest, size = spool(content, part_size)
+        blob = blob_path(self.blob_folder, digest, path)
+        pointer = Pointer(blob, uuid.uuid4().hex, size)
+        ref = "{}/{}".format(refs_path(blob), pointer.ref)
+        with copy:
+            # Referencing the blob before storing it means it never exists without a reference
+            self._write(ref, b"", fast=True)
+            try:
+                if not self.home.exists(blob):
+                    self._write(blob, copy, upload_args, part_size, max_concurrency, on_part, fast, encoding)
+                previous = self._replaced_pointer(path)
+                self._write(path, encode_pointer(pointer), fast=fast, attributes=NO_ATTRIBUTES._replace(pointer=True))
+            except Exception:
+                with contextlib.suppress(errors.ResourceNotFound):
+                    self.home.remove(ref)
+                raise
+        if self.metadata_cache is not None:
+            self.metadata_cache.set(path, "pointer", pointer)
+        if previous is not None:
+            self._release(previous)
+        return size
+
+    def _attributes(self, path):
+        """Return the :class:`~efs.records.FileAttributes` the file at ``path`` was stored with."""
+        load = self.home.attributes if self._records is None else self._records.get
+        if self.metadata_cache is None:
+            return load(path)
+        return self.metadata_cache.get_or_load(path, "attributes", lambda: load(path))
+
+    def _read_pointer(self, path):
+        """Return the :class:`~efs.dedup.Pointer` stored at ``path``, or None if it is a regular file.
+
+        Only the files written as pointers are read, whatever the content of the others looks like.
+        """
+        if not self._attributes(path).pointer:
+            return None
+        with self.home.open_ranged(path, MAX_POINTER_SIZE, read_ahead=0) as file:
+            return decode_pointer(file.read(MAX_POINTER_SIZE), self.blob_folder)
+
+    def _pointer(self, path):
+        """Return the pointer stored at ``path``, or None if it is a regular file.
+
+        Pointers are followed whether this instance deduplicates its uploads or not.
+        """
+        if self.metadata_cache is None:
+            return self._read_pointer(path)
+        return self.metadata_cache.get_or_load(path, "pointer", lambda: self._read_pointer(path))
+
+    def _replaced_pointer(self, path):
+        """Return the pointer of the file at ``path`` that is about to be replaced, or None."""
+        try:
+            return self._pointer(path)
+        except (errors.ResourceNotFound, errors.FileExpected):
+            return None
+
+    def _resolve(self, path):
+        """Return the path of the blob ``path`` points to, or ``path`` itself if it is a regular file or missing."""
+        pointer = self._replaced_pointer(path)
+        return path if pointer is None else pointer.blob
+
+    def _pointers_in(self, path):
+        """Return the pointers of every deduplicated file under the folder ``path``."""
+        pointers = []
+        for entry in self.iter_files(path):
+            if entry.size <= MAX_POINTER_SIZE:
+                pointer = self._read_pointer(entry.path)
+                if pointer is not None:
+                    pointers.append(pointer)
+        return pointers
+
+    def _referenced(self, blob):
+        """Whether any pointer holds a reference to ``blob``."""
+        return next(iter(self.home.iter_files(refs_path(blob), recursive=False)), None) is not None
+
+    def _release(self, pointer):
+        """Drop the reference owned by ``pointer``, removing its blob if it was the last one.
+
+        The blob is moved aside before the references are checked again, and moved back if an upload of the same
+        content referenced it in between: that upload found the blob and did not store it again.
+        """
+        blob = pointer.blob
+        with contextlib.suppress(errors.ResourceNotFound):
+            self.home.remove("{}/{}".format(refs_path(blob), pointer.ref))
+        if self._referenced(blob):
+            return
+        released = "{}.{}.released".format(blob, uuid.uuid4().hex)
+        try:
+            self._move(blob, released, overwrite=True)
+        except errors.ResourceNotFound:
+            # Another release of the last reference removed it
+            released = None
+        if released is not None and self._referenced(blob):
+            self._move(released, blob, overwrite=True)
+        elif released is not None:
+            self.home.remove(released)
+            if self._records is not None:
+                self._records.remove(released)
+            if self.home.needs_directories:
+                with contextlib.suppress(errors.ResourceNotFound, errors.DirectoryNotEmpty):
+                    self.home.removedir(refs_path(blob))
+        if self.metadata_cache is not None:
+            self.metadata_cache.invalidate_tree(blob)
+        if self.disk_cache is not None:
+            self.disk_cache.invalidate(blob)
+
+    @instrumented("open")
+    def open(self, path, *args, ranged=False, range_size=DEFAULT_RANGE_SIZE, read_ahead=1, **kwargs):
         """Open a file and return a file pointer.
 
         :param path: the relative path to file, including filename.
-        :return: a pointer to the file.
+        :param ranged: return a read-only file that fetches byte ranges as they are read instead of downloading
+            the whole file first. Good for reading headers or slices of big S3 objects.
+        :param range_size: how many bytes each ranged read fetches.
+        :param read_ahead: how many ranges after the current one are fetched in the background, they are fetched
+            by up to ``max_concurrency`` parallel requests.
+        :return: a pointer to the file, which reads the decompressed content of compressed files.
         """
         # Maybe we should store paths as relative paths to avoid having to do this
         root_path = getattr(self.home, "_root_path", None)
         path = path.replace(root_path, "") if root_path else path
-        if not self.home.exists(path):
+        if self.write_behind is not None:
+            spooled = self.write_behind.open(path)
+            if spooled is not None:
+                return spooled
+        if not self.exists(path):
             exp = FileNotFoundError()
             exp.filename = path
             raise exp
-        return self.home.openbin(path, *args, **kwargs)
+        # Files are decoded as they were stored, whatever the policies of this instance
+        attributes = self._attributes(path)
+        if attributes.pointer:
+            path = self._resolve(path)
+            attributes = self._attributes(path)
+        encoding = attributes.encoding
+        if ranged:
+            file = self.home.open_ranged(path, range_size, read_ahead, max_concurrency=self.max_concurrency)
+        elif self.disk_cache is not None and hasattr(self.home, "download_if_changed"):
+            file = self.disk_cache.open(self.home, path)
+        else:
+            file = self.home.openbin(path, *args, **kwargs)
+        return file if encoding is None else decompress(file, encoding)
 
-    def remove(self, path):
+    @instrumented("remove")
+    def remove(self, path, dry_run=False, on_progress=None):
         """Remove a file or folder.
 
+        On S3 folders are listed and deleted a page of 1000 objects at a time, ``batch_workers`` pages at once.
+
         :param path: the relative path to file, including filename.
+        :param dry_run: only count what would be removed.
+        :param on_progress: called with the number of files removed (or counted) so far while removing a folder.
+        :return: the number of files removed.
         """
-        if self.home.isdir(path):
-            self.home.removetree(path)
-        else:
-            self.home.remove(path)
+        self._wait_spooled(path)
+        if self.write_behind is not None and not dry_run:
+            self.write_behind.discard(path)
+        if dry_run:
+            if self.isdir(path):
+                return self.home.remove_tree(path, self.batch_workers, on_progress, dry_run=True)
+            return int(self.exists(path))
+        pointers = ()
+        try:
+            if self.isdir(path):
+                if self.dedup:
+                    pointers = self._pointers_in(path)
+                count = self.home.remove_tree(path, self.batch_workers, on_progress)
+                directory = path.strip(self.separator)
+                self._known_directories = {
+                    known for known in self._known_directories
+                    if known != directory and not known.startswith(directory + self.separator)
+                }
+            else:
+                pointer = self._pointer(path)
+                pointers = () if pointer is None else (pointer,)
+                self.home.remove(path)
+                count = 1
+            if self._records is not None:
+                self._records.remove(path)
+        except Exception:
+            if self.metadata_cache is not None:
+                self.metadata_cache.invalidate_tree(path)
+            raise
+        finally:
+            if self.disk_cache is not None:
+                self.disk_cache.invalidate(path)
+        if self.metadata_cache is not None:
+            self.metadata_cache.set_missing(path)
+        for pointer in pointers:
+            self._release(pointer)
+        return count
 
+    @instrumented("rename")
     def rename(self, path, new_path):
-        """Rename a file.
+        """Rename a file or folder.
 
         :param path: the relative path to file, including filename.
         :param new_path: the relative path to new file, including new filename.
         """
-        self.home.move(path, new_path)
+        self._wait_spooled(path, new_path)
+        try:
+            self._move(path, new_path, overwrite=False)
+        finally:
+            self._moved(path, new_path)
 
+    @instrumented("move")
     def move(self, path, new_path):
-        """Move a file.
+        """Move a file or folder, replacing the destination if it exists.
+
+        On S3 objects are copied inside S3 then deleted, never downloaded. Folders are moved object by object,
+        ``batch_workers`` at a time, and objects over 5 GiB are copied in parts, ``max_concurrency`` at a time.
 
         :param path: the relative path to file, including filename.
         :param new_path: the relative path to new file, including filename.
         """
         path_list = new_path.split(self.separator)
-        if len(path_list) > 1:
-            self.home.makedir(self.separator.join(path_list[:-1]), recreate=True)
-        self.home.move(path, new_path, overwrite=True)
+        if self.home.needs_directories and len(path_list) > 1:
+            self.home.makedirs(self.separator.join(path_list[:-1]), recreate=True)
+        self._wait_spooled(path, new_path)
+        replaced = self._replaced_pointer(new_path)
+        try:
+            self._move(path, new_path, overwrite=True)
+        finally:
+            self._moved(path, new_path)
+        if replaced is not None:
+            self._release(replaced)
+
+    def _wait_spooled(self, *paths):
+        """Wait for the spooled uploads to ``paths``, so the operation changing them is applied after them."""
+        if self.write_behind is not None:
+            for path in paths:
+                self.write_behind.wait(path)
+
+    def _move(self, path, new_path, overwrite):
+        """Move a file or folder with the fastest method the backend has."""
+        if not hasattr(self.home, "move_object"):
+            if self.home.isdir(path):
+                self.home.movedir(path, new_path, create=True)
+            else:
+                self.home.move(path, new_path, overwrite=overwrite)
+            if self._records is not None:
+                self._records.move(path, new_path)
+            return
+        try:
+            self.home.move_object(path, new_path, overwrite=overwrite, max_concurrency=self.max_concurrency)
+        except errors.ResourceNotFound:
+            if not self.home.isdir(path):
+                raise
+            results = self.home.move_tree(
+                path, new_path, max_concurrency=self.max_concurrency, max_workers=self.batch_workers
+            )
+            for result in results:
+                if not result.ok:
+                    raise result.error
+
+    def _moved(self, path, new_path):
+        """Update the metadata cache after moving ``path`` to ``new_path``, or failing to."""
+        if self.metadata_cache is not None:
+            self.metadata_cache.invalidate_tree(path)
+            self.metadata_cache.invalidate_tree(new_path)
+            self.metadata_cache.invalidate_parents(new_path)
+        if self.disk_cache is not None:
+            self.disk_cache.invalidate(path)
+            self.disk_cache.invalidate(new_path)
+
+    @instrumented("exists")
+    def exists(self, path):
+        """Check if a file or folder exists.
+
+        :param path: the relative path to file or folder.
+        """
+        if self.write_behind is not None and self.write_behind.spooled(path):
+            return True
+        if self.metadata_cache is None:
+            return self.home.exists(path)
+        return self.metadata_cache.get_or_load(path, "exists", lambda: self.home.exists(path))
+
+    @instrumented("isdir")
+    def isdir(self, path):
+        """Check if a path is an existing folder.
+
+        :param path: the relative path to folder.
+        """
+        if self.write_behind is not None and self.write_behind.spooled_folder(path):
+            return True
+        if self.metadata_cache is None:
+            return self.home.isdir(path)
+        return self.metadata_cache.get_or_load(path, "isdir", lambda: self.home.isdir(path))
+
+    @instrumented("getinfo")
+    def getinfo(self, path, namespaces=None):
+        """Get the :class:`fs.info.Info` of a file or folder.
+
+        :param path: the relative path to file or folder.
+        :param namespaces: the info namespaces to fetch, e.g. ``["details"]``.
+        """
+        if self.metadata_cache is None:
+            return self.home.getinfo(path, namespaces)
+        kind = ("getinfo",) + tuple(sorted(namespaces or ()))
+        return self.metadata_cache.get_or_load(path, kind, lambda: self.home.getinfo(path, namespaces))
+
+    def iter_files(self, prefix="", recursive=True):
+        """Lazily list the files in a folder.
+
+        Entries are yielded while the folder is read, so memory does not grow with the number of files. On S3 the
+        prefix is listed flat, a page of 1000 keys per request, instead of one request per folder.
+
+        .. code-block:: python
+
+            total = sum(entry.size for entry in fs.iter_files('exports'))
+
+        :param prefix: the relative path to folder, the root by default.
+        :param recursive: also list the files of the sub folders.
+        :return: an iterator of :class:`~efs.listing.FileEntry` (path, size, mtime and etag, which is ``None``
+            locally). Files still in the ``write_behind`` spool are listed last, with the size of their content.
+        """
+        entries = self.home.iter_files(prefix, recursive)
+        if self._records is not None:
+            entries = (entry for entry in entries if not entry.path.startswith(RECORDS_FOLDER + "/"))
+        if self.write_behind is not None:
+            entries = self._with_spooled(entries, self.write_behind.entries(prefix, recursive))
+        return entries
+
+    @staticmethod
+    def _with_spooled(entries, spooled):
+        """Yield the listed ``entries``, replacing the ones of the ``spooled`` files, then the other spooled files."""
+        spooled = {entry.path: entry for entry in spooled}
+        for entry in entries:
+            if entry.path not in spooled:
+                yield entry
+        yield from spooled.values()
+
+    def upload_many(self, items, max_workers=None, **options):
+        """Upload many files at once.
+
+        Content types are guessed from the file extensions unless given in ``options``.
+
+        :param items: an iterable of ``(path, content)`` pairs, see :meth:`upload`.
+        :param max_workers: override the instance ``batch_workers`` for this batch.
+        :param options: the options of every upload, e.g. ``cache_control``, see :meth:`upload`.
+        :return: a list of :class:`~efs.batch.BatchResult` with the uploaded sizes, in the same order as ``items``.
+        """
+        return run_batch(functools.partial(self.upload, **options), items, max_workers or self.batch_workers)
+
+    @instrumented("remove_many", prefixed=False)
+    def remove_many(self, paths, max_workers=None):
+        """Remove many files or folders at once.
+
+        On S3 files are removed with ``DeleteObjects`` requests of up to 1000 keys, in which case removing a
+        missing file is not an error and folders are not removed recursively. With ``dedup`` files are removed one
+        by one with :meth:`remove`, so that their contents are released.
+
+        :param paths: an iterable of relative paths.
+        :param max_workers: override the instance ``batch_workers`` for this batch.
+        :return: a list of :class:`~efs.batch.BatchResult`, in the same order as ``paths``.
+        """
+        max_workers = max_workers or self.batch_workers
+        if hasattr(self.home, "remove_many") and not self.dedup:
+            paths = list(paths)
+            self._wait_spooled(*paths)
+            if self.write_behind is not None:
+                for path in paths:
+                    self.write_behind.discard(path)
+            results = self.home.remove_many(paths, max_workers)
+            if self.metadata_cache is not None:
+                # Only the keys are removed, a folder with the same name may still be there
+                for result in results:
+                    self.metadata_cache.invalidate_tree(result.path)
+            if self.disk_cache is not None:
+                for result in results:
+                    self.disk_cache.invalidate(result.path)
+            return results
+        return run_batch(self.remove, ((path,) for path in paths), max_workers)
+
+    def move_many(self, moves, max_workers=None):
+        """Move many files at once.
+
+        :param moves: an iterable of ``(path, new_path)`` pairs, see :meth:`move`.
+        :param max_workers: override the instance ``batch_workers`` for this batch.
+        :return: a list of :class:`~efs.batch.BatchResult`, in the same order as ``moves``.
+        """
+        return run_batch(self.move, moves, max_workers or self.batch_workers)
 
+    @instrumented("sync")
+    def sync(
+        self,
+        prefix,
+        destination,
+        destination_prefix=None,
+        delete=False,
+        max_workers=None,
+        state_file=None,
+        dry_run=False,
+        on_progress=None,
+    ):
+        """Mirror a folder to another filesystem, copying only the files that changed.
+
+        Both folders are listed with :meth:`iter_files`. A file is copied if it is missing from the destination,
+        has another size or ETag, or was modified after its copy, see :func:`~efs.sync.needs_copy`. Files are
+        copied as stored, compressed or not, with their S3 headers and metadata, ``max_workers`` at a time: inside
+        S3 between buckets, streamed from one backend to the other otherwise, so a local folder and an S3 prefix can
+        be synced in both directions. Deduplicated files are pointers, sync the blob folder with them.
+
+        With a ``state_file`` the plan and every finished copy or deletion are recorded in a local file, which is
+        removed once everything succeeded. Running the same sync again after an interruption or failures resumes
+        the plan, without listing both sides again.
+
+        .. code-block:: python
+
+            staging = EFS(storage='local', config={'LOCAL_STORAGE': '/srv/staging'})
+            result = fs.sync('exports', staging, delete=True, state_file='/tmp/exports.sync')
+
+        :param prefix: the relative path to the folder to mirror, the root by default.
+        :param destination: the :class:`EFS` to copy the files to, e.g. one with another storage.
+        :param destination_prefix: the folder of ``destination`` to mirror to, defaults to ``prefix``.
+        :param delete: also delete the destination files missing from the source.
+        :param max_workers: override the instance ``batch_workers`` for this sync.
+        :param state_file: the local path of the file recording the progress.
+        :param dry_run: only work out what would be copied and deleted.
+        :param on_progress: called with the number of files copied or deleted so far.
+        :return: a :class:`~efs.sync.SyncResult`.
+        """
+        prefix = sync_folder(prefix)
+        destination_prefix = prefix if destination_prefix is None else sync_folder(destination_prefix)
+        state = None
+        actions = None
+        skipped = 0
+        if state_file is not None and not dry_run:
+            header = {
+                "source": [self.storage, prefix],
+                "destination": [destination.storage, destination_prefix],
+                "delete": delete,
+            }
+            state = SyncState(state_file, header)
+            actions = state.load()
+        if actions is None:
+            actions, skipped = diff(
+                rebase(self.iter_files(prefix), prefix),
+                rebase(destination.iter_files(destination_prefix), destination_prefix),
+                delete,
+            )
+            if state is not None:
+                state.start(actions)
+        else:
+            state.resume()
+        copies = [path for action, path in actions if action == COPY]
+        deletions = [path for action, path in actions if action == DELETE]
+        if dry_run:
+            return SyncResult(copies, deletions, skipped, [])
+
+        lock = threading.Lock()
+        finished = [0]
+
+        def done(action, path):
+            if state is not None:
+                state.done(action, path)
+            if on_progress is not None:
+                with lock:
+                    finished[0] += 1
+                    count = finished[0]
+                on_progress(count)
+
+        def copy(path):
+            size = self._copy_to(join(prefix, path), destination, join(destination_prefix, path))
+            done(COPY, path)
+            return size
+
+        failed = []
+        try:
+            results = run_batch(copy, ((path,) for path in copies), max_workers or self.batch_workers)
+            failed.extend(result for result in results if not result.ok)
+            if deletions:
+                removed = destination.remove_many(
+                    [join(destination_prefix, path) for path in deletions], max_workers or self.batch_workers
+                )
+                for path, result in zip(deletions, removed):
+                    if result.ok:
+                        done(DELETE, path)
+                    else:
+                        failed.append(result._replace(path=path))
+        except BaseException:
+            if state is not None:
+                state.close(finished=False)
+            raise
+        if state is not None:
+            state.close(finished=not failed)
+        failures = {result.path for result in failed}
+        return SyncResult(
+            [path for path in copies if path not in failures],
+            [path for path in deletions if path not in failures],
+            skipped,
+            failed,
+        )
+
+    def _copy_to(self, path, destination, new_path):
+        """Copy the file at ``path`` to ``new_path`` of the ``destination`` filesystem, as stored.
+
+        Between S3 buckets the file is copied inside S3, otherwise it is streamed. S3 headers and metadata are kept
+        either way.
+
+        :return: the number of bytes copied.
+        """
+        if hasattr(destination.home, "copy_from") and destination.home.copies_from(self.home):
+            size = destination.home.copy_from(self.home, path, new_path, max_concurrency=destination.max_concurrency)
+            if destination.metadata_cache is not None:
+                destination.metadata_cache.invalidate_parents(new_path)
+                destination.metadata_cache.set_file(new_path)
+            if destination.disk_cache is not None:
+                destination.disk_cache.invalidate(new_path)
+            return size
+        attributes = self._attributes(path)
+        upload_args = None
+        if hasattr(self.home, "upload_args_of") and destination._records is None:
+            upload_args = self.home.upload_args_of(path)
+        with self.home.open_ranged(path, self.part_size, max_concurrency=self.max_concurrency) as file:
+            # The destination policies are skipped, the file is already compressed or deduplicated as it should be
+            return destination._write(new_path, file, upload_args, fast=True, attributes=attributes)
+
+    def _watch_requests(self):
+        """Count the S3 requests made by the instrumented operations, see :mod:`efs.metrics`."""
+        client = getattr(self.home, "client", None)
+        if client is not None and client is not self._watched_client:
+            client.meta.events.register("before-call.s3", count_request, unique_id="efs.metrics.count_request")
+            self._watched_client = client
+
+    def _url_builder(self):
+        """Return the URL builder of the backend for the current CDN setting, or None if it has none."""
+        if not hasattr(self.home, "public_url_builder"):
+            return None
+        cdn_host = self.config.get("S3_CDN_URL", None)
+        builder = self._url_builders.get(cdn_host)
+        if builder is None:
+            builder = self._url_builders[cdn_host] = self.home.public_url_builder(cdn_host)
+        return builder
+
+    @instrumented("file_url")
     def file_url(self, path, with_cdn=True):
         """Get a file url.
 
+        S3 files are public, so their URL is built from the bucket URL, which is computed once per instance.
+
         :param path: the relative path to file, including filename.
         :param with_cdn: specify if the url should return with the cdn information, only used for images.
         """
+        # URLs are built without any request, only filesystems deduplicating uploads look up pointers
+        if self.dedup:
+            path = self._resolve(path)
+        builder = self._url_builder()
+        if builder is not None:
+            return builder.url(path, with_cdn)
         url = self.home.geturl(path)
-        if current_app.config.get("S3_CDN_URL", None) and with_cdn:
+        if self.config.get("S3_CDN_URL", None) and with_cdn:
             parsed_url = urllib.parse.urlparse(url)
-            url = url.replace(parsed_url.hostname, current_app.config["S3_CDN_URL"])
+            url = url.replace(parsed_url.hostname, self.config["S3_CDN_URL"])
         url = url.split("?")[0]  # Remove any trace of query string
         url = url.replace("http://", "https://")
         return url
 
+    @instrumented("file_urls", prefixed=False)
+    def file_urls(self, paths, with_cdn=True):
+        """Get the urls of many files, see :meth:`file_url`.
+
+        :param paths: an iterable of relative paths to files.
+        :param with_cdn: specify if the urls should return with the cdn information.
+        :return: a list of urls, in the same order as ``paths``.
+        """
+        if self.dedup:
+            paths = map(self._resolve, paths)
+        builder = self._url_builder()
+        if builder is not None:
+            return builder.urls(paths, with_cdn)
+        return [self.file_url(path, with_cdn) for path in paths]
+
+    def _local_ticket(self, claims, expires_in):
+        """Return the url of a local ticket granting ``claims`` and the timestamp it expires at."""
+        if not self.ticket_url:
+            raise RuntimeError("local tickets need a ticket_url, or the EFS_TICKET_URL setting")
+        expires = int(time.time()) + expires_in
+        return TicketSigner(self.ticket_secret, self.ticket_url).sign(claims, expires), expires
+
+    def _check_ticket_path(self, path):
+        """Refuse tickets writing to the blobs, records or uploads in progress.
+
+        :raise PermissionError: if ``path`` is in one of these folders.
+        """
+        path = relpath(normpath(path))
+        for folder in (self.blob_folder, RECORDS_FOLDER, UPLOADS_FOLDER):
+            if path == folder or path.startswith(folder + "/"):
+                raise PermissionError("{} is kept by the filesystem".format(folder))
+
+    def upload_ticket(
+        self,
+        path,
+        content_type=None,
+        expires_in=DEFAULT_TICKET_TTL,
+        max_size=None,
+        post=False,
+        cache_control=None,
+        metadata=None,
+    ):
+        """Return a :class:`~efs.tickets.Ticket` letting a client upload a file without sending it through the app.
+
+        On S3 the ticket is a presigned PUT, or form POST, straight to the bucket; once the client reports it is
+        done, call :meth:`complete_upload`. Local tickets point to the ticket endpoint of
+        :class:`~efs.extension.FlaskEFS`, which stores the request body (or the ``file`` field of the form) and
+        completes the upload itself. Files uploaded with tickets are stored as sent, without compression or
+        deduplication.
+
+        .. code-block:: python
+
+            ticket = fs.upload_ticket('avatars/42.png', content_type='image/png', max_size=2 ** 20, post=True)
+            return jsonify(ticket._asdict())
+
+        :param path: the relative path to file, including filename.
+        :param content_type: the content type the client has to upload the file with.
+        :param expires_in: how many seconds the ticket is valid for.
+        :param max_size: the largest file accepted, in bytes. S3 can only enforce it for POST tickets.
+        :param post: return a ticket for a form POST instead of a PUT.
+        :param cache_control: the ``Cache-Control`` header S3 serves the file with.
+        :param metadata: a dict of user metadata stored with the S3 object.
+        :raise PermissionError: if ``path`` is in a folder the filesystem keeps for itself.
+        """
+        self._check_ticket_path(path)
+        if hasattr(self.home, "presign_upload"):
+            upload_args = {
+                key: value
+                for key, value in (("ContentType", content_type), ("CacheControl", cache_control), ("Metadata", metadata))
+                if value
+            }
+            upload_args = with_attributes(upload_args, NO_ATTRIBUTES)
+            return self.home.presign_upload(path, expires_in, upload_args, max_size, post)
+        method = "POST" if post else "PUT"
+        url, expires = self._local_ticket(
+            TicketClaims(path, method, content_type, max_size, None, None, None), expires_in
+        )
+        return Ticket(path, method, url, {}, {}, expires)
+
+    def multipart_ticket(self, path, size, part_size=None, content_type=None, expires_in=DEFAULT_TICKET_TTL):
+        """Start an upload sent by the client in parts, and return a :class:`~efs.tickets.MultipartTicket`.
+
+        The client sends each part with a PUT to its url, then the app calls :meth:`complete_upload` with the
+        ``upload_id`` and the ``ETag`` header of every part response, or :meth:`abort_upload` to give up.
+
+        :param path: the relative path to file, including filename.
+        :param size: the size of the file, in bytes.
+        :param part_size: override the instance ``part_size``, S3 grows it to need at most 10000 parts.
+        :param content_type: the content type of the file.
+        :param expires_in: how many seconds the part urls are valid for.
+        :raise PermissionError: if ``path`` is in a folder the filesystem keeps for itself.
+        """
+        self._check_ticket_path(path)
+        part_size = part_size or self.part_size
+        if hasattr(self.home, "presign_multipart"):
+            upload_args = {"ContentType": content_type} if content_type else None
+            return self.home.presign_multipart(path, size, part_size, expires_in, upload_args)
+        upload_id = uuid.uuid4().hex
+        count, part_size = part_count(size, part_size)
+        urls = []
+        for number in range(1, count + 1):
+            url, expires = self._local_ticket(
+                TicketClaims(path, "PUT", content_type, part_size, upload_id, number, None), expires_in
+            )
+            urls.append(url)
+        return MultipartTicket(path, upload_id, part_size, urls, {}, expires)
+
+    @instrumented("complete_upload")
+    def complete_upload(self, path, upload_id=None, etags=None):
+        """Confirm a file uploaded with a ticket is stored, and report it to ``on_direct_upload``.
+
+        :param path: the relative path to file, including filename.
+        :param upload_id: the ``upload_id`` of a :class:`~efs.tickets.MultipartTicket`, whose parts are joined.
+        :param etags: the ETags of the parts of a multipart upload, in order.
+        :return: the :class:`~efs.listing.FileEntry` of the file.
+        :raise fs.errors.ResourceNotFound: if the client did not upload the file, or ``etags`` do not match its parts.
+        """
+        if upload_id is not None:
+            if hasattr(self.home, "complete_multipart"):
+                self.home.complete_multipart(path, upload_id, etags)
+            else:
+                self._join_parts(path, upload_id, etags)
+        info = self.home.getinfo(path, ["details", "s3"])
+        if POINTER_METADATA in (info.get("s3", "metadata") or {}):
+            # Only the filesystem marks pointers, a client did
+            self.home.remove(path)
+            raise PermissionError("{} was uploaded as a pointer".format(path))
+        etag = info.get("s3", "e_tag")
+        entry = FileEntry(relpath(normpath(path)), info.size, info.modified, etag and etag.strip('"'))
+        if self.metadata_cache is not None:
+            self.metadata_cache.invalidate_parents(path)
+            self.metadata_cache.set_file(path)
+        if self.disk_cache is not None:
+            self.disk_cache.invalidate(path)
+        if self.on_direct_upload is not None:
+            self.on_direct_upload(entry)
+        return entry
+
+    def _join_parts(self, path, upload_id, etags=None):
+        """Write the parts of the local multipart upload ``upload_id`` to ``path``, then remove them.
+
+        Like S3, each of the ``etags`` must be the ETag returned for its part, checked before anything is written.
+        """
+        folder = join(UPLOADS_FOLDER, upload_id)
+        parts = sorted((entry.path for entry in self.home.iter_files(folder, recursive=False)), key=lambda part: int(basename(part)))
+        if not parts or (etags is not None and len(etags) != len(parts)):
+            raise errors.ResourceNotFound(path)
+        for part, etag in zip(parts, etags or ()):
+            digest = hashlib.md5()
+            with self.home.openbin(part) as file:
+                for chunk in iter_chunks(file, self.part_size):
+                    digest.update(chunk)
+            if digest.hexdigest() != etag.strip('"'):
+                raise errors.ResourceNotFound(path)
+
+        def chunks():
+            for part in parts:
+                with self.home.openbin(part) as file:
+                    yield from iter_chunks(file, self.part_size)
+
+        self._write(path, chunks(), fast=True)
+        self.home.removetree(folder)
+
+    def abort_upload(self, path, upload_id):
+        """Give up the multipart upload ``upload_id`` of ``path``, dropping the parts already uploaded."""
+        if hasattr(self.home, "abort_multipart"):
+            self.home.abort_multipart(path, upload_id)
+        else:
+            with contextlib.suppress(errors.ResourceNotFound):
+                self.home.removetree(join(UPLOADS_FOLDER, upload_id))
+
+    def download_ticket(self, path, expires_in=DEFAULT_TICKET_TTL, filename=None):
+        """Return a :class:`~efs.tickets.Ticket` letting a client download a file without going through the app.
+
+        S3 tickets are presigned GETs, local ones point to the ticket endpoint of :class:`~efs.extension.FlaskEFS`.
+        Unlike :meth:`file_url`, they also work for private files and expire.
+
+        :param path: the relative path to file, including filename.
+        :param expires_in: how many seconds the ticket is valid for.
+        :param filename: save the download under this name instead of showing it in the browser.
+        """
+        stored = self._resolve(path)
+        if hasattr(self.home, "presign_download"):
+            return self.home.presign_download(stored, expires_in, filename)._replace(path=path)
+        url, expires = self._local_ticket(TicketClaims(stored, "GET", None, None, None, None, filename), expires_in)
+        return Ticket(path, "GET", url, {}, {}, expires)
+
+    def verify_ticket(self, token, method):
+        """Return the :class:`~efs.tickets.TicketClaims` of a local ticket token, if it is valid for ``method``.
+
+        :raise PermissionError: if the token is forged, expired or for another method.
+        """
+        return TicketSigner(self.ticket_secret, self.ticket_url or "").verify(token, method)
+
+    def store_ticket_upload(self, claims, content):
+        """Store the ``content`` a client sent with a local upload ticket.
+
+        :param claims: the verified :class:`~efs.tickets.TicketClaims` of the ticket.
+        :param content: a readable file-like object.
+        :return: the ETag of the part for a part of a multipart upload, otherwise the
+            :class:`~efs.listing.FileEntry` of the completed upload.
+        :raise efs.tickets.ContentTooLarge: once more than the ``max_size`` of the ticket was read, nothing is stored.
+        :raise PermissionError: if the ticket is for a folder the filesystem keeps for itself.
+        """
+        self._check_ticket_path(claims.path)
+        chunks = limit_size(iter_chunks(content, self.part_size), claims.max_size)
+        if claims.part is None:
+            self._store_staged(claims.path, chunks)
+            return self.complete_upload(claims.path)
+        digest = hashlib.md5()
+
+        def hashed():
+            for chunk in chunks:
+                digest.update(chunk)
+                yield chunk
+
+        self._store_staged(join(UPLOADS_FOLDER, claims.upload_id, str(claims.part)), hashed())
+        return digest.hexdigest()
+
+    def _store_staged(self, path, chunks):
+        """Write ``chunks`` to a staging file moved to ``path`` once complete.
+
+        A body rejected half way is dropped without truncating the file it would have replaced.
+        """
+        staging = join(UPLOADS_FOLDER, uuid.uuid4().hex)
+        try:
+            self._write(staging, chunks, fast=True)
+        except Exception:
+            with contextlib.suppress(errors.ResourceNotFound):
+                self.home.remove(staging)
+            raise
+        self.move(staging, path)
+
     @classmethod
     def get_filesystem(cls):
-        """Return an instance of the filesystem abstraction."""
+        """Return an instance of the filesystem abstraction.
+
+        Apps set up with :class:`~efs.extension.FlaskEFS` get the instance it built, otherwise a new one is built
+        on every call.
+        """
+        from flask import current_app
+
+        filesystem = current_app.extensions.get(EXTENSION_NAME)
+        if filesystem is not None:
+            return filesystem
         return cls(storage=current_app.config["DEFAULT_STORAGE"])
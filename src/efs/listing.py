@@ -0,0 +1,6 @@
+"""Entries yielded by the lazy listings of :meth:`efs.filesystem.EFS.iter_files`."""
+from collections import namedtuple
+
+#: A file found by a listing: its relative path, size in bytes, modification time as an aware UTC ``datetime``
+#: and ETag (``None`` for local files).
+FileEntry = namedtuple("FileEntry", ["path", "size", "mtime", "etag"])
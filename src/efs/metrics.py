@@ -0,0 +1,208 @@
+"""Instrumentation of the filesystem operations: hooks receiving a record per operation and a collector for them.
+
+Operations are only timed when the filesystem has hooks, otherwise the instrumented methods are called straight
+away. S3 requests are counted by a botocore event handler, in the context of the operation that made them, including
+the requests sent from thread pools started with :func:`in_context`.
+"""
+import bisect
+import contextvars
+import functools
+import inspect
+import threading
+import time
+from collections import namedtuple
+
+from fs.path import normpath
+from fs.path import relpath
+
+#: Upper bounds, in seconds, of the latency histogram buckets.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+#: What hooks receive after every instrumented operation. ``bytes`` is only known for uploads, ``requests`` is the
+#: number of S3 requests sent and ``error`` the exception the operation raised, if any.
+OperationRecord = namedtuple(
+    "OperationRecord", ["operation", "backend", "prefix", "bytes", "seconds", "requests", "error"]
+)
+
+_scope = contextvars.ContextVar("efs_operation", default=None)
+
+
+class _Scope:
+    """The running operation, counting its S3 requests from any thread."""
+
+    def __init__(self):
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def count(self):
+        with self._lock:
+            self.requests += 1
+
+
+def count_request(**kwargs):
+    """botocore ``before-call`` handler counting a request for the running operation."""
+    scope = _scope.get()
+    if scope is not None:
+        scope.count()
+
+
+def in_context(function):
+    """Wrap ``function`` to run it with the context of the calling thread, so its S3 requests are counted.
+
+    The context is copied for each call, so the wrapper can be given to a thread pool.
+    """
+    context = contextvars.copy_context()
+
+    @functools.wraps(function)
+    def run(*args, **kwargs):
+        return context.copy().run(function, *args, **kwargs)
+
+    return run
+
+
+def path_prefix(path, depth):
+    """Return the first ``depth`` folders of ``path``, e.g. ``exports`` for ``exports/2018/orders.csv``."""
+    return "/".join(relpath(normpath(path)).split("/")[:-1][:depth])
+
+
+def instrumented(operation, sized=False, prefixed=True):
+    """Report the calls of a :class:`~efs.filesystem.EFS` method to the filesystem hooks.
+
+    Operations called by another instrumented operation are part of it and are not reported on their own.
+
+    :param operation: the name of the operation in the records.
+    :param sized: whether the method returns the number of bytes it wrote.
+    :param prefixed: whether the first argument of the method is a path.
+    """
+
+    def decorator(method):
+        signature = inspect.signature(method)
+        # The path is the first argument after self, however it is passed
+        first = list(signature.parameters)[1]
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if not self.hooks or _scope.get() is not None:
+                return method(self, *args, **kwargs)
+            self._watch_requests()
+            scope = _Scope()
+            token = _scope.set(scope)
+            started = time.perf_counter()
+            result = error = None
+            try:
+                result = method(self, *args, **kwargs)
+                return result
+            except Exception as exc:
+                error = exc
+                raise
+            finally:
+                _scope.reset(token)
+                prefix = None
+                if prefixed:
+                    path = signature.bind_partial(self, *args, **kwargs).arguments.get(first)
+                    prefix = None if path is None else path_prefix(path, self.prefix_depth)
+                record = OperationRecord(
+                    operation,
+                    self.storage,
+                    prefix,
+                    result if sized else None,
+                    time.perf_counter() - started,
+                    scope.requests,
+                    error,
+                )
+                for hook in self.hooks:
+                    hook(record)
+
+        return wrapper
+
+    return decorator
+
+
+class MetricsCollector:
+    """A thread-safe hook aggregating the records per operation and backend, with a latency histogram.
+
+    .. code-block:: python
+
+        collector = MetricsCollector()
+        fs = EFS(storage='s3', hooks=[collector])
+
+    :param buckets: the upper bounds, in seconds, of the latency histogram buckets.
+    :param by_prefix: also group the records by path prefix.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, by_prefix=False):
+        """Create an empty collector."""
+        self.buckets = tuple(sorted(buckets))
+        self.by_prefix = by_prefix
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, record):
+        """Add ``record`` to the statistics."""
+        key = (record.operation, record.backend, record.prefix if self.by_prefix else None)
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = {
+                    "count": 0,
+                    "errors": 0,
+                    "seconds": 0.0,
+                    "max_seconds": 0.0,
+                    "bytes": 0,
+                    "requests": 0,
+                    "histogram": [0] * (len(self.buckets) + 1),
+                }
+            stats["count"] += 1
+            stats["errors"] += record.error is not None
+            stats["seconds"] += record.seconds
+            stats["max_seconds"] = max(stats["max_seconds"], record.seconds)
+            stats["bytes"] += record.bytes or 0
+            stats["requests"] += record.requests
+            stats["histogram"][bisect.bisect_left(self.buckets, record.seconds)] += 1
+
+    def snapshot(self):
+        """Return the statistics of every operation seen so far as a list of JSON serialisable dicts.
+
+        The histogram maps each bucket upper bound (``inf`` for the last one) to the number of operations that took
+        at most that long and more than the previous bound.
+        """
+        bounds = [str(bound) for bound in self.buckets] + ["inf"]
+        with self._lock:
+            return [
+                dict(
+                    stats,
+                    operation=operation,
+                    backend=backend,
+                    prefix=prefix,
+                    histogram=dict(zip(bounds, stats["histogram"])),
+                )
+                for (operation, backend, prefix), stats in sorted(self._stats.items(), key=str)
+            ]
+
+    def quantile(self, operation, quantile, backend=None):
+        """Estimate the latency under which ``quantile`` (e.g. 0.99) of the operations ran, in seconds.
+
+        The estimate is the upper bound of the histogram bucket the quantile falls in, or None if no such operation
+        was recorded.
+        """
+        with self._lock:
+            histograms = [
+                stats["histogram"]
+                for (name, stats_backend, _), stats in self._stats.items()
+                if name == operation and backend in (None, stats_backend)
+            ]
+        counts = [sum(counts) for counts in zip(*histograms)]
+        total = sum(counts)
+        if not total:
+            return None
+        seen = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            seen += count
+            if seen >= quantile * total:
+                return bound
+        return float("inf")
+
+    def reset(self):
+        """Forget everything collected."""
+        with self._lock:
+            self._stats.clear()
@@ -0,0 +1,102 @@
+"""A process-wide pool of boto3 clients shared by every :class:`~efs.eatfirst_s3.EatFirstS3`.
+
+Creating a client (and the TLS connections behind it) is far more expensive than any small S3 request, so
+backends with the same credentials, region and endpoint share one client. Clients are thread-safe and keep up to
+``max_pool_connections`` connections alive. Resources are not thread-safe, so each thread gets its own, bound to
+the shared client.
+
+Pre-forking servers must not share connections between processes: the pool is emptied in children forked with
+:func:`os.fork`, and :func:`reset` can be called explicitly (e.g. from gunicorn's ``post_fork`` hook).
+"""
+import os
+import threading
+
+import boto3
+from botocore.config import Config
+
+DEFAULT_MAX_POOL_CONNECTIONS = 50
+
+_lock = threading.Lock()
+_session = None
+_clients = {}
+_local = threading.local()
+
+
+def _key(region, access_key, secret_key, session_token, endpoint_url, max_pool_connections):
+    return (region, access_key, secret_key, session_token, endpoint_url, max_pool_connections)
+
+
+def _create(factory, key, **kwargs):
+    """Create a client or resource for ``key``, must be called holding the lock as sessions are not thread-safe."""
+    global _session
+    if _session is None:
+        _session = boto3.session.Session()
+    region, access_key, secret_key, session_token, endpoint_url, _ = key
+    return getattr(_session, factory)(
+        "s3",
+        region_name=region,
+        aws_access_key_id=access_key,
+        aws_secret_access_key=secret_key,
+        aws_session_token=session_token,
+        endpoint_url=endpoint_url,
+        **kwargs
+    )
+
+
+def get_client(
+    region=None,
+    access_key=None,
+    secret_key=None,
+    session_token=None,
+    endpoint_url=None,
+    max_pool_connections=DEFAULT_MAX_POOL_CONNECTIONS,
+):
+    """Return the shared S3 client for these settings, creating it on first use."""
+    key = _key(region, access_key, secret_key, session_token, endpoint_url, max_pool_connections)
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _clients[key] = _create(
+                    "client", key, config=Config(max_pool_connections=max_pool_connections)
+                )
+    return client
+
+
+def get_resource(
+    region=None,
+    access_key=None,
+    secret_key=None,
+    session_token=None,
+    endpoint_url=None,
+    max_pool_connections=DEFAULT_MAX_POOL_CONNECTIONS,
+):
+    """Return this thread's S3 resource for these settings, sending its requests through the shared client."""
+    key = _key(region, access_key, secret_key, session_token, endpoint_url, max_pool_connections)
+    resources = getattr(_local, "resources", None)
+    if resources is None:
+        resources = _local.resources = {}
+    resource = resources.get(key)
+    if resource is None:
+        client = get_client(*key)
+        with _lock:
+            resource = _create("resource", key)
+        resource.meta.client = client
+        resources[key] = resource
+    return resource
+
+
+def reset():
+    """Forget every pooled client and resource, their connections are closed when garbage collected.
+
+    The session is kept: it holds no connections, only the loaded service models that make creating clients fast.
+    """
+    global _lock, _local
+    _lock = threading.Lock()
+    _local = threading.local()
+    _clients.clear()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=reset)
@@ -0,0 +1,134 @@
+"""How the files are stored, recorded apart from their content.
+
+S3 keeps these attributes with the objects (``ContentEncoding`` and user metadata). The other backends have no metadata, so
+:class:`RecordStore` keeps them in small files under :data:`RECORDS_FOLDER`, at the same relative paths as the files
+they describe. Attributes are never guessed from the content of a file, which any upload could forge.
+"""
+import contextlib
+import json
+from collections import namedtuple
+
+from fs import errors
+from fs.path import dirname
+from fs.path import join
+from fs.path import normpath
+from fs.path import relpath
+
+#: The folder of the storage holding the records of the backends without metadata.
+RECORDS_FOLDER = ".efs"
+
+#: The S3 user metadata marking the objects that are deduplication pointers.
+POINTER_METADATA = "efs-pointer"
+
+#: How a file is stored: the ``encoding`` a :class:`~efs.compression.CompressionPolicy` compressed it with, or None,
+#: and whether it is a ``pointer`` to a deduplicated blob.
+FileAttributes = namedtuple("FileAttributes", ["encoding", "pointer"], defaults=(None, False))
+
+#: The attributes of a file stored as uploaded.
+NO_ATTRIBUTES = FileAttributes()
+
+
+def with_attributes(upload_args, attributes):
+    """Return the S3 ``upload_args`` storing ``attributes`` with the object.
+
+    The pointer metadata given by the caller is dropped, only the filesystem marks pointers.
+
+    :param upload_args: the arguments of the S3 upload request, or None.
+    :param attributes: a :class:`FileAttributes`.
+    """
+    upload_args = dict(upload_args or {})
+    metadata = {
+        key: value for key, value in upload_args.pop("Metadata", {}).items() if key.lower() != POINTER_METADATA
+    }
+    if attributes.pointer:
+        metadata[POINTER_METADATA] = "true"
+    if metadata:
+        upload_args["Metadata"] = metadata
+    if attributes.encoding is not None:
+        upload_args["ContentEncoding"] = attributes.encoding
+    return upload_args or None
+
+
+class RecordStore:
+    """The :class:`FileAttributes` of the files of a backend without metadata, one JSON file per described file.
+
+    Only files with attributes have a record. :class:`~efs.filesystem.EFS` keeps the records in step with the files
+    it writes, moves and removes. Until a record is written or found there is nothing to keep in step, so
+    storages without compressed or deduplicated files pay nothing for the records when files are written.
+
+    :param home: the backend the files and their records are stored in.
+    """
+
+    def __init__(self, home):
+        """Keep the records in ``home``."""
+        self.home = home
+        self._empty = not home.exists(RECORDS_FOLDER)
+
+    @staticmethod
+    def record_path(path):
+        """Return the path of the record of the file or folder ``path``."""
+        return join(RECORDS_FOLDER, relpath(normpath(path)))
+
+    def get(self, path):
+        """Return the :class:`FileAttributes` of the file at ``path``.
+
+        :param path: the relative path to file, including filename.
+        """
+        try:
+            record = self.home.readbytes(self.record_path(path))
+        except (errors.ResourceNotFound, errors.FileExpected):
+            return NO_ATTRIBUTES
+        # Written by another instance sharing the storage
+        self._empty = False
+        return FileAttributes(**json.loads(record.decode()))
+
+    def set(self, path, attributes):
+        """Record the ``attributes`` of the file just written at ``path``, dropping its previous ones.
+
+        :param path: the relative path to file, including filename.
+        :param attributes: a :class:`FileAttributes`.
+        """
+        if attributes == NO_ATTRIBUTES and self._empty:
+            return
+        record = self.record_path(path)
+        if attributes == NO_ATTRIBUTES:
+            with contextlib.suppress(errors.ResourceNotFound, errors.FileExpected):
+                self.home.remove(record)
+            return
+        self._empty = False
+        self.home.makedirs(dirname(record), recreate=True)
+        self.home.writebytes(record, json.dumps(attributes._asdict()).encode())
+
+    def remove(self, path):
+        """Drop the records of the file or folder ``path``.
+
+        :param path: the relative path to file or folder.
+        """
+        if self._empty:
+            return
+        record = self.record_path(path)
+        with contextlib.suppress(errors.ResourceNotFound):
+            if self.home.isdir(record):
+                self.home.removetree(record)
+            else:
+                self.home.remove(record)
+
+    def move(self, path, new_path):
+        """Move the records of the file or folder ``path`` to ``new_path``, where it was just moved.
+
+        :param path: the relative path to the former file or folder.
+        :param new_path: the relative path it was moved to.
+        """
+        if self._empty:
+            return
+        record = self.record_path(path)
+        new_record = self.record_path(new_path)
+        if self.home.isdir(record):
+            self.home.makedirs(dirname(new_record), recreate=True)
+            self.home.movedir(record, new_record, create=True)
+        elif self.home.isfile(record):
+            self.home.makedirs(dirname(new_record), recreate=True)
+            self.home.move(record, new_record, overwrite=True)
+        elif self.home.isfile(new_record):
+            # The file moved over new_path is stored as uploaded
+            self.home.remove(new_record)
@@ -0,0 +1,129 @@
+"""Helpers to move content around in bounded chunks instead of whole payloads."""
+import io
+import mmap
+import os
+import stat
+import tempfile
+from collections import namedtuple
+
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+DEFAULT_RANGE_SIZE = 1024 * 1024
+
+#: Reported to ``on_part`` callbacks once a part of a streamed upload is stored.
+PartReport = namedtuple("PartReport", ["number", "size", "seconds"])
+
+#: Contents that are sliced in place instead of being read or copied.
+BUFFER_TYPES = (bytearray, memoryview, mmap.mmap)
+
+
+class BufferReader(io.RawIOBase):
+    """A seekable binary file reading from a buffer (e.g. a slice of a ``bytearray`` or ``mmap``) in place.
+
+    Only the bytes asked for by each ``read`` are copied, so botocore can stream a part of a big buffer without a
+    copy of the whole part.
+    """
+
+    def __init__(self, buffer):
+        """Read from ``buffer``, anything supporting the buffer protocol."""
+        self._view = memoryview(buffer).cast("B")
+        self._position = 0
+
+    def __len__(self):
+        """Return the size of the buffer."""
+        return self._view.nbytes
+
+    def readable(self):
+        """Return True."""
+        return True
+
+    def seekable(self):
+        """Return True."""
+        return True
+
+    def tell(self):
+        """Return the current position."""
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        """Move the current position and return it."""
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._position, io.SEEK_END: len(self)}[whence]
+        self._position = max(0, base + offset)
+        return self._position
+
+    def read(self, size=-1):
+        """Return up to ``size`` bytes, or everything left if ``size`` is negative."""
+        end = len(self) if size is None or size < 0 else self._position + size
+        data = self._view[self._position:end].tobytes()
+        self._position += len(data)
+        return data
+
+    def readinto(self, buffer):
+        """Copy the next bytes into ``buffer`` and return how many were copied."""
+        data = self._view[self._position:self._position + len(buffer)]
+        buffer[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+
+def as_body(chunk):
+    """Return ``chunk``, as yielded by :func:`iter_chunks`, in a form botocore accepts as a request body."""
+    return BufferReader(chunk) if isinstance(chunk, memoryview) else chunk
+
+
+def file_descriptor(content):
+    """Return the descriptor of the regular file ``content`` reads from, or None if it is anything else."""
+    if isinstance(content, tempfile.SpooledTemporaryFile) and not content._rolled:
+        # Asking for its descriptor would write it to disk
+        return None
+    try:
+        descriptor = content.fileno()
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return None
+    return descriptor if stat.S_ISREG(os.fstat(descriptor).st_mode) else None
+
+
+def _iter_reads(content, size):
+    """Yield successive reads of ``size`` bytes from a file-like object until it is exhausted."""
+    while True:
+        data = content.read(size)
+        if not data:
+            return
+        yield data
+
+
+def iter_chunks(content, chunk_size=DEFAULT_PART_SIZE):
+    """Yield ``content`` as bytes chunks of exactly ``chunk_size`` bytes, except for the last one.
+
+    Short reads (pipes, sockets, unbuffered files) and uneven iterators are regrouped so callers can rely on
+    the chunk size, which S3 multipart uploads require. At most about two chunks are held in memory.
+
+    Buffers are not copied: the chunks of ``bytearray``, ``memoryview`` and ``mmap`` contents, and of ``bytes``
+    bigger than a chunk, are ``memoryview`` slices of them, see :func:`as_body`.
+
+    :param content: ``bytes``, a buffer, a readable file-like object or an iterable of bytes (``str`` items are utf-8
+        encoded).
+    :param chunk_size: the size in bytes of each yielded chunk.
+    """
+    if isinstance(content, bytes) and len(content) <= chunk_size:
+        if content:
+            yield content
+        return
+    if isinstance(content, BUFFER_TYPES + (bytes,)):
+        view = memoryview(content).cast("B")
+        for start in range(0, view.nbytes, chunk_size):
+            yield view[start:start + chunk_size]
+        return
+    pieces = _iter_reads(content, chunk_size) if hasattr(content, "read") else iter(content)
+    buffer = bytearray()
+    for piece in pieces:
+        if isinstance(piece, str):
+            piece = piece.encode()
+        if not buffer and len(piece) == chunk_size:
+            yield bytes(piece)
+            continue
+        buffer += piece
+        while len(buffer) >= chunk_size:
+            yield bytes(buffer[:chunk_size])
+            del buffer[:chunk_size]
+    if buffer:
+        yield bytes(buffer)
@@ -0,0 +1,134 @@
+"""Incremental mirroring of a folder to another filesystem, see :meth:`efs.filesystem.EFS.sync`."""
+import json
+import os
+import threading
+from collections import namedtuple
+
+from fs.path import normpath
+from fs.path import relpath
+
+COPY = "copy"
+DELETE = "delete"
+
+#: What :meth:`~efs.filesystem.EFS.sync` did: the relative paths it copied and deleted, how many files were already
+#: up to date and a :class:`~efs.batch.BatchResult` for every copy or deletion that failed, with its relative path.
+SyncResult = namedtuple("SyncResult", ["copied", "deleted", "skipped", "failed"])
+
+
+def sync_folder(path):
+    """Normalise the folder ``path`` so ``a/b``, ``/a/b`` and ``a/b/`` are the same folder, the root being ``""``."""
+    return relpath(normpath(path or "")).rstrip("/")
+
+
+def rebase(entries, folder):
+    """Yield the :class:`~efs.listing.FileEntry` of ``entries`` with paths relative to ``folder``."""
+    start = len(folder) + 1 if folder else 0
+    for entry in entries:
+        yield entry._replace(path=relpath(entry.path)[start:])
+
+
+def needs_copy(source, destination):
+    """Tell whether the ``source`` entry has to be copied over the ``destination`` one, like ``aws s3 sync``.
+
+    Files of different sizes always differ. ETags are compared when both sides have a plain one (multipart ETags
+    depend on the part size), otherwise the source is copied if it was modified after the destination. S3 keeps
+    modification times to the second, so they are compared to the second.
+
+    :param source: the :class:`~efs.listing.FileEntry` of the file to copy.
+    :param destination: the entry of the file it would replace, or None.
+    """
+    if destination is None or source.size != destination.size:
+        return True
+    if source.etag and destination.etag and "-" not in source.etag + destination.etag:
+        return source.etag != destination.etag
+    return source.mtime.replace(microsecond=0) > destination.mtime.replace(microsecond=0)
+
+
+def diff(source_entries, destination_entries, delete=False):
+    """Compare two listings with relative paths and return what to do to make the destination a mirror.
+
+    The destination listing is held in memory, the source one is streamed.
+
+    :param source_entries: the :class:`~efs.listing.FileEntry` of the source files.
+    :param destination_entries: the entries of the destination files.
+    :param delete: also delete the destination files missing from the source.
+    :return: a list of ``(action, path)`` pairs, copies first, and the number of files already up to date.
+    """
+    destination = {entry.path: entry for entry in destination_entries}
+    actions = []
+    skipped = 0
+    for entry in source_entries:
+        if needs_copy(entry, destination.pop(entry.path, None)):
+            actions.append((COPY, entry.path))
+        else:
+            skipped += 1
+    if delete:
+        actions.extend((DELETE, path) for path in sorted(destination))
+    return actions, skipped
+
+
+class SyncState:
+    """The plan and progress of a sync, appended to a JSON lines file so an interrupted sync resumes where it stopped.
+
+    The file starts with what is synced, then the planned actions, then a line per finished action. A sync that
+    finds the plan of the same sync resumes it without listing both sides again.
+
+    :param path: the local path of the state file.
+    :param header: a JSON serialisable description of the sync, e.g. the source and destination.
+    """
+
+    def __init__(self, path, header):
+        """Remember where the state goes, nothing is read or written yet."""
+        self.path = path
+        self.header = header
+        self._file = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Return the actions an interrupted run of the same sync did not finish, or None to plan a new run."""
+        try:
+            with open(self.path) as file:
+                lines = []
+                for line in file:
+                    try:
+                        lines.append(json.loads(line))
+                    except ValueError:
+                        # Blank, or cut short by an interruption
+                        continue
+        except FileNotFoundError:
+            return None
+        if not lines:
+            return None
+        if lines[0] != {"sync": self.header}:
+            raise RuntimeError("{} holds the state of another sync: {}".format(self.path, lines[0]))
+        planned = [tuple(line["action"]) for line in lines if "action" in line]
+        done = {tuple(line["done"]) for line in lines if "done" in line}
+        if not any("planned" in line for line in lines):
+            return None
+        return [action for action in planned if action not in done]
+
+    def start(self, actions):
+        """Write a new plan and keep the file open to record the progress."""
+        self._file = open(self.path, "w")
+        lines = [{"sync": self.header}] + [{"action": action} for action in actions] + [{"planned": len(actions)}]
+        for line in lines:
+            self._file.write(json.dumps(line) + "\n")
+        self._file.flush()
+
+    def resume(self):
+        """Keep the file open to record the progress of the loaded plan."""
+        self._file = open(self.path, "a")
+        # Ends the last line in case it was cut short
+        self._file.write("\n")
+
+    def done(self, action, path):
+        """Record that ``action`` is done for ``path``."""
+        with self._lock:
+            self._file.write(json.dumps({"done": [action, path]}) + "\n")
+            self._file.flush()
+
+    def close(self, finished):
+        """Close the file, removing it if every action succeeded."""
+        self._file.close()
+        if finished:
+            os.remove(self.path)
@@ -0,0 +1,143 @@
+"""Tickets letting clients upload and download files without their bytes going through the app.
+
+S3 tickets are presigned requests. Local files have no such thing, so their tickets point to an endpoint of the app
+(see :class:`~efs.extension.FlaskEFS`) and carry a token signed with the app's secret key.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import math
+import time
+import urllib.parse
+from collections import namedtuple
+
+#: How many seconds tickets are valid for by default.
+DEFAULT_TICKET_TTL = 3600
+#: The folder of the storage where the parts of local multipart uploads are kept until they are completed.
+UPLOADS_FOLDER = ".uploads"
+
+#: One request a client can send: ``method`` to ``url`` with the form ``fields`` (POST) or ``headers`` (PUT), until
+#: the ``expires`` timestamp.
+Ticket = namedtuple("Ticket", ["path", "method", "url", "fields", "headers", "expires"])
+
+#: The parts of a multipart upload: each part of ``part_size`` bytes (but the last one) is sent with a PUT to its url,
+#: in order, and the ``ETag`` header of every response is given to :meth:`~efs.filesystem.EFS.complete_upload`.
+MultipartTicket = namedtuple("MultipartTicket", ["path", "upload_id", "part_size", "urls", "headers", "expires"])
+
+#: What a local ticket allows, once its token is verified.
+TicketClaims = namedtuple(
+    "TicketClaims", ["path", "method", "content_type", "max_size", "upload_id", "part", "filename"]
+)
+
+#: The request headers matching the S3 upload arguments.
+UPLOAD_HEADERS = {
+    "ACL": "x-amz-acl",
+    "CacheControl": "Cache-Control",
+    "ContentEncoding": "Content-Encoding",
+    "ContentType": "Content-Type",
+    "StorageClass": "x-amz-storage-class",
+}
+
+
+def upload_headers(upload_args, form=False):
+    """Return the headers a client must send for the S3 ``upload_args`` signed in a ticket.
+
+    :param upload_args: the arguments of the S3 request, e.g. ``{"ContentType": "image/png"}``.
+    :param form: return the fields of a POST form instead, where the ACL is ``acl``.
+    """
+    headers = {}
+    for name, value in upload_args.items():
+        if name == "Metadata":
+            headers.update(("x-amz-meta-" + key, metadata) for key, metadata in value.items())
+        elif form and name == "ACL":
+            headers["acl"] = value
+        else:
+            headers[UPLOAD_HEADERS[name]] = value
+    return headers
+
+
+def content_disposition(filename):
+    """Return the ``Content-Disposition`` header saving a download as ``filename``."""
+    return "attachment; filename*=UTF-8''{}".format(urllib.parse.quote(filename))
+
+
+def part_count(size, part_size, max_parts=None):
+    """Return how many parts an upload of ``size`` bytes needs and their size, grown to need at most ``max_parts``."""
+    if max_parts:
+        part_size = max(part_size, math.ceil(size / max_parts))
+    return max(1, math.ceil(size / part_size)), part_size
+
+
+class ContentTooLarge(ValueError):
+    """The body of a ticket upload is bigger than the ticket allows."""
+
+
+def limit_size(chunks, max_size):
+    """Yield ``chunks``, raising :class:`ContentTooLarge` as soon as they add up to more than ``max_size`` bytes.
+
+    Bodies sent without a ``Content-Length`` (chunked) are only known to be too big while they are read.
+
+    :param chunks: an iterable of bytes.
+    :param max_size: how many bytes are allowed, unlimited if None.
+    """
+    size = 0
+    for chunk in chunks:
+        size += len(chunk)
+        if max_size is not None and size > max_size:
+            raise ContentTooLarge("the upload is bigger than {} bytes".format(max_size))
+        yield chunk
+
+
+def _encode(data):
+    """Return ``data`` as unpadded url-safe base64."""
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _decode(text):
+    """Return the bytes of the unpadded url-safe base64 ``text``."""
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+class TicketSigner:
+    """Sign and verify the tokens of local tickets.
+
+    :param secret: the key the tokens are signed with, usually the app's ``SECRET_KEY``.
+    :param base_url: the url of the ticket endpoint, tokens are appended to it.
+    """
+
+    def __init__(self, secret, base_url):
+        """Check there is a secret to sign with."""
+        if not secret:
+            raise RuntimeError("local tickets need a secret key")
+        self.secret = secret.encode() if isinstance(secret, str) else secret
+        self.base_url = base_url.rstrip("/")
+
+    def _signature(self, payload):
+        """Return the signature of the encoded ``payload``."""
+        return _encode(hmac.new(self.secret, payload.encode(), hashlib.sha256).digest())
+
+    def sign(self, claims, expires):
+        """Return the url of a token granting ``claims`` until the ``expires`` timestamp.
+
+        :param claims: a :class:`TicketClaims`.
+        :param expires: the timestamp the token stops being valid at.
+        """
+        payload = _encode(json.dumps([list(claims), int(expires)], separators=(",", ":")).encode())
+        return "{}/{}.{}".format(self.base_url, payload, self._signature(payload))
+
+    def verify(self, token, method):
+        """Return the :class:`TicketClaims` of ``token`` if it is valid for ``method``.
+
+        :raise PermissionError: if the token was not signed with the secret, has expired or is for another method.
+        """
+        payload, _, signature = token.partition(".")
+        if not hmac.compare_digest(signature, self._signature(payload)):
+            raise PermissionError("invalid ticket")
+        claims, expires = json.loads(_decode(payload).decode())
+        claims = TicketClaims(*claims)
+        if expires < time.time():
+            raise PermissionError("expired ticket")
+        if claims.method != method:
+            raise PermissionError("ticket for {} requests".format(claims.method))
+        return claims
@@ -0,0 +1,281 @@
+"""A file system keeping small and recently used files in memory and the others on disk."""
+import io
+import threading
+import time
+from collections import OrderedDict
+from itertools import chain
+
+from autorepr import autorepr
+from fs import errors
+from fs.base import FS
+from fs.mode import Mode
+from fs.path import dirname
+
+from .streaming import DEFAULT_PART_SIZE
+from .streaming import DEFAULT_RANGE_SIZE
+from .streaming import PartReport
+from .streaming import iter_chunks
+
+#: Files up to this many bytes are kept in memory by default.
+DEFAULT_MAX_MEMORY_FILE_SIZE = 1024 * 1024
+
+
+class _TieredWriter(io.RawIOBase):
+    """A new file, buffered in memory until it grows over the size of the memory files and written to disk after."""
+
+    def __init__(self, tiered, path):
+        super().__init__()
+        self._tiered = tiered
+        self._path = path
+        self._buffer = io.BytesIO()
+        self._file = None
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if self._file is None and self._buffer.tell() + memoryview(data).nbytes > self._tiered.max_file_size:
+            self._file = self._tiered.disk.openbin(self._path, "w")
+            self._file.write(self._buffer.getbuffer())
+            self._buffer = None
+        return (self._file or self._buffer).write(data)
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self._file is None:
+                self._tiered._keep_in_memory(self._path, self._buffer.getvalue())
+            else:
+                self._file.close()
+                self._tiered._kept_on_disk(self._path)
+        finally:
+            super().close()
+
+
+class TieredFS(FS):
+    """Keep the files up to ``max_file_size`` bytes in the ``memory`` filesystem and the bigger ones on ``disk``.
+
+    When the memory is full, the least recently used files are moved to disk to make room. Folders always exist on
+    disk, and every file is in exactly one of the two.
+
+    :param memory: an :class:`~efs.eatfirst_memoryfs.EatFirstMemoryFS`, its ``max_size`` is the memory budget.
+    :param disk: an :class:`~efs.eatfirst_osfs.EatFirstOSFS`.
+    :param max_file_size: the files bigger than this many bytes are written to disk.
+    """
+
+    __repr__ = autorepr(["max_file_size", "used"])
+
+    #: Files can only be written inside existing directories.
+    needs_directories = True
+
+    def __init__(self, memory, disk, max_file_size=DEFAULT_MAX_MEMORY_FILE_SIZE):
+        """Keep the files of ``memory`` least recently used first."""
+        super().__init__()
+        self.memory = memory
+        self.disk = disk
+        self.max_file_size = max_file_size
+        self._recent = OrderedDict(("/" + entry.path, None) for entry in memory.iter_files())
+        self._tier_lock = threading.RLock()
+
+    def _tier(self, path):
+        """Return the filesystem holding ``path``, and mark it as recently used if it is in memory.
+
+        Hold ``_tier_lock`` while using the result, the file may move to the other tier as soon as it is released.
+        """
+        _path = self.validatepath(path)
+        with self._tier_lock:
+            if _path in self._recent:
+                self._recent.move_to_end(_path)
+                return self.memory
+        return self.disk
+
+    def _forget(self, path):
+        """Remove the memory copy of ``path``, if there is one."""
+        _path = self.validatepath(path)
+        if _path in self._recent:
+            del self._recent[_path]
+            self.memory.remove(_path)
+
+    def _spill(self, path):
+        """Move the memory file ``path`` to disk."""
+        self.disk.writebytes(path, self.memory.readbytes(path))
+        self._forget(path)
+
+    def _keep_in_memory(self, path, content):
+        """Store the new ``content`` of ``path`` in memory, moving the least recently used files to disk to fit it."""
+        _path = self.validatepath(path)
+        with self._tier_lock:
+            max_size = self.memory.max_size
+            if max_size is not None and len(content) > max_size:
+                self.disk.writebytes(_path, content)
+                self._forget(_path)
+                return
+            self._forget(_path)
+            while max_size is not None and self.memory.used + len(content) > max_size:
+                self._spill(next(iter(self._recent)))
+            self.memory.makedirs(dirname(_path), recreate=True)
+            self.memory.writebytes(_path, content)
+            self._recent[_path] = None
+            if self.disk.isfile(_path):
+                self.disk.remove(_path)
+
+    def _kept_on_disk(self, path):
+        """Forget the memory copy of ``path``, now written to disk."""
+        with self._tier_lock:
+            self._forget(path)
+
+    def getinfo(self, path, namespaces=None):
+        with self._tier_lock:
+            return self._tier(path).getinfo(path, namespaces)
+
+    def listdir(self, path):
+        with self._tier_lock:
+            names = self.disk.listdir(path)
+            if self.memory.isdir(path):
+                on_disk = set(names)
+                names.extend(name for name in self.memory.listdir(path) if name not in on_disk)
+        return names
+
+    def makedir(self, path, permissions=None, recreate=False):
+        self.disk.makedir(path, permissions, recreate)
+        return self.opendir(path)
+
+    def openbin(self, path, mode="r", buffering=-1, **options):
+        _mode = Mode(mode)
+        _mode.validate_bin()
+        _path = self.validatepath(path)
+        if not _mode.truncate:
+            with self._tier_lock:
+                return self._tier(_path).openbin(_path, mode, buffering, **options)
+        if not self.disk.isdir(dirname(_path)):
+            raise errors.ResourceNotFound(path)
+        if self.isdir(_path):
+            raise errors.FileExpected(path)
+        if _mode.exclusive and self.exists(_path):
+            raise errors.FileExists(path)
+        if _mode.reading:
+            # Files written and read back in the same handle are only written to disk
+            self._kept_on_disk(_path)
+            return self.disk.openbin(_path, mode, buffering, **options)
+        return _TieredWriter(self, _path)
+
+    def remove(self, path):
+        with self._tier_lock:
+            self._tier(path).remove(path)
+            self._recent.pop(self.validatepath(path), None)
+
+    def removedir(self, path):
+        if self.listdir(path):
+            raise errors.DirectoryNotEmpty(path)
+        self.disk.removedir(path)
+        if self.memory.isdir(path):
+            self.memory.removedir(path)
+
+    def removetree(self, path):
+        _path = self.validatepath(path)
+        with self._tier_lock:
+            self.disk.removetree(_path)
+            if self.memory.isdir(_path):
+                self.memory.removetree(_path)
+            prefix = _path.rstrip("/") + "/"
+            for file_path in [file_path for file_path in self._recent if file_path.startswith(prefix)]:
+                del self._recent[file_path]
+
+    def setinfo(self, path, info):
+        with self._tier_lock:
+            self._tier(path).setinfo(path, info)
+
+    def move(self, src_path, dst_path, overwrite=False, preserve_time=False):
+        _src_path = self.validatepath(src_path)
+        _dst_path = self.validatepath(dst_path)
+        with self._tier_lock:
+            if not overwrite and self.exists(_dst_path):
+                raise errors.DestinationExists(dst_path)
+            if _src_path not in self._recent:
+                self.disk.move(_src_path, _dst_path, overwrite=True, preserve_time=preserve_time)
+                self._forget(_dst_path)
+                return
+            if not self.disk.isdir(dirname(_dst_path)):
+                raise errors.ResourceNotFound(dst_path)
+            if _src_path == _dst_path:
+                return
+            self.memory.makedirs(dirname(_dst_path), recreate=True)
+            self.memory.move(_src_path, _dst_path, overwrite=True, preserve_time=preserve_time)
+            del self._recent[_src_path]
+            self._recent[_dst_path] = None
+            if self.disk.isfile(_dst_path):
+                self.disk.remove(_dst_path)
+
+    def getsyspath(self, path):
+        """Return the path of the file on disk.
+
+        :raise fs.errors.NoSysPath: if the file is in memory.
+        """
+        with self._tier_lock:
+            return self._tier(path).getsyspath(path)
+
+    def close(self):
+        self.memory.close()
+        self.disk.close()
+        super().close()
+
+    @property
+    def used(self):
+        """How many bytes the memory files use."""
+        return self.memory.used
+
+    def remove_tree(self, path, max_workers=1, on_progress=None, dry_run=False):
+        """Remove a folder and everything in it, see :meth:`efs.eatfirst_s3.EatFirstS3.remove_tree`.
+
+        :param path: the relative path to folder.
+        :param max_workers: ignored, kept for parity with S3.
+        :param on_progress: called once with the number of files removed.
+        :param dry_run: only count the files that would be removed.
+        :return: the number of files removed.
+        """
+        count = sum(1 for _ in self.iter_files(path))
+        if not dry_run:
+            self.removetree(path)
+        if on_progress:
+            on_progress(count)
+        return count
+
+    def iter_files(self, path="/", recursive=True):
+        """Yield a :class:`~efs.listing.FileEntry` for every file under ``path``, the memory files first.
+
+        :param path: the relative path to folder, nothing is yielded if it does not exist.
+        :param recursive: also list the files of the sub folders.
+        """
+        return chain(self.memory.iter_files(path, recursive), self.disk.iter_files(path, recursive))
+
+    def open_ranged(self, path, range_size=DEFAULT_RANGE_SIZE, read_ahead=1, max_concurrency=1):
+        """Open ``path`` for reading, the range options are ignored.
+
+        :param path: the relative path to file, including filename.
+        :return: a seekable binary file.
+        """
+        return self.openbin(path)
+
+    def upload_stream(
+        self, path, content, part_size=DEFAULT_PART_SIZE, max_concurrency=1, on_part=None, upload_args=None
+    ):
+        """Write ``content`` to ``path`` one chunk at a time, in memory until it is bigger than ``max_file_size``.
+
+        :param path: the relative path to file, including filename.
+        :param content: ``bytes``, a buffer, a readable file-like object or an iterable of bytes.
+        :param part_size: how many bytes are read from ``content`` at once.
+        :param max_concurrency: ignored, kept for parity with S3.
+        :param on_part: called with a :class:`~efs.streaming.PartReport` once each chunk is written.
+        :param upload_args: ignored, these files have no metadata. Kept for parity with S3.
+        :return: the number of bytes written.
+        """
+        size = 0
+        with self.openbin(path, "w") as destination:
+            for number, chunk in enumerate(iter_chunks(content, part_size), 1):
+                started = time.perf_counter()
+                destination.write(chunk)
+                size += len(chunk)
+                if on_part:
+                    on_part(PartReport(number, len(chunk), time.perf_counter() - started))
+        return size
@@ -0,0 +1,39 @@
+"""Build the URLs of public files with string operations only."""
+import urllib.parse
+
+from fs.path import normpath
+from fs.path import relpath
+
+
+class PublicUrlBuilder:
+    """Build the URL of public-read objects without signing anything or touching a client.
+
+    :param base_url: the URL of the bucket root, ending with a slash, e.g. ``https://bucket.s3.amazonaws.com/``.
+    :param key_prefix: prepended to the paths to get the object keys, e.g. the folder the filesystem is rooted at.
+    :param cdn_host: the host name serving the bucket through a CDN, if any.
+    :param delimiter: the key delimiter replacing ``/`` in paths.
+    """
+
+    def __init__(self, base_url, key_prefix="", cdn_host=None, delimiter="/"):
+        """Precompute the URL prefixes."""
+        self.base_url = base_url.replace("http://", "https://")
+        self.key_prefix = key_prefix
+        self.delimiter = delimiter
+        self.cdn_url = None
+        if cdn_host:
+            hostname = urllib.parse.urlparse(self.base_url).hostname
+            self.cdn_url = self.base_url.replace(hostname, cdn_host)
+
+    def url(self, path, with_cdn=True):
+        """Return the URL of the object at ``path``.
+
+        :param path: the relative path to file, including filename.
+        :param with_cdn: use the CDN host, when there is one.
+        """
+        key = (self.key_prefix + relpath(normpath(path))).replace("/", self.delimiter)
+        base_url = self.cdn_url if with_cdn and self.cdn_url else self.base_url
+        return base_url + urllib.parse.quote(key, safe="/~")
+
+    def urls(self, paths, with_cdn=True):
+        """Return the URLs of the objects at ``paths``, in the same order."""
+        return [self.url(path, with_cdn) for path in paths]
@@ -0,0 +1,317 @@
+"""Write-behind uploads: payloads are spooled to a local folder and uploaded in the background."""
+import contextlib
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from fs import errors
+
+from .batch import BatchResult
+from .cache import cache_path
+from .eatfirst_osfs import EatFirstOSFS
+from .listing import FileEntry
+
+DEFAULT_WRITE_BEHIND_WORKERS = 4
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_RETRY_DELAY = 1
+JOURNAL_NAME = "journal"
+
+
+def _under(queued, path):
+    """Whether the ``queued`` path is ``path`` or inside it."""
+    return not path or queued == path or queued.startswith(path + "/")
+
+
+class WriteBehind:
+    """A local spool of uploads flushed to the filesystem by a pool of background threads.
+
+    Every upload is written to a file of the spool folder and recorded in an append-only journal before
+    :meth:`~efs.filesystem.EFS.upload` returns. Uploads to the same path are sent in order, one at a time, and an
+    upload still waiting when a newer one to its path arrives is dropped since it would be overwritten anyway.
+    Failed uploads are retried ``max_retries`` times, waiting ``retry_delay`` seconds and twice as long after every
+    attempt, then given up: ``on_failure`` is called and they stay in the journal.
+
+    When the filesystem starts, the uploads the journal records as not done, by a crash or given up, are queued
+    again. The spool is owned by one filesystem at a time, never share its folder between processes.
+
+    .. code-block:: python
+
+        fs = EFS(storage='s3', write_behind=WriteBehind('/var/spool/efs'))
+        fs.upload('avatars/1.png', content)  # returns once the file is spooled
+        fs.write_behind.close()  # on shutdown, waits for the uploads
+
+    :param root: the local folder the payloads and the journal are kept in.
+    :param max_workers: how many uploads are sent at the same time.
+    :param max_retries: how many times a failed upload is tried again.
+    :param retry_delay: how many seconds to wait before the first retry.
+    :param on_failure: called with a :class:`~efs.batch.BatchResult` holding the error of every upload given up.
+    """
+
+    def __init__(
+        self,
+        root,
+        max_workers=DEFAULT_WRITE_BEHIND_WORKERS,
+        max_retries=DEFAULT_MAX_RETRIES,
+        retry_delay=DEFAULT_RETRY_DELAY,
+        on_failure=None,
+    ):
+        """Create the spool folder, the uploads are replayed by :meth:`start`."""
+        self.home = EatFirstOSFS(root, create=True)
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.on_failure = on_failure
+        self.filesystem = None
+        # The spooled uploads of every path, the first one is being sent
+        self._queues = {}
+        # The last upload given up for every path, still read from the spool
+        self._failed = {}
+        self._changed = threading.Condition()
+        self._journal = None
+        self._executor = None
+        self._closed = False
+
+    @property
+    def pending(self):
+        """How many uploads are waiting or being sent."""
+        with self._changed:
+            return sum(len(queue) for queue in self._queues.values())
+
+    def start(self, filesystem):
+        """Send the spooled uploads to ``filesystem``, starting with the ones left in the journal.
+
+        :param filesystem: the :class:`~efs.filesystem.EFS` uploads are flushed to.
+        """
+        self.filesystem = filesystem
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="efs-write-behind")
+        entries = self._replay()
+        self._journal = open(self.home.getsyspath(JOURNAL_NAME), "a")
+        for spool_id, path, options in entries:
+            self._queue(spool_id, path, options)
+
+    def _replay(self):
+        """Return the uploads the journal records as not done, and rewrite it with only them."""
+        journal = self.home.getsyspath(JOURNAL_NAME)
+        entries = {}
+        with contextlib.suppress(FileNotFoundError), open(journal) as lines:
+            for line in lines:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # The last line may have been cut by a crash
+                    continue
+                if record[0] == "put":
+                    entries[record[1]] = record[1:]
+                else:
+                    entries.pop(record[1], None)
+        latest = {}
+        for spool_id, path, options in entries.values():
+            if self.home.isfile(spool_id):
+                latest.pop(path, None)
+                latest[path] = (spool_id, path, options)
+        kept = {spool_id for spool_id, _, _ in latest.values()}
+        for name in self.home.listdir("/"):
+            if name != JOURNAL_NAME and name not in kept:
+                self.home.remove(name)
+        temp = journal + ".tmp"
+        with open(temp, "w") as compacted:
+            for spool_id, path, options in latest.values():
+                compacted.write(json.dumps(["put", spool_id, path, options]) + "\n")
+            compacted.flush()
+            os.fsync(compacted.fileno())
+        os.replace(temp, journal)
+        return list(latest.values())
+
+    def _record(self, *record, sync=False):
+        """Append ``record`` to the journal, on disk before returning if ``sync``."""
+        if self._journal.closed:
+            # Uploads finishing after close are sent again on next start
+            return
+        self._journal.write(json.dumps(record) + "\n")
+        self._journal.flush()
+        if sync:
+            os.fsync(self._journal.fileno())
+
+    def submit(self, path, content, options):
+        """Spool ``content`` and queue its upload to ``path``.
+
+        :param path: the relative path to file, including filename.
+        :param content: what :meth:`~efs.filesystem.EFS.upload` accepts, but paths and descriptors.
+        :param options: the keyword arguments of the upload, they must be JSON serialisable.
+        :return: the number of bytes spooled.
+        """
+        spool_id = uuid.uuid4().hex
+        if isinstance(content, str):
+            content = content.encode()
+        try:
+            size = self.home.upload_stream(spool_id, content, self.filesystem.part_size)
+            descriptor = os.open(self.home.getsyspath(spool_id), os.O_RDONLY)
+            try:
+                os.fsync(descriptor)
+            finally:
+                os.close(descriptor)
+        except Exception:
+            with contextlib.suppress(errors.ResourceNotFound):
+                self.home.remove(spool_id)
+            raise
+        with self._changed:
+            self._record("put", spool_id, cache_path(path), options, sync=True)
+            self._queue(spool_id, cache_path(path), options)
+        return size
+
+    def _queue(self, spool_id, path, options):
+        """Queue the upload of ``spool_id``, dropping the upload to the same path waiting for its turn."""
+        with self._changed:
+            queue = self._queues.get(path)
+            if queue is None:
+                self._queues[path] = [(spool_id, options)]
+                self._executor.submit(self._send, path)
+                return
+            if len(queue) > 1:
+                self._done(queue.pop()[0])
+            queue.append((spool_id, options))
+
+    def _done(self, spool_id):
+        """Mark the upload of ``spool_id`` as done and delete its file, the journal has to be locked."""
+        self._record("done", spool_id)
+        with contextlib.suppress(errors.ResourceNotFound):
+            self.home.remove(spool_id)
+
+    def _send(self, path):
+        """Upload the queue of ``path``, one spooled file after the other."""
+        while True:
+            with self._changed:
+                queue = self._queues[path]
+                if not queue or self._closed:
+                    del self._queues[path]
+                    self._changed.notify_all()
+                    return
+                spool_id, options = queue[0]
+            error = self._upload(path, spool_id, options)
+            with self._changed:
+                queue.pop(0)
+                failed = self._failed.pop(path, None)
+                if error is None:
+                    self._done(spool_id)
+                    if failed is not None:
+                        self._done(failed[0])
+                else:
+                    self._failed[path] = (spool_id, options)
+                    if failed is not None:
+                        self._done(failed[0])
+            if error is not None and self.on_failure:
+                self.on_failure(BatchResult(path, None, error))
+
+    def _upload(self, path, spool_id, options):
+        """Upload the spooled file, retrying on errors, and return the last error or None."""
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                time.sleep(self.retry_delay * 2 ** (attempt - 1))
+            try:
+                with self.home.openbin(spool_id) as content:
+                    self.filesystem.upload(path, content, write_behind=False, **options)
+                return None
+            except Exception as exc:
+                error = exc
+        return error
+
+    def _latest(self, path):
+        """Return the last upload to ``path`` still in the spool, or None. The journal has to be locked."""
+        queue = self._queues.get(path)
+        return queue[-1] if queue else self._failed.get(path)
+
+    def spooled(self, path):
+        """Whether the content of ``path`` is in the spool, waiting to be uploaded or given up.
+
+        :param path: the relative path to file, including filename.
+        """
+        with self._changed:
+            return self._latest(cache_path(path)) is not None
+
+    def spooled_folder(self, path):
+        """Whether files under the folder ``path`` are in the spool, so it exists once they are uploaded.
+
+        :param path: the relative path to folder.
+        """
+        path = cache_path(path)
+        with self._changed:
+            return any(queued != path and _under(queued, path) for queued in self._spooled_paths())
+
+    def entries(self, path, recursive=True):
+        """Return a :class:`~efs.listing.FileEntry` for every file under the folder ``path`` in the spool.
+
+        The sizes are the ones of the content before compression, the ETags are None.
+
+        :param path: the relative path to folder.
+        :param recursive: also list the files of the sub folders.
+        """
+        path = cache_path(path)
+        entries = []
+        with self._changed:
+            for queued in self._spooled_paths():
+                name = queued[len(path) + 1:] if path else queued
+                if queued == path or not _under(queued, path) or (not recursive and "/" in name):
+                    continue
+                info = self.home.getinfo(self._latest(queued)[0], ["details"])
+                entries.append(FileEntry(queued, info.size, info.modified, None))
+        return sorted(entries)
+
+    def _spooled_paths(self):
+        """Return the paths whose content is in the spool. The journal has to be locked."""
+        return [path for path in set(self._queues).union(self._failed) if self._latest(path) is not None]
+
+    def open(self, path):
+        """Return the spooled content of ``path`` opened for reading, or None if it is not in the spool.
+
+        :param path: the relative path to file, including filename.
+        """
+        with self._changed:
+            latest = self._latest(cache_path(path))
+            # The file stays readable once opened, even if its upload finishes and deletes it
+            return None if latest is None else self.home.openbin(latest[0])
+
+    def wait(self, path):
+        """Wait for the uploads to ``path`` and under it to be sent.
+
+        Operations changing ``path`` call this first, so they are applied after the uploads that came before.
+
+        :param path: the relative path to file or folder.
+        """
+        path = cache_path(path)
+        with self._changed:
+            self._changed.wait_for(lambda: not any(_under(queued, path) for queued in self._queues))
+
+    def discard(self, path):
+        """Forget the uploads to ``path`` and under it that were given up.
+
+        :param path: the relative path to file or folder.
+        """
+        path = cache_path(path)
+        with self._changed:
+            for failed in [failed for failed in self._failed if _under(failed, path)]:
+                self._done(self._failed.pop(failed)[0])
+
+    def flush(self, timeout=None):
+        """Wait for every spooled upload to be sent, or given up.
+
+        :param timeout: how many seconds to wait at most, forever if None.
+        :return: whether nothing is left to send.
+        """
+        with self._changed:
+            return self._changed.wait_for(lambda: not self._queues, timeout)
+
+    def close(self, timeout=None):
+        """Flush the uploads and stop the threads, what is not sent in ``timeout`` seconds is sent on next start.
+
+        :param timeout: how many seconds to wait for the uploads at most, forever if None.
+        :return: whether every upload was sent.
+        """
+        flushed = self.flush(timeout)
+        with self._changed:
+            self._closed = True
+            self._journal.close()
+        self._executor.shutdown(wait=flushed)
+        return flushed
@@ -7,6 +7,8 @@ import pytest
 from flask import Flask
 from moto import mock_s3
 
+from efs import pool
+
 
 @pytest.yield_fixture(scope='function')
 def app():
@@ -65,6 +67,7 @@ def bucket(request, app):
                 file.delete()
 
             mock.stop()
+            pool.reset()
 
         request.addfinalizer(tear_down)
 
@@ -0,0 +1,99 @@
+"""Asyncio filesystem tests."""
+import asyncio
+import os
+import time
+
+import pytest
+from flask import current_app
+
+from efs import AsyncEFS
+
+
+def run(coroutine):
+    """Run ``coroutine`` in a new event loop."""
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def test_operations(app, delete_temp_files):
+    """Test every operation of the local storage as a coroutine."""
+    assert app
+    assert delete_temp_files
+    home_path = current_app.config['LOCAL_STORAGE']
+
+    async def scenario():
+        async with AsyncEFS(max_concurrency=4) as aefs:
+            sizes = await asyncio.gather(*[aefs.upload('a/{}.txt'.format(number), b'x' * number) for number in range(10)])
+            assert sizes == list(range(10))
+            assert await aefs.read('a/3.txt') == b'xxx'
+
+            await aefs.rename('a/3.txt', 'a/three.txt')
+            await aefs.move('a/three.txt', 'b/three.txt')
+            async with await aefs.open('b/three.txt') as reader:
+                await reader.seek(1)
+                assert await reader.read() == b'xx'
+
+            await aefs.remove('a')
+            assert not os.path.exists(os.path.join(home_path, 'a'))
+            assert os.path.exists(os.path.join(home_path, 'b/three.txt'))
+
+    run(scenario())
+
+
+def test_concurrency_is_bounded(app, delete_temp_files, monkeypatch):
+    """Test no more than max_concurrency blocking calls run at once."""
+    assert app
+    assert delete_temp_files
+    running = []
+    peak = []
+
+    async def scenario():
+        aefs = AsyncEFS(max_concurrency=3)
+        upload = aefs.filesystem.upload
+
+        def slow_upload(*args, **kwargs):
+            running.append(1)
+            peak.append(len(running))
+            try:
+                time.sleep(0.01)
+                return upload(*args, **kwargs)
+            finally:
+                running.pop()
+
+        monkeypatch.setattr(aefs.filesystem, 'upload', slow_upload)
+        await asyncio.gather(*[aefs.upload('{}.txt'.format(number), b'x') for number in range(12)])
+        await aefs.close()
+
+    run(scenario())
+    assert max(peak) <= 3
+
+
+def test_streaming_writer_and_reader(app, delete_temp_files):
+    """Test uploading from an async iterator and reading back in chunks."""
+    assert app
+    assert delete_temp_files
+
+    async def chunks():
+        for number in range(5):
+            await asyncio.sleep(0)
+            yield bytes([number]) * 100
+
+    async def scenario():
+        async with AsyncEFS() as aefs:
+            assert await aefs.upload('streamed.bin', chunks(), part_size=64) == 500
+            reader = await aefs.open('streamed.bin')
+            reader.chunk_size = 128
+            read = [chunk async for chunk in reader]
+            await reader.close()
+            assert b''.join(read) == b''.join(bytes([number]) * 100 for number in range(5))
+            assert len(read) == 4
+
+            with pytest.raises(ValueError):
+                async with aefs.writer('failed.bin') as writer:
+                    await writer.write(b'partial')
+                    raise ValueError('producer failed')
+
+    run(scenario())
@@ -0,0 +1,88 @@
+"""Cache tests."""
+from efs import EFS
+from efs.cache import MetadataCache
+
+
+class FakeClock:
+    """A clock that only moves when told to."""
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def test_metadata_cache_ttl_and_lru():
+    """Test entries expire after the ttl and the least recently used paths are evicted first."""
+    clock = FakeClock()
+    cache = MetadataCache(max_entries=2, ttl=10, clock=clock)
+    loads = []
+
+    def load(value):
+        return lambda: loads.append(value) or value
+
+    assert cache.get_or_load('a', 'exists', load(True)) is True
+    assert cache.get_or_load('/a/', 'exists', load(False)) is True
+    assert cache.stats == {'hits': 1, 'misses': 1, 'size': 1}
+
+    clock.now = 11
+    assert cache.get_or_load('a', 'exists', load(False)) is False
+
+    cache.get_or_load('b', 'exists', load(True))
+    cache.get_or_load('a', 'exists', load(True))
+    cache.get_or_load('c', 'exists', load(True))
+    assert len(cache) == 2
+    cache.get_or_load('a', 'exists', load(True))
+    cache.get_or_load('b', 'exists', load(True))
+    assert loads == [True, False, True, True, True]
+
+
+def test_metadata_cache_skips_stale_loads():
+    """Test a value loaded while its path is invalidated is returned but not cached."""
+    cache = MetadataCache()
+
+    def load_during_write():
+        cache.invalidate_tree('dir')
+        return False
+
+    assert cache.get_or_load('dir/file.txt', 'exists', load_during_write) is False
+    assert cache.get_or_load('dir/file.txt', 'exists', lambda: True) is True
+
+    def load_during_parent_write():
+        cache.invalidate_parents('dir/file.txt')
+        return True
+
+    assert cache.get_or_load('dir', 'isdir', load_during_parent_write) is True
+    assert cache.get_or_load('dir', 'isdir', lambda: False) is False
+    assert cache.get_or_load('dir', 'isdir', lambda: True) is False
+
+
+def test_metadata_cache_invalidation(app, delete_temp_files):
+    """Test writes through EFS keep the cache up to date."""
+    assert app
+    assert delete_temp_files
+
+    cache = MetadataCache()
+    efs = EFS(metadata_cache=cache)
+    assert not efs.exists('dir/file.txt')
+    assert not efs.isdir('dir')
+
+    efs.upload('dir/file.txt', b'data')
+    misses = cache.misses
+    assert efs.exists('dir/file.txt')
+    assert not efs.isdir('dir/file.txt')
+    assert cache.misses == misses
+    assert efs.isdir('dir')
+    assert efs.getinfo('dir/file.txt', ['details']).size == 4
+    assert efs.open('dir/file.txt').read() == b'data'
+
+    efs.move('dir/file.txt', 'other/file.txt')
+    assert not efs.exists('dir/file.txt')
+    assert efs.exists('other/file.txt')
+    assert efs.isdir('other')
+
+    efs.remove('other')
+    assert not efs.exists('other/file.txt')
+    assert not efs.isdir('other')
+    assert cache.hits > 0
@@ -0,0 +1,124 @@
+"""Flask extension tests."""
+import gzip
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import pytest
+from fs import errors
+
+import efs
+from efs import EFS
+from efs import FlaskEFS
+from efs.compression import CompressionPolicy
+
+
+def test_init_app(app, delete_temp_files, monkeypatch):
+    """Test the filesystem is built once at init_app and get_filesystem only looks it up."""
+    assert delete_temp_files
+    app.config['DEFAULT_STORAGE'] = 'local'
+    storage = FlaskEFS(fast_upload=True)
+    storage.init_app(app)
+
+    filesystem = app.extensions['efs']
+    assert isinstance(filesystem, EFS)
+    assert filesystem.fast_upload
+    assert storage.filesystem is filesystem
+
+    monkeypatch.setattr(EFS, '__init__', None)
+    assert efs.get_filesystem() is filesystem
+    assert EFS.get_filesystem() is filesystem
+
+
+def test_get_filesystem_without_extension(app, delete_temp_files):
+    """Test apps without the extension still get a new filesystem per call."""
+    assert delete_temp_files
+    app.config['DEFAULT_STORAGE'] = 'local'
+
+    assert efs.get_filesystem() is not efs.get_filesystem()
+
+
+def test_shared_filesystem_across_threads(app, bucket):
+    """Test threads sharing the app's filesystem each get their own content type and content."""
+    bucket = bucket()
+    app.config['DEFAULT_STORAGE'] = 's3'
+    FlaskEFS(app, fast_upload=True)
+    content_types = ['text/plain', 'text/csv', 'application/json', 'image/png']
+
+    def upload(number):
+        with app.app_context():
+            filesystem = efs.get_filesystem()
+            path = 'thread/{}.bin'.format(number)
+            filesystem.upload(path, str(number), content_type=content_types[number % 4])
+            return filesystem
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        filesystems = list(executor.map(upload, range(40)))
+
+    assert all(filesystem is app.extensions['efs'] for filesystem in filesystems)
+    assert 'ContentType' not in app.extensions['efs'].home.upload_args
+    for number in range(40):
+        obj = bucket.Object('thread/{}.bin'.format(number)).get()
+        assert obj['Body'].read() == str(number).encode()
+        assert obj['ContentType'] == content_types[number % 4]
+
+
+def test_local_tickets(app, delete_temp_files):
+    """Test the ticket endpoint stores uploads, joins multipart ones and serves downloads of valid tokens only."""
+    assert delete_temp_files
+    app.config.update(DEFAULT_STORAGE='local', SECRET_KEY='secret', EFS_TICKET_URL='http://localhost/_efs/tickets')
+    uploaded = []
+    FlaskEFS(app, ticket_rule='/_efs/tickets', on_direct_upload=uploaded.append)
+    filesystem = efs.get_filesystem()
+    client = app.test_client()
+
+    ticket = filesystem.upload_ticket('avatars/1.png', content_type='image/png', max_size=10)
+    assert ticket.method == 'PUT'
+    assert client.put(ticket.url, data=b'png').status_code == 201
+    assert filesystem.open('avatars/1.png').read() == b'png'
+    assert [(entry.path, entry.size) for entry in uploaded] == [('avatars/1.png', 3)]
+    assert client.put(ticket.url, data=b'x' * 11).status_code == 413
+    # Chunked bodies have no Content-Length, they are cut while they are read
+    chunked = {'wsgi.input_terminated': True}
+    response = client.put(ticket.url, input_stream=BytesIO(b'x' * 5000), environ_overrides=chunked)
+    assert response.status_code == 413
+    assert filesystem.open('avatars/1.png').read() == b'png'
+    assert not filesystem.home.listdir('.uploads')
+    assert client.post(ticket.url, data={'file': (BytesIO(b'png'), 'a.png')}).status_code == 403
+    assert client.put(ticket.url[:-2] + 'xx', data=b'png').status_code == 403
+    with pytest.raises(PermissionError):
+        filesystem.upload_ticket('.efs/avatars/1.png')
+
+    ticket = filesystem.upload_ticket('avatars/2.png', post=True)
+    assert client.post(ticket.url, data={'file': (BytesIO(b'form'), 'a.png')}).status_code == 201
+    assert filesystem.open('avatars/2.png').read() == b'form'
+
+    ticket = filesystem.multipart_ticket('videos/1.mp4', size=25, part_size=10)
+    assert len(ticket.urls) == 3
+    etags = []
+    for number, url in enumerate(ticket.urls):
+        response = client.put(url, data=bytes([number]) * (10 if number < 2 else 5))
+        etags.append(response.headers['ETag'])
+    response = client.put(ticket.urls[0], input_stream=BytesIO(b'x' * 11), environ_overrides=chunked)
+    assert response.status_code == 413
+    assert not filesystem.exists('videos/1.mp4')
+    with pytest.raises(errors.ResourceNotFound):
+        filesystem.complete_upload('videos/1.mp4', ticket.upload_id, [etags[1], etags[0], etags[2]])
+    assert not filesystem.exists('videos/1.mp4')
+    entry = filesystem.complete_upload('videos/1.mp4', ticket.upload_id, etags)
+    assert entry.size == 25
+    assert filesystem.open('videos/1.mp4').read() == b'\x00' * 10 + b'\x01' * 10 + b'\x02' * 5
+    assert uploaded[-1] == entry
+    assert not filesystem.exists('.uploads/' + ticket.upload_id)
+
+    ticket = filesystem.download_ticket('videos/1.mp4', filename='intro.mp4')
+    response = client.get(ticket.url)
+    assert response.data == filesystem.open('videos/1.mp4').read()
+    assert 'attachment' in response.headers['Content-Disposition']
+    assert client.get(filesystem.download_ticket('videos/1.mp4', expires_in=-1).url).status_code == 403
+    assert client.get(filesystem.download_ticket('missing.mp4').url).status_code == 404
+
+    filesystem.compression = CompressionPolicy()
+    filesystem.upload('exports/report.json', b'{"id": 1}')
+    response = client.get(filesystem.download_ticket('exports/report.json').url)
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(response.data) == b'{"id": 1}'
@@ -0,0 +1,42 @@
+"""Import time tests."""
+import subprocess
+import sys
+
+HEAVY_MODULES = ('asyncio', 'boto3', 'botocore', 'flask', 'fs_s3fs')
+
+
+def imported_modules(code):
+    """Run ``code`` in a new interpreter with ``-X importtime`` and return the cumulative microseconds per module."""
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code], stderr=subprocess.PIPE, universal_newlines=True, check=True
+    )
+    modules = {}
+    for line in process.stderr.splitlines():
+        if line.startswith('import time:') and '|' in line and 'cumulative' not in line:
+            _, cumulative, name = line.split('|')
+            modules[name.strip()] = int(cumulative)
+    return modules
+
+
+def test_import_loads_nothing():
+    """Test importing the package does not load any of its modules nor their dependencies."""
+    modules = imported_modules('import efs')
+    # In microseconds, loading the backends eagerly took about 500 ms
+    assert modules['efs'] < 50000
+    assert not [name for name in modules if name.startswith(('efs.', 'fs') + HEAVY_MODULES)]
+
+
+def test_local_storage_does_not_load_s3(tmp_path):
+    """Test a local filesystem built with its config never loads the S3 backend, boto3, flask or asyncio."""
+    modules = imported_modules(
+        'from efs import EFS\n'
+        'fs = EFS(storage="local", config={{"LOCAL_STORAGE": {!r}}})\n'
+        'fs.upload("file.txt", b"content")'.format(str(tmp_path))
+    )
+    assert 'efs.eatfirst_osfs' in modules
+    assert 'efs.eatfirst_s3' not in modules
+    assert not [name for name in modules if name.split('.')[0] in HEAVY_MODULES]
+
+    modules = imported_modules('from efs import EFS\nEFS(storage="s3", config={"S3_BUCKET": "bucket"})')
+    assert 'efs.eatfirst_s3' in modules
+    assert 'boto3' in modules
@@ -1,12 +1,20 @@
 """EatFirst FileSystem tests."""
 
+import gzip
+import mmap
 import os
 from io import BytesIO
+from uuid import uuid4
 
+import pytest
 from faker import Faker
 from flask import current_app
 
 from efs import EFS
+from efs.compression import CompressionPolicy
+from efs.dedup import Pointer
+from efs.dedup import decode_pointer
+from efs.dedup import encode_pointer
 
 fake = Faker()
 TEST_FILE = 'test_file.txt'
@@ -93,3 +101,350 @@ def test_move_file(app, delete_temp_files):
     efs.move(TEST_FILE, 'special_text/test_file.txt')
     assert not os.path.exists(os.path.join(home_path, TEST_FILE))
     assert os.path.exists(os.path.join(home_path, 'special_text/' + TEST_FILE))
+
+
+def test_upload_stream(app, delete_temp_files):
+    """Test uploading an iterator of chunks and an open file without buffering them."""
+    assert app
+    assert delete_temp_files
+
+    efs = EFS(part_size=4)
+    home_path = current_app.config['LOCAL_STORAGE']
+    assert efs.upload('streamed/' + TEST_FILE, (piece for piece in [b'abc', 'def', b'ghijk'])) == 11
+    with open(os.path.join(home_path, 'streamed', TEST_FILE), 'rb') as uploaded:
+        assert uploaded.read() == b'abcdefghijk'
+
+    with open(os.path.join(home_path, 'streamed', TEST_FILE), 'rb') as source:
+        assert efs.upload('copy.txt', source, part_size=2) == 11
+    assert efs.open('copy.txt').read() == b'abcdefghijk'
+
+
+def test_open_ranged(app, delete_temp_files):
+    """Test a ranged open of a local file is a plain seekable file."""
+    assert app
+    assert delete_temp_files
+
+    efs = EFS()
+    efs.upload(TEST_FILE, b'0123456789')
+    with efs.open(TEST_FILE, ranged=True) as ranged_file:
+        ranged_file.seek(4)
+        assert ranged_file.read(3) == b'456'
+
+
+def test_batch_operations(app, delete_temp_files):
+    """Test batch upload, move and remove report every item instead of stopping at the first error."""
+    assert app
+    assert delete_temp_files
+
+    efs = EFS(batch_workers=4)
+    home_path = current_app.config['LOCAL_STORAGE']
+    uploaded = efs.upload_many(('batch/{}.txt'.format(number), b'x' * number) for number in range(10))
+    assert [(result.path, result.value, result.ok) for result in uploaded] == [
+        ('batch/{}.txt'.format(number), number, True) for number in range(10)
+    ]
+
+    moved = efs.move_many([('batch/1.txt', 'moved/1.txt'), ('missing.txt', 'moved/missing.txt')])
+    assert moved[0].ok
+    assert isinstance(moved[1].error, Exception)
+    assert os.path.exists(os.path.join(home_path, 'moved/1.txt'))
+
+    removed = efs.remove_many(['batch/2.txt', 'missing.txt', 'moved'])
+    assert [result.ok for result in removed] == [True, False, True]
+    assert not os.path.exists(os.path.join(home_path, 'batch/2.txt'))
+    assert not os.path.exists(os.path.join(home_path, 'moved'))
+
+
+def test_fast_upload(app, delete_temp_files, monkeypatch):
+    """Test a fast upload creates each parent directory only once."""
+    assert app
+    assert delete_temp_files
+
+    efs = EFS(fast_upload=True)
+    home_path = current_app.config['LOCAL_STORAGE']
+    created = []
+    makedirs = efs.home.makedirs
+    monkeypatch.setattr(efs.home, 'makedirs', lambda path, **kwargs: created.append(path) or makedirs(path, **kwargs))
+    # Without any compressed or deduplicated file, uploads do not touch the records
+    remove = efs.home.remove
+    monkeypatch.setattr(efs.home, 'remove', lambda path: pytest.fail('removed ' + path))
+
+    for number in range(3):
+        efs.upload('fast/dir/{}.txt'.format(number), b'data')
+    assert created == ['fast/dir']
+    monkeypatch.setattr(efs.home, 'remove', remove)
+    assert os.path.exists(os.path.join(home_path, 'fast/dir/2.txt'))
+
+    efs.remove('fast')
+    efs.upload('fast/dir/0.txt', b'data')
+    assert created == ['fast/dir', 'fast/dir']
+    assert os.path.exists(os.path.join(home_path, 'fast/dir/0.txt'))
+
+
+def test_move_folder(app, delete_temp_files):
+    """Test moving a folder with its content."""
+    assert app
+    assert delete_temp_files
+
+    efs = EFS()
+    home_path = current_app.config['LOCAL_STORAGE']
+    efs.upload('reports/2018/' + TEST_FILE, b'nested')
+    efs.move('reports', 'archive')
+    assert not os.path.exists(os.path.join(home_path, 'reports'))
+    assert os.path.exists(os.path.join(home_path, 'archive/2018', TEST_FILE))
+
+
+def test_remove_folder_dry_run(app, delete_temp_files):
+    """Test counting the files of a folder before removing it."""
+    assert app
+    assert delete_temp_files
+
+    efs = EFS()
+    home_path = current_app.config['LOCAL_STORAGE']
+    efs.upload_many(('counted/{}/{}.txt'.format(number % 2, number), b'x') for number in range(5))
+    assert efs.remove('counted', dry_run=True) == 5
+    assert os.path.exists(os.path.join(home_path, 'counted'))
+    assert efs.remove('counted') == 5
+    assert not os.path.exists(os.path.join(home_path, 'counted'))
+
+
+def test_iter_files(app, delete_temp_files):
+    """Test files are listed with their size and modification time, recursively or not."""
+    assert app
+    assert delete_temp_files
+
+    efs = EFS()
+    efs.upload_many(('listed/{}/{}.txt'.format(number % 2, number), b'x' * number) for number in range(6))
+    efs.upload('listed/top.txt', b'top')
+
+    entries = {entry.path: entry for entry in efs.iter_files('listed')}
+    assert sorted(entries) == ['listed/0/0.txt', 'listed/0/2.txt', 'listed/0/4.txt',
+                               'listed/1/1.txt', 'listed/1/3.txt', 'listed/1/5.txt', 'listed/top.txt']
+    assert entries['listed/1/5.txt'].size == 5
+    assert entries['listed/1/5.txt'].etag is None
+    assert entries['listed/1/5.txt'].mtime.timestamp() == pytest.approx(os.path.getmtime(
+        os.path.join(current_app.config['LOCAL_STORAGE'], 'listed/1/5.txt')))
+
+    assert [entry.path for entry in efs.iter_files('listed', recursive=False)] == ['listed/top.txt']
+    assert len(list(efs.iter_files())) == 7
+    assert list(efs.iter_files('missing')) == []
+
+
+def test_dedup(app, delete_temp_files):
+    """Test identical files share their content, which is removed with the last path pointing to it."""
+    assert app
+    assert delete_temp_files
+
+    efs = EFS(dedup=True)
+    home_path = current_app.config['LOCAL_STORAGE']
+    template = fake.binary(2048)
+    efs.upload_many(('invoices/{}.pdf'.format(number), template) for number in range(3))
+    efs.upload('invoices/other.pdf', b'other')
+
+    blobs = [entry for entry in efs.iter_files('.blobs') if '.refs/' not in entry.path]
+    assert sorted(entry.size for entry in blobs) == [5, 2048]
+    assert os.path.getsize(os.path.join(home_path, 'invoices/0.pdf')) < 1024
+    assert efs.open('invoices/2.pdf').read() == template
+
+    efs.move('invoices/other.pdf', 'invoices/1.pdf')
+    efs.rename('invoices/0.pdf', 'archive.pdf')
+    assert efs.open('archive.pdf').read() == template
+    # Pointers are followed by filesystems that do not deduplicate too
+    assert EFS().open('archive.pdf').read() == template
+    assert efs.open('invoices/1.pdf').read() == b'other'
+    assert efs.remove('invoices') == 2
+    assert [entry.size for entry in efs.iter_files('.blobs') if '.refs/' not in entry.path] == [2048]
+    efs.remove_many(['archive.pdf'])
+    assert list(efs.iter_files('.blobs')) == []
+
+    # Uploads looking like pointers are regular files, and pointers only lead to blobs
+    efs.upload('secret.txt', b'secret')
+    forged = encode_pointer(Pointer('secret.txt', uuid4().hex, 6))
+    efs.upload('invoices/forged.pdf', forged)
+    assert efs.open('invoices/forged.pdf').read() == forged
+    efs.remove('invoices/forged.pdf')
+    assert efs.open('secret.txt').read() == b'secret'
+    assert decode_pointer(forged) is None
+
+
+def test_dedup_release_race(app, delete_temp_files, monkeypatch):
+    """Test an upload referencing a blob while its last reference is released keeps the blob."""
+    assert app
+    assert delete_temp_files
+
+    efs = EFS(dedup=True)
+    efs.upload('a.bin', b'shared')
+    iter_files = efs.home.iter_files
+    raced = []
+
+    def upload_between(path, recursive=True):
+        entries = list(iter_files(path, recursive))
+        if path.endswith('.refs') and not entries and not raced:
+            # The same content is uploaded after the release found no reference and before it removes the blob
+            raced.append(path)
+            efs.upload('b.bin', b'shared')
+        return iter(entries)
+
+    monkeypatch.setattr(efs.home, 'iter_files', upload_between)
+    efs.remove('a.bin')
+    assert raced
+    assert efs.open('b.bin').read() == b'shared'
+    assert [entry.path for entry in efs.iter_files('.blobs') if '.refs/' not in entry.path] == [raced[0][:-5]]
+
+    efs.remove('b.bin')
+    assert list(efs.iter_files('.blobs')) == []
+
+
+def test_compression(app, delete_temp_files):
+    """Test text files are compressed on disk and read back decompressed, other files are kept as is."""
+    assert app
+    assert delete_temp_files
+
+    efs = EFS(compression=CompressionPolicy())
+    home_path = current_app.config['LOCAL_STORAGE']
+    content = b'{"id": 1, "name": "report"}\n' * 500
+    archive = gzip.compress(b'already compressed')
+
+    efs.upload('exports/report.json', BytesIO(content))
+    efs.upload('exports/archive.gz', archive)
+    with open(os.path.join(home_path, 'exports/report.json'), 'rb') as stored:
+        assert gzip.decompress(stored.read()) == content
+    assert efs.open('exports/report.json').read() == content
+    assert efs.open('exports/archive.gz').read() == archive
+
+    # Only the files the policy compressed are decompressed, whatever their content looks like
+    efs.upload('backups/dump.bin', archive)
+    assert efs.open('backups/dump.bin').read() == archive
+    efs.move('exports/report.json', 'backups/dump.bin')
+    assert efs.open('backups/dump.bin').read() == content
+    efs.upload('backups/dump.bin', archive)
+    assert efs.open('backups/dump.bin').read() == archive
+    assert sorted(entry.path for entry in efs.iter_files()) == ['backups/dump.bin', 'exports/archive.gz']
+
+    # Compressed files are decompressed by filesystems without a policy too
+    efs.upload('exports/report.json', content)
+    assert EFS().open('exports/report.json').read() == content
+
+
+def test_move_to_new_nested_folder(app, delete_temp_files):
+    """Test moving a file creates every missing folder of the destination."""
+    assert app
+    assert delete_temp_files
+
+    efs = EFS()
+    efs.upload('file.txt', b'content')
+    efs.move('file.txt', 'a/b/c/file.txt')
+    assert efs.open('a/b/c/file.txt').read() == b'content'
+
+
+def test_upload_buffers_and_local_files(app, delete_temp_files, tmp_path):
+    """Test buffers are written in place and local files copied from their path, descriptor or position."""
+    assert app
+    assert delete_temp_files
+
+    efs = EFS(part_size=1000)
+    home_path = current_app.config['LOCAL_STORAGE']
+    content = os.urandom(4500)
+    source = tmp_path / 'source.bin'
+    source.write_bytes(content)
+
+    assert efs.upload('buffers/bytearray.bin', bytearray(content)) == 4500
+    assert efs.upload('buffers/memoryview.bin', memoryview(content)[500:]) == 4000
+    with open(source, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        assert efs.upload('buffers/mmap.bin', mapped) == 4500
+
+    parts = []
+    assert efs.upload('files/path.bin', source, on_part=parts.append) == 4500
+    assert [part.size for part in parts] == [1000, 1000, 1000, 1000, 500]
+    descriptor = os.open(source, os.O_RDONLY)
+    try:
+        assert efs.upload('files/descriptor.bin', descriptor) == 4500
+    finally:
+        os.close(descriptor)
+    with open(source, 'rb') as file:
+        file.read(100)
+        assert efs.upload('files/file.bin', file) == 4400
+        assert file.read() == b''
+
+    for name, expected in (('buffers/bytearray.bin', content), ('buffers/memoryview.bin', content[500:]),
+                           ('buffers/mmap.bin', content), ('files/path.bin', content),
+                           ('files/descriptor.bin', content), ('files/file.bin', content[100:])):
+        with open(os.path.join(home_path, name), 'rb') as stored:
+            assert stored.read() == expected, name
+
+
+def test_sync(app, delete_temp_files, tmp_path):
+    """Test only changed files are copied, extraneous ones deleted and failed syncs resumed from the state file."""
+    assert app
+    assert delete_temp_files
+
+    efs = EFS(fast_upload=True)
+    mirror = EFS(config={'LOCAL_STORAGE': str(tmp_path / 'mirror')})
+    efs.upload_many(('site/{}.html'.format(number), 'page {}'.format(number)) for number in range(5))
+    efs.upload('site/css/main.css', b'body {}')
+    efs.upload('other/skipped.txt', b'not synced')
+
+    result = efs.sync('site', mirror, 'www')
+    assert sorted(result.copied) == ['0.html', '1.html', '2.html', '3.html', '4.html', 'css/main.css']
+    assert (result.deleted, result.skipped, result.failed) == ([], 0, [])
+    assert mirror.open('www/css/main.css').read() == b'body {}'
+    assert not mirror.exists('www/skipped.txt')
+
+    efs.upload('site/1.html', b'page one, longer')
+    efs.remove('site/4.html')
+    mirror.upload('www/stale.html', b'stale')
+    assert efs.sync('site', mirror, 'www', dry_run=True) == (['1.html'], [], 4, [])
+    result = efs.sync('site', mirror, 'www', delete=True)
+    assert (result.copied, sorted(result.deleted), result.skipped) == (['1.html'], ['4.html', 'stale.html'], 4)
+    assert mirror.open('www/1.html').read() == b'page one, longer'
+    assert not mirror.exists('www/4.html')
+
+    state_file = str(tmp_path / 'site.sync')
+    efs.upload_many(('site/new/{}.html'.format(number), 'new {}'.format(number)) for number in range(3))
+    write = mirror._write
+
+    def flaky(path, *args, **kwargs):
+        if path == 'www/new/1.html':
+            raise OSError('disk full')
+        return write(path, *args, **kwargs)
+
+    mirror._write = flaky
+    progress = []
+    result = efs.sync('site', mirror, 'www', state_file=state_file, on_progress=progress.append)
+    assert sorted(result.copied) == ['new/0.html', 'new/2.html']
+    assert [failure.path for failure in result.failed] == ['new/1.html']
+    assert progress == [1, 2]
+    assert os.path.exists(state_file)
+
+    # The plan is resumed, the folders are not listed again
+    mirror._write = write
+    efs.iter_files = mirror.iter_files = None
+    result = efs.sync('site', mirror, 'www', state_file=state_file)
+    assert (result.copied, result.failed) == (['new/1.html'], [])
+    assert mirror.open('www/new/1.html').read() == b'new 1'
+    assert not os.path.exists(state_file)
+
+    with open(state_file, 'w') as file:
+        file.write('{"sync": {"source": ["s3", "other"]}}\n')
+    with pytest.raises(RuntimeError):
+        efs.sync('site', mirror, 'www', state_file=state_file)
+
+
+def test_sync_command(app, delete_temp_files, tmp_path, capsys):
+    """Test the efs-sync command mirrors a local folder."""
+    assert app
+    assert delete_temp_files
+
+    from efs.cli import sync
+
+    source = tmp_path / 'source'
+    (source / 'docs').mkdir(parents=True)
+    (source / 'docs' / 'readme.txt').write_bytes(b'read me')
+    destination = tmp_path / 'destination'
+    assert sync([str(source), str(destination), '--dry-run']) == 0
+    assert not (destination / 'docs').exists()
+    assert sync([str(source), str(destination)]) == 0
+    assert (destination / 'docs' / 'readme.txt').read_bytes() == b'read me'
+    assert sync([str(source), str(destination)]) == 0
+    output = capsys.readouterr()
+    assert output.out.splitlines() == ['copy docs/readme.txt', 'copy docs/readme.txt']
+    assert output.err.splitlines()[-1] == '0 copied, 0 deleted, 1 up to date, 0 failed'
@@ -0,0 +1,109 @@
+"""Memory and tiered FileSystem tests."""
+
+import os
+import threading
+
+import pytest
+from flask import current_app
+from fs.errors import InsufficientStorage
+
+from efs import EFS
+
+TEST_FILE = 'test_file.txt'
+
+
+def test_memory_storage(app):
+    """Test files are kept in memory, within the byte budget."""
+    assert app
+    app.config['MEMORY_STORAGE_SIZE'] = 10
+
+    efs = EFS(storage='memory')
+    efs.upload('folder/' + TEST_FILE, b'0123456789')
+    assert efs.open('folder/' + TEST_FILE).read() == b'0123456789'
+    assert sorted(entry.path for entry in efs.iter_files()) == ['folder/' + TEST_FILE]
+    assert efs.home.used == 10
+
+    with pytest.raises(InsufficientStorage):
+        efs.upload('other.txt', b'x')
+    efs.upload('folder/' + TEST_FILE, b'01234')
+    assert efs.home.used == 5
+    efs.upload('other.txt', b'abcde')
+    assert efs.home.used == 10
+
+    efs.move('other.txt', 'folder/' + TEST_FILE)
+    assert efs.home.used == 5
+    efs.remove('folder')
+    assert efs.home.used == 0
+    with pytest.raises(FileNotFoundError):
+        efs.open('folder/' + TEST_FILE)
+
+
+def test_tiered_storage(app, delete_temp_files):
+    """Test small files are kept in memory and the big or least recently used ones are written to disk."""
+    assert app
+    assert delete_temp_files
+    app.config['MEMORY_STORAGE_SIZE'] = 10
+    app.config['MEMORY_STORAGE_FILE_SIZE'] = 6
+    home_path = current_app.config['LOCAL_STORAGE']
+
+    efs = EFS(storage='tiered', part_size=4)
+    efs.upload('big.txt', b'0123456789')
+    assert os.path.exists(os.path.join(home_path, 'big.txt'))
+    assert efs.home.used == 0
+
+    efs.upload('folder/a.txt', b'aaaaa')
+    efs.upload('folder/b.txt', b'bbbbb')
+    assert not os.path.exists(os.path.join(home_path, 'folder', 'a.txt'))
+    assert efs.home.used == 10
+    assert efs.open('folder/a.txt').read() == b'aaaaa'
+
+    # b.txt is now the least recently used file, it makes room for c.txt
+    efs.upload('folder/c.txt', b'ccccc')
+    assert os.path.exists(os.path.join(home_path, 'folder', 'b.txt'))
+    assert efs.home.used == 10
+    assert efs.open('folder/b.txt').read() == b'bbbbb'
+    assert sorted(efs.home.listdir('folder')) == ['a.txt', 'b.txt', 'c.txt']
+    paths = sorted(entry.path for entry in efs.iter_files())
+    assert paths == ['big.txt', 'folder/a.txt', 'folder/b.txt', 'folder/c.txt']
+
+    efs.move('folder/a.txt', 'folder/b.txt')
+    assert not os.path.exists(os.path.join(home_path, 'folder', 'b.txt'))
+    assert efs.open('folder/b.txt').read() == b'aaaaa'
+    assert efs.remove('folder') == 2
+    assert efs.home.used == 0
+    assert not os.path.exists(os.path.join(home_path, 'folder'))
+
+
+def test_tiered_storage_concurrent_reads(app, delete_temp_files):
+    """Test files moving between the tiers while they are uploaded stay readable from other threads."""
+    assert app
+    assert delete_temp_files
+    app.config['MEMORY_STORAGE_SIZE'] = 100
+    app.config['MEMORY_STORAGE_FILE_SIZE'] = 50
+    paths = ['folder/{}.txt'.format(number) for number in range(10)]
+
+    efs = EFS(storage='tiered')
+    for path in paths:
+        efs.upload(path, b'x' * 40)
+    done = threading.Event()
+    errors = []
+
+    def read():
+        while not done.is_set():
+            for path in paths:
+                try:
+                    assert efs.home.getinfo(path).name == os.path.basename(path)
+                    with efs.home.openbin(path) as file:
+                        assert len(file.read()) in (30, 40)
+                except Exception as error:
+                    errors.append(error)
+
+    readers = [threading.Thread(target=read) for _ in range(3)]
+    for reader in readers:
+        reader.start()
+    for number in range(1000):
+        efs.upload(paths[number % len(paths)], b'y' * (30 + number % 2 * 10))
+    done.set()
+    for reader in readers:
+        reader.join()
+    assert errors == []
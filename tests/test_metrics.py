@@ -0,0 +1,87 @@
+"""Instrumentation tests."""
+import pytest
+from fs.errors import ResourceNotFound
+
+from efs import EFS
+from efs import FlaskEFS
+from efs.metrics import MetricsCollector
+from efs.metrics import OperationRecord
+
+
+def test_collector_histogram():
+    """Test records are aggregated per operation and backend, with latency quantiles from the histogram."""
+    collector = MetricsCollector(buckets=(0.01, 0.1, 1))
+    for seconds in (0.005, 0.05, 0.05, 0.5, 5):
+        collector(OperationRecord('upload', 's3', 'exports', 10, seconds, 2, None))
+    collector(OperationRecord('open', 's3', 'exports', None, 0.01, 1, ResourceNotFound('missing')))
+
+    open_stats, upload_stats = collector.snapshot()
+    assert upload_stats['operation'] == 'upload' and upload_stats['prefix'] is None
+    assert upload_stats['count'] == 5 and upload_stats['bytes'] == 50 and upload_stats['requests'] == 10
+    assert upload_stats['histogram'] == {'0.01': 1, '0.1': 2, '1': 1, 'inf': 1}
+    assert upload_stats['max_seconds'] == 5
+    assert open_stats['errors'] == 1 and open_stats['histogram']['0.01'] == 1
+    assert collector.quantile('upload', 0.5) == 0.1
+    assert collector.quantile('upload', 0.99) == float('inf')
+    assert collector.quantile('upload', 0.5, backend='local') is None
+    collector.reset()
+    assert collector.snapshot() == []
+
+
+def test_hooks_record_operations(bucket):
+    """Test every operation is reported once, with the S3 requests made by it and by its worker threads."""
+    bucket()
+    records = []
+    efs = EFS(storage='s3', hooks=[records.append], part_size=5 * 1024 * 1024, max_concurrency=3, fast_upload=True)
+
+    assert efs.upload('exports/2018/big.csv', b'x' * (12 * 1024 * 1024)) == 12 * 1024 * 1024
+    efs.open('exports/2018/big.csv').close()
+    with pytest.raises(FileNotFoundError):
+        efs.open('exports/missing.csv')
+    efs.remove_many(['exports/2018/big.csv'])
+
+    upload, opened, missing, removed = records
+    assert upload[:4] == ('upload', 's3', 'exports', 12 * 1024 * 1024)
+    assert upload.requests == 5  # Create, three parts and complete
+    assert upload.error is None and upload.seconds > 0
+    assert opened.operation == 'open' and opened.requests >= 2
+    assert missing.operation == 'open' and isinstance(missing.error, FileNotFoundError)
+    assert removed.operation == 'remove_many' and removed.prefix is None and removed.requests == 1
+
+
+def test_no_hooks(app, delete_temp_files):
+    """Test filesystems without hooks do not instrument anything."""
+    assert delete_temp_files
+    efs = EFS()
+    efs.upload('file.txt', b'content')
+    assert efs.exists('file.txt')
+    assert efs._watched_client is None
+
+
+def test_flask_stats(app, delete_temp_files):
+    """Test the extension records the operations of the app filesystem and serves their statistics."""
+    assert delete_temp_files
+    app.config['DEFAULT_STORAGE'] = 'local'
+    collector = MetricsCollector()
+    storage = FlaskEFS(app, collector=collector, stats_rule='/_efs/stats')
+
+    storage.filesystem.upload('reports/a.txt', b'content')
+    storage.filesystem.upload('reports/b.txt', b'content')
+
+    stats = app.test_client().get('/_efs/stats').get_json()
+    assert stats == {'operations': collector.snapshot()}
+    assert stats['operations'][0]['operation'] == 'upload'
+    assert stats['operations'][0]['count'] == 2
+    assert stats['operations'][0]['bytes'] == 14
+
+
+def test_keyword_arguments(app, delete_temp_files):
+    """Test instrumented methods take their arguments by keyword, with or without hooks."""
+    assert delete_temp_files
+    for hooked in (False, True):
+        records = []
+        efs = EFS(hooks=[records.append] if hooked else None)
+        efs.upload(path='exports/file.txt', content=b'content')
+        assert efs.exists(path='exports/file.txt')
+        assert [result.ok for result in efs.remove_many(paths=['exports/file.txt'])] == [True]
+        assert [record.prefix for record in records] == (['exports', 'exports', None] if hooked else [])
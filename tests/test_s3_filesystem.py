@@ -1,12 +1,32 @@
 """EatFirst FileSystem tests."""
+import base64
+import gzip
+import json
+import mmap
+import os
+import threading
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 from uuid import uuid4
 
+import boto3
 import pytest
+import requests
 from botocore.exceptions import ClientError
 from faker import Faker
+from fs.errors import DestinationExists
+from fs.errors import ResourceNotFound
 
 from efs import EFS
+from efs import pool
+from efs.cache import DiskCache
+from efs.cache import MetadataCache
+from efs.compression import CompressionPolicy
+from efs.eatfirst_s3 import EatFirstS3
+from efs.streaming import iter_chunks
+from efs.writebehind import JOURNAL_NAME
+from efs.writebehind import WriteBehind
 
 fake = Faker()
 TEST_FILE = 'test_file_{0}.txt'.format(uuid4())
@@ -110,3 +130,717 @@ def test_move_file(bucket):
     assert e.value.response["Error"]["Code"] == "NoSuchKey"
     key = bucket.Object("special_text/test_file.txt")
     assert key.get()
+
+
+def test_iter_chunks():
+    """Test chunks are regrouped to the requested size whatever the source yields."""
+    assert list(iter_chunks([b"a", b"bcdef", b"", b"gh"], 3)) == [b"abc", b"def", b"gh"]
+    assert list(iter_chunks(BytesIO(b"abcdefg"), 3)) == [b"abc", b"def", b"g"]
+    assert list(iter_chunks(BytesIO(), 3)) == []
+
+
+def test_upload_multipart(bucket, monkeypatch):
+    """Test streamed content bigger than a part goes through a multipart upload."""
+    monkeypatch.setattr("moto.s3.models.S3_UPLOAD_PART_MIN_SIZE", 1)
+    monkeypatch.setattr("efs.eatfirst_s3.MIN_PART_SIZE", 1)
+    bucket = bucket()
+    data = fake.binary(length=10 * 1024)
+
+    efs = EFS(storage="s3", part_size=1024)
+    assert efs.upload(TEST_FILE, BytesIO(data), content_type="application/pdf") == len(data)
+
+    obj = bucket.Object(TEST_FILE).get()
+    assert obj["Body"].read() == data
+    assert obj["ContentType"] == "application/pdf"
+    assert obj["ETag"].strip('"').endswith("-10")
+    assert "ContentType" not in efs.home.upload_args
+
+
+def test_upload_small_part_size(bucket):
+    """Test part sizes S3 would reject are raised to its minimum, instead of failing once every part is sent."""
+    bucket = bucket()
+    efs = EFS(storage="s3", part_size=1024, fast_upload=True)
+    calls = count_requests(efs)
+    assert efs.upload(TEST_FILE, BytesIO(b"x" * 6 * 1024)) == 6 * 1024
+    assert calls == ["PutObject"]
+    assert efs.multipart_ticket("videos/1.mp4", size=12 * 1024 * 1024, part_size=1024).part_size == 5 * 1024 * 1024
+
+
+def test_upload_multipart_aborts_on_failure(bucket, monkeypatch):
+    """Test a failing stream aborts the multipart upload instead of leaving orphan parts."""
+    monkeypatch.setattr("moto.s3.models.S3_UPLOAD_PART_MIN_SIZE", 1)
+    monkeypatch.setattr("efs.eatfirst_s3.MIN_PART_SIZE", 1)
+    bucket = bucket()
+
+    def broken_content():
+        yield b"x" * 2048
+        raise IOError("connection lost")
+
+    efs = EFS(storage="s3", part_size=1024)
+    with pytest.raises(IOError):
+        efs.upload(TEST_FILE, broken_content())
+
+    assert not list(bucket.multipart_uploads.all())
+
+
+def test_upload_parallel_parts(bucket, monkeypatch):
+    """Test parts are sent concurrently, read ahead is bounded and every part is reported."""
+    monkeypatch.setattr("moto.s3.models.S3_UPLOAD_PART_MIN_SIZE", 1)
+    monkeypatch.setattr("efs.eatfirst_s3.MIN_PART_SIZE", 1)
+    bucket = bucket()
+    reports = []
+    read_ahead = []
+
+    def content():
+        for number in range(20):
+            read_ahead.append(number + 1 - len(reports))
+            yield bytes([number]) * 1024
+
+    efs = EFS(storage="s3", part_size=1024, max_concurrency=4)
+    assert efs.upload(TEST_FILE, content(), on_part=reports.append) == 20 * 1024
+
+    assert bucket.Object(TEST_FILE).get()["Body"].read() == b"".join(bytes([number]) * 1024 for number in range(20))
+    assert sorted(report.number for report in reports) == list(range(1, 21))
+    assert all(report.size == 1024 and report.seconds >= 0 for report in reports)
+    assert max(read_ahead) <= 4 + 2
+
+
+def test_upload_parallel_parts_aborts_on_failure(bucket, monkeypatch):
+    """Test a part failing while others are in flight aborts the whole multipart upload."""
+    monkeypatch.setattr("moto.s3.models.S3_UPLOAD_PART_MIN_SIZE", 1)
+    monkeypatch.setattr("efs.eatfirst_s3.MIN_PART_SIZE", 1)
+    bucket = bucket()
+
+    def on_part(report):
+        if report.number == 3:
+            raise RuntimeError("part failed")
+
+    efs = EFS(storage="s3", part_size=1024, max_concurrency=3)
+    with pytest.raises(RuntimeError):
+        efs.upload(TEST_FILE, BytesIO(b"x" * 10 * 1024), on_part=on_part)
+
+    assert not list(bucket.multipart_uploads.all())
+
+
+def test_open_ranged(bucket):
+    """Test a ranged open only downloads the ranges that are read."""
+    bucket = bucket()
+    data = fake.binary(length=10 * 1024)
+    bucket.Object(TEST_FILE).put(Body=data)
+
+    efs = EFS(storage="s3", max_concurrency=2)
+    ranges = []
+    efs.home.client.meta.events.register(
+        "before-call.s3.GetObject", lambda params, **kwargs: ranges.append(params["headers"].get("Range"))
+    )
+    with efs.open(TEST_FILE, ranged=True, range_size=1024, read_ahead=0) as ranged_file:
+        assert ranged_file.read(10) == data[:10]
+        ranged_file.seek(5000)
+        assert ranged_file.read(100) == data[5000:5100]
+        ranged_file.seek(-24, 2)
+        assert ranged_file.read() == data[-24:]
+    assert ranges == ["bytes=0-1023", "bytes=4096-5119", "bytes=9216-10239"]
+
+    with efs.open(TEST_FILE, ranged=True, range_size=1000, read_ahead=3) as ranged_file:
+        assert ranged_file.read() == data
+
+
+def test_remove_many(bucket, monkeypatch):
+    """Test batch removals are grouped in DeleteObjects requests."""
+    monkeypatch.setattr("efs.eatfirst_s3.MAX_DELETE_KEYS", 2)
+    bucket = bucket()
+    for number in range(5):
+        bucket.Object("batch/{}.txt".format(number)).put(Body=b"x")
+    bucket.Object("kept.txt").put(Body=b"x")
+
+    efs = EFS(storage="s3")
+    requests = []
+    efs.home.client.meta.events.register("before-call.s3.DeleteObjects", lambda **kwargs: requests.append(1))
+    results = efs.remove_many(["batch/{}.txt".format(number) for number in range(5)] + ["batch/0.txt"])
+
+    assert [result.path for result in results] == ["batch/{}.txt".format(number) for number in range(5)] + [
+        "batch/0.txt"
+    ]
+    assert all(result.ok for result in results)
+    assert len(requests) == 3
+    assert [obj.key for obj in bucket.objects.all()] == ["kept.txt"]
+
+
+def count_requests(efs):
+    """Return a list collecting the name of every S3 API call made by ``efs``."""
+    calls = []
+    efs.home.client.meta.events.register("before-call.s3", lambda model, **kwargs: calls.append(model.name))
+    return calls
+
+
+def test_fast_upload(bucket):
+    """Test a fast upload writes the object with a single request and no directory markers."""
+    bucket = bucket()
+
+    efs = EFS(storage="s3")
+    calls = count_requests(efs)
+    efs.upload("very/long/path/" + TEST_FILE, b"slow")
+    assert len(calls) > 1
+
+    efs = EFS(storage="s3", fast_upload=True)
+    calls = count_requests(efs)
+    efs.upload("other/long/path/" + TEST_FILE, b"fast", content_type="text/csv")
+    assert calls == ["PutObject"]
+
+    obj = bucket.Object("other/long/path/" + TEST_FILE).get()
+    assert obj["Body"].read() == b"fast"
+    assert obj["ContentType"] == "text/csv"
+    assert not [obj.key for obj in bucket.objects.filter(Prefix="other/") if obj.key.endswith("/")]
+
+
+def test_clients_are_pooled(bucket):
+    """Test filesystems with the same settings share one client, whatever the thread."""
+    bucket()
+
+    efs = EFS(storage="s3")
+    other = EFS(storage="s3")
+    assert efs.home.client is other.home.client
+    assert efs.home.s3.meta.client is efs.home.client
+    assert efs.home.client.meta.config.max_pool_connections == pool.DEFAULT_MAX_POOL_CONNECTIONS
+
+    results = efs.upload_many([("{}.txt".format(number), b"x") for number in range(4)], max_workers=4)
+    assert all(result.ok for result in results)
+    assert efs.home.client is other.home.client
+
+    bigger = EFS(storage="s3", max_pool_connections=100)
+    assert bigger.home.client is not efs.home.client
+    assert bigger.home.client.meta.config.max_pool_connections == 100
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="requires os.fork")
+def test_pool_is_reset_after_fork(bucket):
+    """Test forked children do not inherit the parent's clients."""
+    bucket()
+    client = EFS(storage="s3").home.client
+
+    child = os.fork()
+    if not child:
+        os._exit(0 if EFS(storage="s3").home.client is not client else 1)
+    _, status = os.waitpid(child, 0)
+    assert os.WEXITSTATUS(status) == 0
+
+
+def test_metadata_cache(bucket):
+    """Test cached existence checks do not hit S3 again and uploads update them."""
+    bucket = bucket()
+    bucket.Object(TEST_FILE).put(Body=b"data")
+
+    efs = EFS(storage="s3", metadata_cache=MetadataCache())
+    calls = count_requests(efs)
+    assert efs.open(TEST_FILE).read() == b"data"
+    first = calls.count("HeadObject")
+    calls.clear()
+    assert efs.open(TEST_FILE).read() == b"data"
+    # Both the existence and the attributes of the file are cached
+    assert calls.count("HeadObject") == first - 2
+    assert efs.metadata_cache.stats["hits"] == 2
+
+    efs.remove_many([TEST_FILE])
+    assert not efs.exists(TEST_FILE)
+    efs.upload(TEST_FILE, b"new", fast=True)
+    calls.clear()
+    assert efs.exists(TEST_FILE)
+    assert not calls
+
+
+def test_disk_cache(bucket, tmpdir):
+    """Test opened files are downloaded once, revalidated by ETag and invalidated by writes."""
+    bucket = bucket()
+    bucket.Object(TEST_FILE).put(Body=b"first")
+
+    efs = EFS(storage="s3", disk_cache=DiskCache(str(tmpdir)))
+    with efs.open(TEST_FILE) as cached_file:
+        assert cached_file.read() == b"first"
+    with efs.open(TEST_FILE) as cached_file:
+        assert cached_file.read() == b"first"
+    assert efs.disk_cache.stats == {"hits": 1, "misses": 1}
+
+    bucket.Object(TEST_FILE).put(Body=b"changed elsewhere")
+    with efs.open(TEST_FILE) as cached_file:
+        assert cached_file.read() == b"changed elsewhere"
+    assert efs.disk_cache.stats == {"hits": 1, "misses": 2}
+
+    efs.upload(TEST_FILE, b"uploaded", fast=True)
+    assert not tmpdir.join(TEST_FILE + "~").exists()
+    with efs.open(TEST_FILE) as cached_file:
+        assert cached_file.read() == b"uploaded"
+
+    efs.remove(TEST_FILE)
+    assert not tmpdir.join(TEST_FILE + "~").exists()
+
+
+def test_disk_cache_concurrent_opens(bucket, tmpdir):
+    """Test threads opening the same file at once download it only once."""
+    bucket = bucket()
+    bucket.Object(TEST_FILE).put(Body=b"shared")
+    efs = EFS(storage="s3", disk_cache=DiskCache(str(tmpdir)))
+
+    def read(_):
+        with efs.open(TEST_FILE) as cached_file:
+            return cached_file.read()
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        assert set(executor.map(read, range(16))) == {b"shared"}
+    assert efs.disk_cache.stats == {"hits": 15, "misses": 1}
+    assert efs.disk_cache._locks == {}
+
+
+def test_disk_cache_eviction(bucket, tmpdir):
+    """Test the least recently opened files are evicted once the cache is full."""
+    bucket = bucket()
+    for name in "abc":
+        bucket.Object(name).put(Body=b"x" * 100)
+
+    efs = EFS(storage="s3", disk_cache=DiskCache(str(tmpdir), max_size=250))
+    for name in "abac":
+        efs.open(name).close()
+
+    cached = {name for name in "abc" if tmpdir.join(name + "~").exists() and tmpdir.join(name + "~").listdir()}
+    assert cached == {"a", "c"}
+
+
+def legacy_file_url(efs, path, cdn_host=None):
+    """Build a file url the way EFS.file_url did before urls were precomputed."""
+    url = efs.home.geturl(path)
+    if cdn_host:
+        url = url.replace(urllib.parse.urlparse(url).hostname, cdn_host)
+    return url.split("?")[0].replace("http://", "https://")
+
+
+def test_file_url(app, bucket, monkeypatch):
+    """Test public urls match the signed ones stripped of their query string, without signing each of them."""
+    bucket()
+    paths = [TEST_FILE, "a b/ü.png", "x+y&z.txt", "/leading/slash.txt", "folder/"]
+
+    efs = EFS(storage="s3", dir_path="/root/dir")
+    expected = [legacy_file_url(efs, path) for path in paths]
+    signed = []
+    generate_presigned_url = efs.home.client.generate_presigned_url
+    monkeypatch.setattr(
+        efs.home.client, "generate_presigned_url", lambda **kwargs: signed.append(1) or generate_presigned_url(**kwargs)
+    )
+    assert [efs.file_url(path) for path in paths] == expected
+    assert efs.file_urls(paths) == expected
+    assert len(signed) == 1
+
+    app.config["S3_CDN_URL"] = "cdn.example.com"
+    assert efs.file_urls(paths) == [legacy_file_url(efs, path, "cdn.example.com") for path in paths]
+    assert efs.file_url(TEST_FILE, with_cdn=False) == expected[0]
+
+
+def test_move_is_server_side(bucket):
+    """Test moves copy inside S3, keep the object public and create no directory markers."""
+    bucket = bucket()
+    efs = EFS(storage="s3", fast_upload=True)
+    efs.upload(TEST_FILE, b"moved", content_type="text/csv")
+
+    calls = count_requests(efs)
+    efs.move(TEST_FILE, "special_text/deep/test_file.txt")
+    assert "CopyObject" in calls
+    assert "GetObject" not in calls
+    assert "PutObject" not in calls
+
+    obj = bucket.Object("special_text/deep/test_file.txt")
+    assert obj.get()["Body"].read() == b"moved"
+    assert obj.content_type == "text/csv"
+    assert any(grant["Grantee"].get("URI", "").endswith("AllUsers") for grant in obj.Acl().grants)
+    assert [obj.key for obj in bucket.objects.all()] == ["special_text/deep/test_file.txt"]
+
+
+def test_rename_does_not_overwrite(bucket):
+    """Test renaming onto an existing file fails and keeps both files."""
+    bucket = bucket()
+    bucket.Object("a.txt").put(Body=b"a")
+    bucket.Object("b.txt").put(Body=b"b")
+
+    efs = EFS(storage="s3")
+    with pytest.raises(DestinationExists):
+        efs.rename("a.txt", "b.txt")
+    assert bucket.Object("b.txt").get()["Body"].read() == b"b"
+
+
+def test_move_large_object_in_parts(bucket, monkeypatch):
+    """Test objects over the CopyObject limit are copied with parallel UploadPartCopy requests."""
+    monkeypatch.setattr("moto.s3.models.S3_UPLOAD_PART_MIN_SIZE", 1)
+    monkeypatch.setattr("efs.eatfirst_s3.MAX_COPY_SIZE", 1024)
+    monkeypatch.setattr("efs.eatfirst_s3.DEFAULT_COPY_PART_SIZE", 1000)
+    bucket = bucket()
+    data = fake.binary(length=4500)
+    bucket.Object(TEST_FILE).put(Body=data, ContentType="application/pdf", Metadata={"owner": "eatfirst"})
+
+    efs = EFS(storage="s3", max_concurrency=3)
+    calls = count_requests(efs)
+    efs.move(TEST_FILE, "big/" + TEST_FILE)
+
+    assert calls.count("UploadPartCopy") == 5
+    assert "CopyObject" not in calls
+    obj = bucket.Object("big/" + TEST_FILE)
+    assert obj.get()["Body"].read() == data
+    assert obj.content_type == "application/pdf"
+    assert obj.metadata == {"owner": "eatfirst"}
+    assert [obj.key for obj in bucket.objects.all()] == ["big/" + TEST_FILE]
+
+
+def test_move_folder(bucket):
+    """Test moving a folder moves every object under it."""
+    bucket = bucket()
+    efs = EFS(storage="s3", batch_workers=4)
+    efs.upload("reports/2018/" + TEST_FILE, b"nested")
+    for number in range(5):
+        bucket.Object("reports/{}.csv".format(number)).put(Body=str(number).encode())
+
+    efs.move("reports", "archive/reports")
+
+    assert not list(bucket.objects.filter(Prefix="reports/"))
+    assert bucket.Object("archive/reports/2018/" + TEST_FILE).get()["Body"].read() == b"nested"
+    assert bucket.Object("archive/reports/3.csv").get()["Body"].read() == b"3"
+
+
+def test_remove_folder_in_batches(bucket, monkeypatch):
+    """Test removing a folder deletes pages of keys with DeleteObjects, reporting progress, and can count first."""
+    monkeypatch.setattr("efs.eatfirst_s3.MAX_DELETE_KEYS", 10)
+    bucket = bucket()
+    efs = EFS(storage="s3", fast_upload=True, batch_workers=3)
+    efs.upload_many(("exports/{}/{}.csv".format(number % 4, number), b"x") for number in range(45))
+    bucket.Object("exports.csv").put(Body=b"kept")
+
+    assert efs.remove("exports", dry_run=True) == 45
+    assert len(list(bucket.objects.all())) == 46
+
+    calls = count_requests(efs)
+    progress = []
+    assert efs.remove("exports", on_progress=progress.append) == 45
+    assert calls.count("DeleteObjects") == 5
+    assert "DeleteObject" not in calls
+    assert progress[-1] == 45 and progress == sorted(progress)
+    assert [obj.key for obj in bucket.objects.all()] == ["exports.csv"]
+    assert efs.remove("exports", dry_run=True) == 0
+
+
+def test_iter_files(bucket, monkeypatch):
+    """Test files are listed flat, lazily, one page at a time, without the directory markers."""
+    monkeypatch.setattr("efs.eatfirst_s3.MAX_LIST_KEYS", 10)
+    bucket = bucket()
+    efs = EFS(storage="s3", fast_upload=True)
+    efs.upload_many(("logs/{}/{:02}.log".format(number % 3, number), b"x" * number) for number in range(25))
+    efs.upload("logs/top.log", b"top", fast=False)
+    efs.upload("logsbook.txt", b"not in logs")
+
+    calls = count_requests(efs)
+    entries = efs.iter_files("logs")
+    first = next(entries)
+    assert calls == ["ListObjectsV2"]
+    assert first.path == "logs/0/00.log"
+    assert first.etag == bucket.Object("logs/0/00.log").e_tag.strip('"')
+    entries = [first] + list(entries)
+    assert calls.count("ListObjectsV2") == 3
+    assert len(entries) == 26
+    assert {entry.path: entry.size for entry in entries}["logs/2/23.log"] == 23
+    assert all(entry.mtime.tzinfo for entry in entries)
+
+    assert [entry.path for entry in efs.iter_files("logs", recursive=False)] == ["logs/top.log"]
+    assert list(efs.iter_files("missing")) == []
+
+
+def test_dedup(bucket):
+    """Test identical files are uploaded once and the content is removed with the last path pointing to it."""
+    bucket = bucket()
+    efs = EFS(storage="s3", dedup=True, fast_upload=True)
+    logo = fake.binary(4096)
+
+    calls = count_requests(efs)
+    assert efs.upload("brands/a/logo.png", logo) == 4096
+    assert efs.upload("brands/b/logo.png", BytesIO(logo)) == 4096
+    assert calls.count("PutObject") == 5  # The blob, two references and two pointers
+    blobs = [obj for obj in bucket.objects.filter(Prefix=".blobs/") if ".refs/" not in obj.key]
+    assert len(blobs) == 1 and blobs[0].key.endswith(".png") and blobs[0].size == 4096
+
+    assert efs.open("brands/b/logo.png").read() == logo
+    assert efs.open("brands/b/logo.png", ranged=True).read() == logo
+    assert efs.file_url("brands/a/logo.png").endswith("/" + blobs[0].key)
+    assert efs.file_urls(["brands/a/logo.png", "brands/b/logo.png"]) == [efs.file_url("brands/a/logo.png")] * 2
+
+    efs.move("brands/a/logo.png", "brands/c/logo.png")
+    assert efs.open("brands/c/logo.png").read() == logo
+    efs.remove("brands/b/logo.png")
+    assert efs.open("brands/c/logo.png").read() == logo
+    efs.upload("brands/c/logo.png", b"new logo")
+    assert efs.open("brands/c/logo.png").read() == b"new logo"
+    assert not efs.home.exists(blobs[0].key)
+
+    efs.remove("brands")
+    assert list(bucket.objects.all()) == []
+
+
+def test_compression(bucket):
+    """Test text files are stored compressed with their content encoding and read back decompressed."""
+    bucket = bucket()
+    efs = EFS(storage="s3", compression=CompressionPolicy(), part_size=5 * 1024 * 1024)
+    rows = "".join("{},customer {},{}\n".format(number, number % 97, fake.city()) for number in range(500)).encode()
+
+    size = efs.upload("exports/users.csv", iter_chunks(rows, 1024))
+    assert size < len(rows) / 2
+    obj = bucket.Object("exports/users.csv").get()
+    assert obj["ContentEncoding"] == "gzip"
+    assert obj["ContentType"] == "text/csv"
+    assert gzip.decompress(obj["Body"].read()) == rows
+    assert efs.open("exports/users.csv").read() == rows
+    assert efs.open("exports/users.csv", ranged=True, range_size=4096).read() == rows
+
+    efs.upload("exports/data", b'{"a": 1}', content_type="application/json")
+    assert bucket.Object("exports/data").content_encoding == "gzip"
+    efs.upload("exports/image.png", b"png")
+    assert bucket.Object("exports/image.png").content_encoding is None
+    assert efs.open("exports/image.png").read() == b"png"
+    assert "ContentEncoding" not in (efs.home.upload_args or {})
+
+
+def test_zstd_compression(bucket):
+    """Test files can be compressed with zstd when zstandard is installed."""
+    zstandard = pytest.importorskip("zstandard")
+    bucket = bucket()
+    efs = EFS(storage="s3", compression=CompressionPolicy("zstd"), fast_upload=True)
+    content = b'{"key": "value"}\n' * 1000
+
+    efs.upload("data.json", content)
+    obj = bucket.Object("data.json").get()
+    assert obj["ContentEncoding"] == "zstd"
+    assert zstandard.ZstdDecompressor().decompressobj().decompress(obj["Body"].read()) == content
+    assert efs.open("data.json").read() == content
+
+
+def test_concurrent_upload_options(bucket):
+    """Test a shared filesystem hammered from many threads stores every file with its own upload options."""
+    bucket = bucket()
+    efs = EFS(storage="s3", part_size=5 * 1024 * 1024)
+    content_types = ["text/plain", "text/csv", "application/json", "image/png", None]
+    storage_classes = ["STANDARD", "STANDARD_IA", "REDUCED_REDUNDANCY"]
+
+    def options(number):
+        return {
+            "content_type": content_types[number % 5],
+            "cache_control": "max-age={}".format(number),
+            "metadata": {"number": str(number)},
+            "storage_class": storage_classes[number % 3],
+            "fast": number % 2 == 0,
+        }
+
+    def upload(number):
+        content = str(number).encode() * 100
+        if number % 4 == 1:
+            content = BytesIO(content)
+        elif number % 40 == 3:
+            content = iter_chunks(content * 60000, 1024 * 1024)
+        return efs.upload("stress/{}.bin".format(number), content, **options(number))
+
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        list(executor.map(upload, range(120)))
+
+    assert not efs.home.upload_args or set(efs.home.upload_args) == {"ACL"}
+    for number in range(120):
+        obj = bucket.Object("stress/{}.bin".format(number))
+        expected = options(number)
+        assert obj.content_type == (expected["content_type"] or "application/octet-stream")
+        assert obj.cache_control == expected["cache_control"]
+        assert obj.metadata == expected["metadata"]
+        assert (obj.storage_class or "STANDARD") == expected["storage_class"]
+        assert obj.content_length == 100 * len(str(number)) * (60000 if number % 40 == 3 else 1)
+
+
+def test_upload_buffers_and_local_files(bucket, tmp_path):
+    """Test buffers are sent in place, part by part, and local files can be uploaded from their path."""
+    bucket = bucket()
+    efs = EFS(storage="s3", part_size=5 * 1024 * 1024, max_concurrency=2, fast_upload=True)
+    content = bytearray(os.urandom(11 * 1024 * 1024))
+    chunks = list(iter_chunks(content, 5 * 1024 * 1024))
+    assert all(isinstance(chunk, memoryview) for chunk in chunks)
+    assert chunks[0].obj is content
+
+    assert efs.upload("buffers/bytearray.bin", content) == len(content)
+    assert efs.upload("buffers/memoryview.bin", memoryview(content)[:1024]) == 1024
+    source = tmp_path / "source.bin"
+    source.write_bytes(content)
+    with open(source, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        assert efs.upload("buffers/mmap.bin", mapped) == len(content)
+    assert efs.upload("files/path.bin", source) == len(content)
+
+    for key, expected in (("buffers/bytearray.bin", content), ("buffers/memoryview.bin", content[:1024]),
+                          ("buffers/mmap.bin", content), ("files/path.bin", content)):
+        assert bucket.Object(key).get()["Body"].read() == expected, key
+
+
+def test_sync(bucket, tmp_path):
+    """Test a local folder is mirrored to S3 and back, then only changed files are copied."""
+    bucket = bucket()
+    efs = EFS(storage="s3", fast_upload=True, part_size=5 * 1024 * 1024, compression=CompressionPolicy())
+    local = EFS(config={"LOCAL_STORAGE": str(tmp_path / "local")}, fast_upload=True)
+    big = os.urandom(6 * 1024 * 1024)
+    local.upload_many([("exports/big.bin", big), ("exports/2018/orders.csv", b"id\n1\n")])
+
+    result = local.sync("exports", efs, "backup/exports")
+    assert sorted(result.copied) == ["2018/orders.csv", "big.bin"]
+    assert bucket.Object("backup/exports/big.bin").get()["Body"].read() == big
+    assert bucket.Object("backup/exports/big.bin").e_tag.endswith('-2"')
+
+    # Compressed files are copied as stored, with their encoding
+    efs.upload("backup/exports/2018/orders.csv", "id\n1\n2\n")
+    restored = EFS(config={"LOCAL_STORAGE": str(tmp_path / "restored")}, compression=CompressionPolicy())
+    result = efs.sync("backup", restored)
+    assert sorted(result.copied) == ["exports/2018/orders.csv", "exports/big.bin"]
+    with restored.open("backup/exports/2018/orders.csv") as file:
+        assert file.read() == b"id\n1\n2\n"
+    copy = EFS(storage="s3", compression=CompressionPolicy())
+    restored.sync("backup", copy, "copy")
+    assert bucket.Object("copy/exports/2018/orders.csv").content_encoding == "gzip"
+
+    calls = count_requests(efs)
+    assert efs.sync("backup", restored) == ([], [], 2, [])
+    assert calls == ["ListObjectsV2"]
+    assert local.sync("exports", efs, "backup/exports").copied == ["2018/orders.csv"]
+
+
+def test_sync_between_buckets(bucket, app, monkeypatch):
+    """Test files are copied inside S3 between buckets, with their headers and metadata."""
+    bucket = bucket()
+    efs = EFS(storage="s3", compression=CompressionPolicy())
+    efs.upload("exports/orders.csv", "id\n1\n", cache_control="max-age=60", metadata={"owner": "42"})
+    boto3.resource("s3").Bucket("mirror").create()
+    mirror = EFS(storage="s3", config=dict(app.config, S3_BUCKET="mirror"), compression=CompressionPolicy())
+
+    calls = count_requests(mirror)
+    assert efs.sync("exports", mirror).copied == ["orders.csv"]
+    assert "CopyObject" in calls and "PutObject" not in calls
+    copied = boto3.resource("s3").Object("mirror", "exports/orders.csv")
+    assert (copied.cache_control, copied.content_type, copied.content_encoding) == ("max-age=60", "text/csv", "gzip")
+    assert copied.metadata == {"owner": "42"}
+    assert mirror.open("exports/orders.csv").read() == b"id\n1\n"
+
+    # Buckets of other endpoints are streamed to, the headers and metadata are sent with the upload
+    monkeypatch.setattr(mirror.home, "copies_from", lambda source: False)
+    assert efs.sync("exports", mirror, "streamed").copied == ["orders.csv"]
+    streamed = boto3.resource("s3").Object("mirror", "streamed/orders.csv")
+    assert (streamed.cache_control, streamed.content_type, streamed.content_encoding) == ("max-age=60", "text/csv", "gzip")
+    assert streamed.metadata == {"owner": "42"}
+
+
+def test_tickets(bucket):
+    """Test presigned tickets upload and download straight from S3 and completing them reports the files."""
+    bucket = bucket()
+    uploaded = []
+    efs = EFS(storage="s3", on_direct_upload=uploaded.append)
+
+    ticket = efs.upload_ticket("avatars/1.png", content_type="image/png", cache_control="max-age=60")
+    assert ticket.headers == {"x-amz-acl": "public-read", "Content-Type": "image/png", "Cache-Control": "max-age=60"}
+    requests.put(ticket.url, data=b"png", headers=ticket.headers).raise_for_status()
+    entry = efs.complete_upload("avatars/1.png")
+    assert (entry.path, entry.size) == ("avatars/1.png", 3)
+    assert entry.etag == bucket.Object("avatars/1.png").e_tag.strip('"')
+    assert uploaded == [entry]
+    assert bucket.Object("avatars/1.png").content_type == "image/png"
+
+    # Only the filesystem marks pointers, clients can not forge one
+    ticket = efs.upload_ticket("avatars/3.png", metadata={"efs-pointer": "true", "owner": "42"})
+    assert "x-amz-meta-efs-pointer" not in ticket.headers
+    requests.put(ticket.url, data=b"png", headers=dict(ticket.headers, **{"x-amz-meta-efs-pointer": "true"}))
+    with pytest.raises(PermissionError):
+        efs.complete_upload("avatars/3.png")
+    assert not efs.exists("avatars/3.png")
+    with pytest.raises(PermissionError):
+        efs.upload_ticket(".blobs/00/forged.png")
+
+    ticket = efs.upload_ticket("avatars/2.png", max_size=10, post=True)
+    assert ["content-length-range", 0, 10] in json.loads(base64.b64decode(ticket.fields["policy"]))["conditions"]
+    response = requests.post(ticket.url, data=ticket.fields, files={"file": b"form"})
+    assert response.status_code < 300
+    assert efs.open("avatars/2.png").read() == b"form"
+
+    part = 5 * 1024 * 1024
+    ticket = efs.multipart_ticket("videos/1.mp4", size=part + 10, part_size=part)
+    assert len(ticket.urls) == 2
+    etags = [
+        requests.put(url, data=data).headers["ETag"] for url, data in zip(ticket.urls, (b"a" * part, b"b" * 10))
+    ]
+    assert not efs.exists("videos/1.mp4")
+    assert efs.complete_upload("videos/1.mp4", ticket.upload_id, etags).size == part + 10
+    assert efs.open("videos/1.mp4").read()[-11:] == b"a" + b"b" * 10
+
+    ticket = efs.multipart_ticket("videos/2.mp4", size=1)
+    efs.abort_upload("videos/2.mp4", ticket.upload_id)
+    assert not list(bucket.multipart_uploads.all())
+    with pytest.raises(ResourceNotFound):
+        efs.complete_upload("videos/2.mp4")
+
+    ticket = efs.download_ticket("videos/1.mp4", filename="intro.mp4")
+    assert len(requests.get(ticket.url).content) == part + 10
+    query = urllib.parse.parse_qs(urllib.parse.urlparse(ticket.url).query)
+    assert query["response-content-disposition"] == ["attachment; filename*=UTF-8''intro.mp4"]
+
+
+def test_write_behind(bucket, tmp_path, monkeypatch):
+    """Test spooled uploads return at once, are read from the spool and are sent in order with retries."""
+    bucket = bucket()
+    released = threading.Event()
+    calls = []
+    upload_stream = EatFirstS3.upload_stream
+
+    def slow_upload_stream(self, path, content, *args, **kwargs):
+        released.wait(5)
+        calls.append(path)
+        if len(calls) == 1:
+            raise ConnectionError("connection lost")
+        return upload_stream(self, path, content, *args, **kwargs)
+
+    monkeypatch.setattr(EatFirstS3, "upload_stream", slow_upload_stream)
+    spool = WriteBehind(str(tmp_path), retry_delay=0)
+    efs = EFS(storage="s3", write_behind=spool)
+
+    assert efs.upload("notes/a.txt", b"one", content_type="text/plain") == 3
+    assert efs.upload("notes/a.txt", b"two") == 3
+    assert efs.upload("notes/a.txt", "three") == 5
+    assert efs.exists("notes/a.txt")
+    assert efs.open("notes/a.txt").read() == b"three"
+    assert spool.pending == 2
+    assert efs.isdir("notes") and not efs.isdir("notes/a.txt")
+    assert [(entry.path, entry.size) for entry in efs.iter_files("notes")] == [("notes/a.txt", 5)]
+    assert [entry.path for entry in efs.iter_files(recursive=False)] == []
+
+    released.set()
+    assert spool.close(timeout=5)
+    # The first upload was retried, the second one dropped for the third one
+    assert calls == ["notes/a.txt"] * 3
+    assert bucket.Object("notes/a.txt").get()["Body"].read() == b"three"
+    assert os.listdir(str(tmp_path)) == [JOURNAL_NAME]
+
+
+def test_write_behind_replays_journal(bucket, tmp_path, monkeypatch):
+    """Test uploads given up or cut by a crash are sent again when the next filesystem starts."""
+    bucket = bucket()
+    failures = []
+    upload_stream = EatFirstS3.upload_stream
+
+    def failing_upload_stream(self, path, content, *args, **kwargs):
+        raise ConnectionError("connection lost")
+
+    monkeypatch.setattr(EatFirstS3, "upload_stream", failing_upload_stream)
+    spool = WriteBehind(str(tmp_path), max_retries=1, retry_delay=0, on_failure=failures.append)
+    efs = EFS(storage="s3", write_behind=spool)
+    efs.upload("report.csv", BytesIO(b"a,b\n"), content_type="text/csv")
+    assert spool.close(timeout=5)
+    assert [(failure.path, type(failure.error)) for failure in failures] == [("report.csv", ConnectionError)]
+    assert efs.open("report.csv").read() == b"a,b\n"
+    with open(os.path.join(str(tmp_path), JOURNAL_NAME), "a") as journal:
+        journal.write('["put", "0123')
+
+    monkeypatch.setattr(EatFirstS3, "upload_stream", upload_stream)
+    spool = WriteBehind(str(tmp_path))
+    efs = EFS(storage="s3", write_behind=spool)
+    assert spool.close(timeout=5)
+    obj = bucket.Object("report.csv").get()
+    assert obj["Body"].read() == b"a,b\n"
+    assert obj["ContentType"] == "text/csv"
+    assert os.listdir(str(tmp_path)) == [JOURNAL_NAME]